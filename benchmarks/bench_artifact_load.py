@@ -0,0 +1,84 @@
+"""
+Start-up time and per-worker memory for pickle vs memory-mapped artifacts.
+
+For each artifact and worker count, starts that many processes at once.
+Each one loads the model through load_model, scores one patient (so the
+pages it needs are resident), and reports its load time, RSS and PSS. PSS
+is proportional set size: shared pages are split across the processes that
+map them, so it shows the real per-worker cost. Processes wait at a barrier
+until all have measured, so their mappings overlap. Linux only, since it
+reads /proc/self/status and /proc/self/smaps_rollup.
+
+Usage:
+    python -m model.artifact heart_model_ensemble.pkl heart_model_ensemble.mmap
+    python benchmarks/bench_artifact_load.py heart_model_ensemble.pkl heart_model_ensemble.mmap
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _proc_kb(path, field):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _worker(model_path, patient, barrier, results):
+    from model.load_model import load_model
+    from model.predict import predict_heart_disease
+
+    rss_before = _proc_kb('/proc/self/status', 'VmRSS')
+    start = time.perf_counter()
+    model_components = load_model(model_path, compile_trees=True)
+    load_seconds = time.perf_counter() - start
+    predict_heart_disease(patient, model_components)
+
+    barrier.wait()
+    results.put({
+        'load_seconds': load_seconds,
+        'rss_mb': _proc_kb('/proc/self/status', 'VmRSS') / 1024,
+        'model_rss_mb': (_proc_kb('/proc/self/status', 'VmRSS') - rss_before) / 1024,
+        'pss_mb': _proc_kb('/proc/self/smaps_rollup', 'Pss') / 1024
+    })
+    barrier.wait()
+
+
+def measure(model_path, workers, patient):
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(model_path, patient, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in range(workers)]
+    for process in processes:
+        process.join()
+    return {key: sum(sample[key] for sample in samples) / workers for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('artifacts', nargs='+', help='Model artifacts (pickle files or mmap directories)')
+    parser.add_argument('--workers', default='1,4,8', help='Comma-separated worker counts')
+    args = parser.parse_args()
+
+    patient = {'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1, 'restecg': 0,
+               'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0, 'ca': 0, 'thal': 1}
+
+    print(f"{'artifact':<36} {'workers':>7} {'load s':>8} {'RSS MB':>8} {'model MB':>9} {'PSS MB':>8}")
+    for model_path in args.artifacts:
+        for workers in [int(w) for w in args.workers.split(',')]:
+            stats = measure(model_path, workers, patient)
+            print(f"{os.path.basename(model_path.rstrip('/')):<36} {workers:>7} {stats['load_seconds']:>8.3f} "
+                  f"{stats['rss_mb']:>8.1f} {stats['model_rss_mb']:>9.1f} {stats['pss_mb']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Additivity check and per-request cost of the tree attribution engine.
+
+Computes the attributions of every row of heart.csv and checks that, added
+to the base probability, they reproduce the ensemble probability of the
+tree engine (and, per model, its raw score). Then times attribution of
+batches of synthetic patients, and a full single-patient prediction with
+and without attributions. Exits non-zero if any difference exceeds
+--tolerance.
+
+Usage:
+    python benchmarks/bench_attribution.py --model heart_model_ensemble.pkl
+    python benchmarks/bench_attribution.py --batch-sizes 1,8,64,512
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.patients import synthetic_patients
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+
+
+def median_ms(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to check additivity on')
+    parser.add_argument('--tolerance', type=float, default=1e-5, help='Maximum allowed probability difference')
+    parser.add_argument('--batch-sizes', default='1,8,64,256', help='Comma-separated batch sizes to time')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed calls per measurement')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model_components = load_model(args.model, compile_trees=True)
+    print(f"Load + compile: {time.perf_counter() - start:.2f}s")
+    attribution = model_components.get('tree_attribution')
+    if attribution is None:
+        sys.exit("The model artifact carries no attribution engine; re-export it with model/artifact.py")
+    engine = model_components['tree_engine']['ensemble']
+    schema = model_components['feature_schema']
+    print(f"{len(attribution.leaf_value)} leaf paths, up to {attribution.path_feature.shape[0]} features long")
+
+    scaled = schema.scale(pd.read_csv(args.data)[schema.features].to_numpy(dtype=np.float64))
+    phi, base = attribution.attributions(scaled)
+    ensemble_diff = np.abs(base + phi.sum(axis=1) - engine.predict_proba(scaled)[:, 0]).max()
+
+    raw = attribution.member_expected + attribution.member_attributions(scaled).sum(axis=2)
+    member_proba = np.where(attribution.member_sigmoid.astype(bool), 1.0 / (1.0 + np.exp(-raw)), raw)
+    member_diff = np.abs(member_proba - engine.member_proba(scaled)).max()
+    print(f"Additivity over {len(scaled)} rows (max |base + sum(attributions) - probability|):")
+    print(f"  ensemble   {ensemble_diff:.2e}")
+    print(f"  members    {member_diff:.2e}")
+
+    patients = synthetic_patients(args.data, max(int(size) for size in args.batch_sizes.split(',')), seed=0)
+    rows = schema.scale(schema.to_array(patients))
+    print(f"{'batch':>6} {'ms/call':>9} {'ms/row':>8}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        repeats = max(args.repeats * 8 // batch_size, 3)
+        elapsed = median_ms(lambda: attribution.attributions(rows[:batch_size]), repeats)
+        print(f"{batch_size:>6} {elapsed:>9.2f} {elapsed / batch_size:>8.2f}")
+
+    with_ms = median_ms(lambda: predict_heart_disease_batch(patients[:1], model_components), args.repeats)
+    without_ms = median_ms(lambda: predict_heart_disease_batch(patients[:1], model_components,
+                                                              include_attributions=False), args.repeats)
+    print(f"Single-patient prediction: {without_ms:.2f} ms without attributions, {with_ms:.2f} ms with "
+          f"(+{with_ms - without_ms:.2f} ms)")
+
+    if max(ensemble_diff, member_diff) > args.tolerance:
+        sys.exit("Additivity check failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Throughput benchmark for batch scoring.
+
+Compares scoring patients one at a time through predict_heart_disease with
+scoring them together through predict_heart_disease_batch, for batches
+sampled from heart.csv.
+
+Usage:
+    python benchmarks/bench_batch.py --model heart_model_ensemble.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+from model.predict import predict_heart_disease, predict_heart_disease_batch
+
+
+def sample_patients(data_path, n_rows, seed=0):
+    """Sample n_rows patients (with replacement) from the training CSV"""
+    df = pd.read_csv(data_path).drop(columns=['target'])
+    return df.sample(n=n_rows, replace=True, random_state=seed).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to sample patients from')
+    parser.add_argument('--sizes', default='1,100,10000', help='Comma-separated batch sizes')
+    parser.add_argument('--max-loop-rows', type=int, default=100,
+                        help='Cap on rows scored one at a time (the per-row rate is extrapolated)')
+    args = parser.parse_args()
+
+    model_components = load_model(args.model)
+    predict_heart_disease_batch(sample_patients(args.data, 2), model_components)  # warm up
+
+    print(f"{'rows':>8} {'loop rows/s':>12} {'batch rows/s':>13} {'batch s':>9} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        patients = sample_patients(args.data, size)
+
+        loop_rows = min(size, args.max_loop_rows)
+        records = patients.iloc[:loop_rows].to_dict(orient='records')
+        start = time.perf_counter()
+        for record in records:
+            predict_heart_disease(record, model_components)
+        loop_rate = loop_rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        predict_heart_disease_batch(patients, model_components)
+        batch_seconds = time.perf_counter() - start
+        batch_rate = size / batch_seconds
+
+        print(f"{size:>8} {loop_rate:>12.1f} {batch_rate:>13.1f} {batch_seconds:>9.3f} {batch_rate / loop_rate:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
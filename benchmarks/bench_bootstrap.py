@@ -0,0 +1,134 @@
+"""
+Statistical equivalence of the vectorized bootstrap uncertainty.
+
+predict_heart_disease used to perturb the patient with fresh global
+np.random noise in a loop of 50 bootstrap samples, scoring each noisy copy
+with four predict_proba calls. reference_uncertainty keeps that loop
+verbatim. For a few heart.csv rows, both are run --repeats times with
+independent noise: the reference after np.random.seed(repeat), the current
+path with random_state=repeat. The uncertainty percents of each row must
+have the same mean (Welch's t-test) and spread (Levene's test) at
+--alpha, Bonferroni-corrected over rows and tests; the script exits
+non-zero otherwise. It also reports where the default, input-seeded
+uncertainty of each row falls in the reference distribution.
+
+Usage:
+    python benchmarks/bench_bootstrap.py --model heart_model_ensemble.pkl --rows 5 --repeats 20
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+from model.predict import predict_heart_disease
+
+
+def reference_uncertainty(patient_data, model_components, num_bootstrap_samples=50):
+    """Uncertainty percent of the previous per-sample loop, kept verbatim as the reference"""
+    rf_model1 = model_components['rf_model1']
+    rf_model2 = model_components['rf_model2']
+    gb_model1 = model_components['gb_model1']
+    gb_model2 = model_components['gb_model2']
+    scaler = model_components['scaler']
+
+    patient_data = pd.DataFrame([patient_data])
+    patient_data_scaled = pd.DataFrame(
+        scaler.transform(patient_data),
+        columns=patient_data.columns
+    )
+
+    bootstrap_probs = []
+    for _ in range(num_bootstrap_samples):
+        bootstrap_sample = patient_data_scaled.copy()
+        for col in bootstrap_sample.columns:
+            noise = np.random.normal(0, 0.05)
+            if bootstrap_sample[col].dtype in [np.float64, np.int64]:
+                bootstrap_sample[col] = bootstrap_sample[col] + noise
+
+        rf1_prob = rf_model1.predict_proba(bootstrap_sample)[0, 1]
+        rf2_prob = rf_model2.predict_proba(bootstrap_sample)[0, 1]
+        gb1_prob = gb_model1.predict_proba(bootstrap_sample)[0, 1]
+        gb2_prob = gb_model2.predict_proba(bootstrap_sample)[0, 1]
+
+        avg_prob = (rf1_prob + rf2_prob + gb1_prob + gb2_prob) / 4
+        bootstrap_probs.append(avg_prob)
+
+    model_probs = [
+        rf_model1.predict_proba(patient_data_scaled)[0, 1],
+        rf_model2.predict_proba(patient_data_scaled)[0, 1],
+        gb_model1.predict_proba(patient_data_scaled)[0, 1],
+        gb_model2.predict_proba(patient_data_scaled)[0, 1]
+    ]
+    model_variance = np.var(model_probs)
+
+    bootstrap_std = np.std(bootstrap_probs)
+    combined_uncertainty = np.sqrt(bootstrap_std**2 + model_variance)
+    return round(min(combined_uncertainty * 400, 100), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to take the rows from')
+    parser.add_argument('--rows', type=int, default=5, help='Rows checked, spread evenly over the CSV')
+    parser.add_argument('--repeats', type=int, default=20, help='Independent bootstrap runs per row and path')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Family-wise significance level')
+    args = parser.parse_args()
+
+    model_components = load_model(args.model)
+    data = pd.read_csv(args.data)[model_components['feature_means'].index]
+    rows = [data.iloc[i].to_dict() for i in np.linspace(0, len(data) - 1, args.rows).astype(int)]
+    threshold = args.alpha / (2 * len(rows))
+
+    print(f"{'row':>4}  {'reference':>14}  {'vectorized':>14}  {'t-test p':>9}  {'Levene p':>9}  "
+          f"{'input-seeded':>12}  {'percentile':>10}")
+    failures = 0
+    reference_seconds = vectorized_seconds = 0.0
+    for i, row in enumerate(rows):
+        reference, vectorized = [], []
+        for repeat in range(args.repeats):
+            np.random.seed(repeat)
+            start = time.perf_counter()
+            reference.append(reference_uncertainty(row, model_components))
+            reference_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            result = predict_heart_disease(row, model_components, random_state=repeat)
+            vectorized_seconds += time.perf_counter() - start
+            vectorized.append(result['uncertainty']['uncertainty_percent'])
+        reference, vectorized = np.array(reference), np.array(vectorized)
+
+        # Identical samples (e.g. uncertainty capped at 100) make both tests undefined
+        if np.ptp(reference) == 0 and np.ptp(vectorized) == 0:
+            t_p = levene_p = 1.0 if reference[0] == vectorized[0] else 0.0
+        else:
+            # Nearly identical samples only cost the tests some precision
+            warnings.filterwarnings('ignore', message='Precision loss occurred')
+            t_p = stats.ttest_ind(reference, vectorized, equal_var=False).pvalue
+            levene_p = stats.levene(reference, vectorized).pvalue
+        seeded = predict_heart_disease(row, model_components)['uncertainty']['uncertainty_percent']
+        failed = t_p < threshold or levene_p < threshold
+        failures += failed
+        print(f"{i:>4}  {reference.mean():>7.2f}+-{reference.std():<5.2f}  "
+              f"{vectorized.mean():>7.2f}+-{vectorized.std():<5.2f}  {t_p:>9.3f}  {levene_p:>9.3f}  "
+              f"{seeded:>12.1f}  {stats.percentileofscore(reference, seeded):>9.0f}%"
+              f"{'  DIFFERENT' if failed else ''}")
+
+    calls = len(rows) * args.repeats
+    print(f"Per call: reference {reference_seconds / calls * 1e3:.0f} ms, "
+          f"vectorized {vectorized_seconds / calls * 1e3:.1f} ms")
+    if failures:
+        print(f"{failures} of {len(rows)} rows differ at p < {threshold:.4f}")
+        sys.exit(1)
+    print(f"No row differs at p < {threshold:.4f} (alpha {args.alpha}, Bonferroni over {2 * len(rows)} tests)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Agreement, tree count and latency of the early-exit cascade.
+
+Scores the unique rows of heart.csv and synthetic patients from
+benchmarks/patients.py (every feature drawn independently, unlike the
+calibration's mixes of real rows) one patient per call, as /predict does,
+with and without the cascade calibrated for the model (see
+model/cascade.py). Reports the share of patients exiting early, the
+average number of trees evaluated per request, the share of patients
+whose results differ from the full path in any thresholded field (risk
+level, binary prediction, reliability assessment or clinical insights),
+the probability and uncertainty error of early exits and the median and
+p95 latency of predict_heart_disease_batch.
+
+Usage:
+    python -m model.cascade heart_model_ensemble.pkl heart.csv
+    python benchmarks/bench_cascade.py --model heart_model_ensemble.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+from benchmarks.patients import synthetic_patients
+
+
+def score_each(patients, model_components):
+    """Results and latencies (ms) of scoring every patient in its own call"""
+    predict_heart_disease_batch(patients[:1], model_components)
+    results, timings = [], []
+    for patient in patients:
+        start = time.perf_counter()
+        results.append(predict_heart_disease_batch([patient], model_components)[0])
+        timings.append(time.perf_counter() - start)
+    return results, np.array(timings) * 1e3
+
+
+def same_decisions(a, b):
+    """Whether two results agree on every thresholded field"""
+    return (a['prediction']['risk_level'] == b['prediction']['risk_level']
+            and a['prediction']['binary_prediction'] == b['prediction']['binary_prediction']
+            and a['uncertainty']['assessment'] == b['uncertainty']['assessment']
+            and a['clinical_insights'] == b['clinical_insights'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to check agreement on')
+    parser.add_argument('--synthetic', type=int, default=1000, help='Synthetic patients to check agreement on')
+    args = parser.parse_args()
+
+    full_model = load_model(args.model, compile_trees=True)
+    cascade_model = load_model(args.model, compile_trees=True, cascade=True)
+    if cascade_model.get('cascade') is None:
+        sys.exit(f"No cascade calibrated for {args.model}; run python -m model.cascade {args.model} {args.data}")
+    calibration = cascade_model['cascade'].calibration
+    print(f"First stage: {len(cascade_model['cascade'].first_trees)} of {cascade_model['cascade'].engine.n_trees} "
+          f"trees, exit margin {calibration['margin']:.3f}, estimated uncertainty at most "
+          f"{calibration['max_uncertainty']:g}%, agreement target {calibration['agreement_target']:.1%}\n")
+
+    datasets = {
+        'data rows': pd.read_csv(args.data).drop(columns=['target']).drop_duplicates().to_dict('records'),
+        'synthetic': synthetic_patients(args.data, args.synthetic)
+    }
+    print(f"{'rows':<11}{'n':>6}{'exit':>8}{'trees':>8}{'same':>8}{'exit |err|':>12}{'max':>7}"
+          f"{'unc |err|':>11}{'max':>7}{'full p50/p95 ms':>18}{'cascade p50/p95 ms':>21}")
+    for name, patients in datasets.items():
+        full, full_ms = score_each(patients, full_model)
+        cascade, cascade_ms = score_each(patients, cascade_model)
+        exited = np.array([result['early_exit'] for result in cascade])
+        trees = np.mean([result['trees_evaluated'] for result in cascade])
+        agreement = np.mean([same_decisions(a, b) for a, b in zip(full, cascade)])
+        error = np.abs([a['prediction']['heart_disease_probability'] - b['prediction']['heart_disease_probability']
+                        for a, b in zip(full, cascade)])[exited]
+        uncertainty_error = np.abs([a['uncertainty']['uncertainty_percent'] - b['uncertainty']['uncertainty_percent']
+                                    for a, b in zip(full, cascade)])[exited]
+        print(f"{name:<11}{len(patients):>6}{exited.mean():>8.1%}{trees:>8.0f}{agreement:>8.1%}"
+              f"{error.mean() if exited.any() else 0:>12.4f}{error.max() if exited.any() else 0:>7.3f}"
+              f"{uncertainty_error.mean() if exited.any() else 0:>11.2f}"
+              f"{uncertainty_error.max() if exited.any() else 0:>7.1f}"
+              f"{np.median(full_ms):>10.2f}/{np.percentile(full_ms, 95):<7.2f}"
+              f"{np.median(cascade_ms):>13.2f}/{np.percentile(cascade_ms, 95):<7.2f}")
+
+
+if __name__ == '__main__':
+    main()
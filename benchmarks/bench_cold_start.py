@@ -0,0 +1,86 @@
+"""
+Cold-start benchmark: time-to-ready and first-request latency.
+
+Launches the API with uvicorn, polls the readiness endpoint until it
+answers 200, then times the first /predict call, the first render of the
+returned visualization, and a second /predict call for comparison. Uses
+only the standard library as an HTTP client.
+
+Usage:
+    python benchmarks/bench_cold_start.py --model heart_model_ensemble.pkl
+    python benchmarks/bench_cold_start.py --ready-path /docs   # servers without /readyz
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Distinct from main.WARMUP_PATIENTS so nothing is served from a warm cache
+PATIENTS = [
+    {'age': 58, 'sex': 1, 'cp': 2, 'trestbps': 138, 'chol': 251, 'fbs': 0, 'restecg': 1,
+     'thalach': 141, 'exang': 1, 'oldpeak': 1.8, 'slope': 1, 'ca': 1, 'thal': 3},
+    {'age': 49, 'sex': 0, 'cp': 0, 'trestbps': 122, 'chol': 219, 'fbs': 0, 'restecg': 0,
+     'thalach': 163, 'exang': 0, 'oldpeak': 0.6, 'slope': 2, 'ca': 0, 'thal': 2},
+]
+
+
+def request(url, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as response:
+        body = response.read()
+    return time.perf_counter() - start, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--app-dir', default=ROOT, help='Directory containing main.py')
+    parser.add_argument('--ready-path', default='/readyz', help='Path polled until it returns 200')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    env = dict(os.environ, MODEL_PATH=os.path.abspath(args.model))
+    base = f'http://127.0.0.1:{args.port}'
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.port), '--log-level', 'warning'],
+        cwd=args.app_dir, env=env
+    )
+    try:
+        while True:
+            try:
+                request(base + args.ready_path)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    sys.exit("Server exited before becoming ready")
+                time.sleep(0.05)
+        time_to_ready = time.perf_counter() - start
+
+        first_seconds, body = request(base + '/predict', PATIENTS[0])
+        visualization = json.loads(body).get('visualization') or ''
+        render_seconds = None
+        if visualization.startswith('/'):
+            render_seconds, _ = request(base + visualization)
+        second_seconds, _ = request(base + '/predict', PATIENTS[1])
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"Time to ready:            {time_to_ready:7.2f} s")
+    print(f"First /predict:           {first_seconds * 1e3:7.1f} ms")
+    if render_seconds is not None:
+        print(f"First visualization GET:  {render_seconds * 1e3:7.1f} ms")
+    print(f"Second /predict:          {second_seconds * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Fidelity and latency of the fast-mode surrogate against the full model.
+
+Scores the unique rows of heart.csv and synthetic patients from
+benchmarks/patients.py (every feature drawn independently, so unlike the
+distillation set's mixes of real rows) with both modes, and reports the
+surrogate's maximum and mean absolute probability error, risk-level and
+binary agreement and mean uncertainty error. Then times one patient and a
+batch through predict_heart_disease_batch in each mode.
+
+Usage:
+    python benchmarks/bench_fast_mode.py --model heart_model_ensemble.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+from model.surrogate import find_surrogate, fidelity, load_surrogate
+from benchmarks.patients import synthetic_patients
+
+
+def median_ms(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1e3
+
+
+def scores(patients, model_components, mode):
+    results = predict_heart_disease_batch(patients, model_components, include_insights=False,
+                                          include_attributions=False, mode=mode)
+    return (np.array([result['prediction']['heart_disease_probability'] for result in results]),
+            np.array([result['uncertainty']['uncertainty_percent'] for result in results]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--surrogate', help='Surrogate file (default: the one next to the artifact)')
+    parser.add_argument('--data', default='heart.csv', help='CSV to check fidelity on')
+    parser.add_argument('--synthetic', type=int, default=2000, help='Synthetic patients to check fidelity on')
+    parser.add_argument('--batch', type=int, default=100, help='Patients per timed batch')
+    parser.add_argument('--repeats', type=int, default=200, help='Timed calls per measurement')
+    args = parser.parse_args()
+
+    model_components = load_model(args.model, compile_trees=True)
+    if args.surrogate:
+        fast_model = load_surrogate(args.surrogate)
+    else:
+        fast_model = find_surrogate(args.model, model_components['model_version'])
+    if fast_model is None:
+        sys.exit(f"No surrogate of model version {model_components['model_version']} next to {args.model}")
+
+    datasets = {
+        'data rows': pd.read_csv(args.data).drop(columns=['target']).drop_duplicates(),
+        'synthetic': pd.DataFrame(synthetic_patients(args.data, args.synthetic))
+    }
+    print(f"{'rows':<12}{'n':>6}{'max |err|':>11}{'mean |err|':>12}{'risk agree':>12}"
+          f"{'binary':>9}{'unc MAE':>9}")
+    for name, patients in datasets.items():
+        proba, uncertainty = scores(patients, fast_model, 'fast')
+        target_proba, target_uncertainty = scores(patients, model_components, 'full')
+        report = fidelity(proba, uncertainty, target_proba, target_uncertainty)
+        print(f"{name:<12}{report['rows']:>6}{report['max_abs_error']:>11.3f}{report['mean_abs_error']:>12.4f}"
+              f"{report['risk_level_agreement']:>12.1%}{report['binary_agreement']:>9.1%}"
+              f"{report['uncertainty_mae']:>9.1f}")
+
+    patients = synthetic_patients(args.data, args.batch, seed=1)
+    print(f"\n{'call':<22}{'full ms':>10}{'fast ms':>10}{'speedup':>9}")
+    for label, batch in (('1 patient', patients[:1]), (f'{args.batch} patients', patients)):
+        full = median_ms(lambda: predict_heart_disease_batch(batch, model_components), args.repeats)
+        fast = median_ms(lambda: predict_heart_disease_batch(batch, fast_model, mode='fast'), args.repeats)
+        print(f"{label:<22}{full:>10.2f}{fast:>10.3f}{full / fast:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Throughput scaling benchmark for the inference worker pool.
+
+Starts an InferencePool with each requested worker count and keeps
+2 x workers single-patient /predict tasks in flight until --requests have
+completed, then reports requests per second. Throughput should grow with
+the worker count up to the number of physical cores.
+
+Usage:
+    python benchmarks/bench_inference_pool.py --model heart_model_ensemble.pkl --workers 1,2,4,8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.inference_pool import InferencePool, predict_task
+
+
+async def drive(pool, patients, n_requests, concurrency):
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(patients[i % len(patients)])
+
+    async def client():
+        while not queue.empty():
+            await pool.run(predict_task, queue.get_nowait())
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to take patients from')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per worker count')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data).drop(columns=['target'])
+    patients = data.head(100).to_dict(orient='records')
+
+    print(f"CPU cores: {os.cpu_count()}")
+    print(f"{'workers':>8} {'start s':>8} {'req/s':>8} {'scaling':>8}")
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        pool = InferencePool(args.model, workers=workers, queue_depth=workers)
+        start = time.perf_counter()
+        pool.start()
+        startup = time.perf_counter() - start
+        try:
+            asyncio.run(drive(pool, patients, workers * 2, workers * 2))  # warm up
+            seconds = asyncio.run(drive(pool, patients, args.requests, workers * 2))
+        finally:
+            pool.shutdown()
+        throughput = args.requests / seconds
+        baseline = baseline or throughput
+        print(f"{workers:>8} {startup:>8.2f} {throughput:>8.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
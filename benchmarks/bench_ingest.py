@@ -0,0 +1,104 @@
+"""
+Parse and validation cost per row of the batch payload formats.
+
+Encodes the same patients (rows sampled from heart.csv) as the
+object-per-row JSON list of /predict/batch and as each /predict/columnar
+format (JSON column arrays, Arrow IPC stream, .npy matrix), then times
+turning the request body into validated features:
+
+    objects  json.loads, List[PatientData] validation (as FastAPI does for
+             /predict/batch) and model_dump of every patient
+    columnar parse_columnar and validate_matrix
+
+Usage:
+    python benchmarks/bench_ingest.py --sizes 1000,10000,50000
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema import FEATURES, PatientData, validate_matrix
+from utils.columnar import parse_columnar
+
+
+def encode(frame):
+    """Request bodies of a DataFrame of patients, by format"""
+    bodies = {
+        'objects': json.dumps(frame.to_dict('records')).encode(),
+        'columns': json.dumps(frame.to_dict('list')).encode()
+    }
+    try:
+        import pyarrow as pa
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        bodies['arrow'] = sink.getvalue().to_pybytes()
+    except ImportError:
+        print("pyarrow is not installed; skipping Arrow")
+    buffer = io.BytesIO()
+    np.save(buffer, frame.to_numpy(dtype=np.float64))
+    bodies['npy'] = buffer.getvalue()
+    return bodies
+
+
+patients_adapter = TypeAdapter(List[PatientData])
+
+
+def ingest_objects(body):
+    return [patient.model_dump() for patient in patients_adapter.validate_python(json.loads(body))]
+
+
+def ingest_columnar(body, fmt):
+    values = parse_columnar(body, fmt)
+    n_invalid, _ = validate_matrix(values)
+    assert n_invalid == 0
+    return values
+
+
+def median_seconds(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='heart.csv', help='CSV to sample patients from')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated row counts')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per measurement')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data)[FEATURES]
+    print(f"{'rows':>7}  {'format':<8}{'body KB':>10}{'us/row':>9}{'speedup':>9}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        frame = data.sample(n=size, replace=True, random_state=0).reset_index(drop=True)
+        bodies = encode(frame)
+        baseline = None
+        for fmt, body in bodies.items():
+            if fmt == 'objects':
+                seconds = median_seconds(lambda: ingest_objects(body), args.repeats)
+                baseline = seconds
+            else:
+                assert (ingest_columnar(body, fmt) == frame.to_numpy(dtype=np.float64)).all()
+                seconds = median_seconds(lambda: ingest_columnar(body, fmt), args.repeats)
+            print(f"{size:>7}  {fmt:<8}{len(body) / 1e3:>10.0f}{seconds / size * 1e6:>9.2f}"
+                  f"{baseline / seconds:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
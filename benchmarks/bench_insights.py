@@ -0,0 +1,157 @@
+"""
+Parity check and timing of the clinical insight rule engine.
+
+For every row of heart.csv, compares the insights and recommendations of
+the rule tables (InsightRules.evaluate over the whole batch, and
+get_clinical_insights for one result) with those of reference_insights,
+the hand-written if/elif chain the tables replaced. Each row is checked
+with the probability and uncertainty the model reports for it, and again
+with every risk band and uncertainty bound, just below, at and just above
+it. Exits non-zero on any difference, then times the reference run one
+patient at a time against one batch evaluation.
+
+Usage:
+    python benchmarks/bench_insights.py --model heart_model_ensemble.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+from model.feature_schema import get_feature_schema
+from model.clinical_insights import get_clinical_insights
+
+
+def reference_insights(risk_prob, uncertainty, abnormal_features):
+    """The insights of the previous if/elif implementation, kept verbatim as the parity reference"""
+    insights = []
+    recommendations = []
+
+    if risk_prob < 0.2:
+        insights.append("Patient shows minimal indicators of heart disease.")
+        recommendations.append("Standard preventive care and lifestyle counseling advised.")
+    elif risk_prob < 0.4:
+        insights.append("Patient shows some risk factors for heart disease.")
+        recommendations.append("Consider lifestyle modifications and monitoring of risk factors.")
+    elif risk_prob < 0.6:
+        insights.append("Patient shows moderate risk factors for heart disease.")
+        recommendations.append("Further cardiac assessment recommended. Consider non-invasive testing.")
+    elif risk_prob < 0.8:
+        insights.append("Patient shows significant risk factors for heart disease.")
+        recommendations.append("Comprehensive cardiac evaluation indicated. Consider stress test and echocardiogram.")
+    else:
+        insights.append("Patient shows strong indicators of heart disease.")
+        recommendations.append("Urgent cardiology referral advised. Consider cardiac catheterization if symptomatic.")
+
+    if uncertainty > 0.5:
+        insights.append("Model shows significant uncertainty in this prediction.")
+        recommendations.append("Consider additional diagnostic tests to confirm cardiovascular status.")
+
+    for feature, details in abnormal_features.items():
+        if feature == 'cp' and details['value'] in [0, 1, 2]:
+            insights.append(f"Patient reports {details.get('readable_value', details['value'])}, which may indicate angina.")
+            if details['value'] == 0:
+                recommendations.append("Evaluate for stable coronary artery disease.")
+        elif feature == 'thalach' and details['direction'] == 'low':
+            insights.append("Maximum heart rate during exercise is abnormally low, suggesting reduced cardiac capacity.")
+            recommendations.append("Consider evaluation for chronotropic incompetence or ischemic heart disease.")
+        elif feature == 'oldpeak' and details['direction'] == 'high':
+            insights.append("Significant ST depression observed during exercise, suggesting myocardial ischemia.")
+            recommendations.append("ECG monitoring during exercise recommended to assess for ischemic changes.")
+        elif feature == 'chol' and details['direction'] == 'high':
+            insights.append("Elevated cholesterol levels may contribute to atherosclerotic disease.")
+            recommendations.append("Lipid management indicated. Consider statin therapy if appropriate.")
+        elif feature == 'trestbps' and details['direction'] == 'high':
+            insights.append("Elevated resting blood pressure increases cardiac workload and stroke risk.")
+            recommendations.append("Blood pressure management recommended. Target <130/80 mmHg.")
+        elif feature == 'ca' and details['value'] > 0:
+            insights.append(f"Fluoroscopy shows {int(details['value'])} major vessel(s) with calcium deposits.")
+            recommendations.append("Presence of calcified vessels indicates atherosclerotic disease.")
+        elif feature == 'exang' and details['value'] == 1:
+            insights.append("Patient experiences angina during exercise, strongly associated with CAD.")
+            recommendations.append("Anti-anginal medication may be indicated.")
+        elif feature == 'thal' and details['value'] in [1, 2]:
+            thal_value = details.get('readable_value', details['value'])
+            insights.append(f"Thallium scan shows {thal_value}, indicating abnormal blood flow.")
+            recommendations.append("Consider myocardial perfusion imaging to assess for reversible ischemia.")
+
+    return {"key_insights": insights[:5], "recommendations": recommendations[:5]}
+
+
+def median_seconds(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings)
+
+
+def edge_values(bounds):
+    return [value for bound in bounds for value in (np.nextafter(bound, -1), bound, np.nextafter(bound, 2))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to check parity on')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed runs of each path')
+    parser.add_argument('--z-score-threshold', type=float, default=1.5, help='Threshold for abnormal features')
+    args = parser.parse_args()
+
+    model_components = load_model(args.model)
+    schema = get_feature_schema(model_components)
+    patients = pd.read_csv(args.data)[schema.features]
+    results, z_scores = predict_heart_disease_batch(patients, model_components, include_insights=False,
+                                                    z_score_threshold=args.z_score_threshold,
+                                                    return_z_scores=True)
+    values = patients.to_numpy(dtype=np.float64)
+    abnormal = np.abs(z_scores) >= args.z_score_threshold
+    abnormal_order = np.argsort(-np.abs(z_scores), axis=1, kind='stable')
+    abnormal_features = [result['abnormal_features'] for result in results]
+
+    # (probability, uncertainty fraction) cases: the model's, then every band and bound edge
+    cases = [(np.array([result['prediction']['heart_disease_probability'] for result in results]),
+              np.array([result['uncertainty']['uncertainty_percent'] for result in results]) / 100)]
+    for probability in edge_values([0.2, 0.4, 0.6, 0.8]) + [0.0, 1.0]:
+        for uncertainty in edge_values([0.5]):
+            cases.append((np.full(len(results), probability), np.full(len(results), uncertainty)))
+
+    mismatches = 0
+    for probabilities, uncertainties in cases:
+        batch = schema.insight_rules.evaluate(probabilities, uncertainties, values, z_scores, abnormal,
+                                              abnormal_order)
+        for row, features in enumerate(abnormal_features):
+            expected = reference_insights(probabilities[row], uncertainties[row], features)
+            single = get_clinical_insights(probabilities[row], uncertainties[row], features)
+            if batch[row] != expected or single != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"row {row}, probability {probabilities[row]}, uncertainty {uncertainties[row]}:\n"
+                          f"  expected {expected}\n  batch    {batch[row]}\n  single   {single}")
+    checks = len(cases) * len(results)
+    print(f"{checks:,} checks ({len(results)} rows x {len(cases)} probability/uncertainty cases): "
+          f"{mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+    probabilities, uncertainties = cases[0]
+    for name, fn in (
+        ('reference, per patient', lambda: [reference_insights(probabilities[row], uncertainties[row], features)
+                                            for row, features in enumerate(abnormal_features)]),
+        ('rule tables, batch', lambda: schema.insight_rules.evaluate(probabilities, uncertainties, values,
+                                                                    z_scores, abnormal, abnormal_order))
+    ):
+        print(f"{name:<24}{median_seconds(fn, args.repeats) / len(results) * 1e6:>8.2f} us/patient")
+
+
+if __name__ == '__main__':
+    main()
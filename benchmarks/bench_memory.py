@@ -0,0 +1,187 @@
+"""
+Memory footprint of a loaded model: bytes per component and process RSS.
+
+For each artifact, a fresh process loads the model through load_model (with
+the tree engine and attribution engine compiled), scores one patient and
+reports:
+
+- the bytes held by each model component, counted once: components are
+  walked in order (individual models first, then the ensemble, the
+  compiled engines and the rest), and memory already counted for an
+  earlier component is not counted again. An ensemble sharing its members
+  with rf_model1, rf_model2, gb_model1 and gb_model2 therefore shows only
+  its own small overhead;
+- the RSS of the process after loading and scoring, and how much of it the
+  model added.
+
+Pickle artifacts are measured with their members shared (the default) and,
+with --compare, also with the duplicated layout (load_model(...,
+share_members=False)). Memory-mapped artifacts report their array files,
+which are page-cache backed and shared between workers.
+
+--output writes the report as JSON; --baseline compares the total and RSS
+against such a report and exits non-zero if any grew by more than
+--threshold. Linux only, since RSS is read from /proc/self/status.
+
+Usage:
+    python benchmarks/bench_memory.py heart_model_ensemble.pkl --compare
+    python benchmarks/bench_memory.py heart_model_ensemble.pkl --output memory.json
+    python benchmarks/bench_memory.py heart_model_ensemble.pkl --baseline memory.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Reporting order: memory shared between components is attributed to the first
+COMPONENT_ORDER = ('rf_model1', 'rf_model2', 'gb_model1', 'gb_model2', 'ensemble', 'tree_engine',
+                   'tree_attribution', 'feature_schema', 'scaler', 'feature_means', 'feature_stds',
+                   'feature_importances')
+
+
+def deep_bytes(obj, seen):
+    """
+    Approximate bytes reachable from obj that are not in seen (object ids)
+
+    NumPy arrays count the buffer of the array that owns their memory, so
+    views are not counted twice; sklearn trees count their node and value
+    arrays.
+    """
+    import numpy as np
+    import pandas as pd
+    from sklearn.tree._tree import Tree
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        owner = obj
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        size = 0
+        if owner is obj or id(owner) not in seen:
+            seen.add(id(owner))
+            size = owner.nbytes
+        if obj.dtype == object:
+            size += sum(deep_bytes(item, seen) for item in obj.ravel())
+        return size
+    if isinstance(obj, Tree):
+        state = obj.__getstate__()
+        return sys.getsizeof(obj) + state['nodes'].nbytes + state['values'].nbytes
+    if isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(deep_bytes(k, seen) + deep_bytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(deep_bytes(item, seen) for item in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        return sys.getsizeof(obj) + deep_bytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+
+def component_bytes(model_components):
+    """Bytes of each model component, each shared object counted once"""
+    seen = set()
+    keys = [key for key in COMPONENT_ORDER if key in model_components]
+    keys += [key for key in model_components if key not in keys]
+    return {key: deep_bytes(model_components[key], seen) for key in keys}
+
+
+def _proc_kb(path, field):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _worker(model_path, share_members, patient, results):
+    from model.load_model import load_model
+    from model.predict import predict_heart_disease
+
+    rss_before = _proc_kb('/proc/self/status', 'VmRSS')
+    model_components = load_model(model_path, compile_trees=True, share_members=share_members)
+    predict_heart_disease(patient, model_components)
+    gc.collect()
+    rss = _proc_kb('/proc/self/status', 'VmRSS')
+    components = component_bytes(model_components)
+    results.put({
+        'shared_members': bool(model_components.get('shared_members')),
+        'components': components,
+        'total_bytes': sum(components.values()),
+        'rss_mb': rss / 1024,
+        'model_rss_mb': (rss - rss_before) / 1024
+    })
+
+
+def measure(model_path, share_members, patient):
+    """Memory report of the model loaded in a fresh process"""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_worker, args=(model_path, share_members, patient, results))
+    process.start()
+    report = results.get()
+    process.join()
+    return report
+
+
+def print_report(name, report):
+    print(f"{name}  (shared members: {'yes' if report['shared_members'] else 'no'})")
+    for key, size in report['components'].items():
+        print(f"  {key:<20} {size / 2**20:>9.2f} MB")
+    print(f"  {'total':<20} {report['total_bytes'] / 2**20:>9.2f} MB")
+    print(f"  {'process RSS':<20} {report['rss_mb']:>9.1f} MB "
+          f"(+{report['model_rss_mb']:.1f} MB loading and scoring)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('artifacts', nargs='+', help='Model artifacts (pickle files or mmap directories)')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also measure pickles without sharing the ensemble members')
+    parser.add_argument('--output', help='Write the report as JSON')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Allowed relative growth over the baseline (default 0.1)')
+    args = parser.parse_args()
+
+    patient = {'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1, 'restecg': 0,
+               'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0, 'ca': 0, 'thal': 1}
+
+    reports = {}
+    for model_path in args.artifacts:
+        name = os.path.basename(model_path.rstrip('/'))
+        layouts = [True, False] if args.compare and os.path.isfile(model_path) else [True]
+        for share_members in layouts:
+            label = name if share_members else f"{name} (duplicated)"
+            reports[label] = measure(model_path, share_members, patient)
+            print_report(label, reports[label])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for label, report in reports.items():
+            if label not in baseline:
+                continue
+            for metric in ('total_bytes', 'rss_mb'):
+                before, after = baseline[label][metric], report[metric]
+                change = after / before - 1
+                print(f"{label} {metric}: {before:.1f} -> {after:.1f} ({change:+.1%})")
+                if change > args.threshold:
+                    regressions.append(f"{label} {metric}")
+        if regressions:
+            sys.exit("Memory regression: " + ", ".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
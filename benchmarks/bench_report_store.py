@@ -0,0 +1,149 @@
+"""
+Sustained write throughput of the report store (utils/report_store.py).
+
+Submits --reports real reports (predictions and report texts of synthetic
+patients, cycled with fresh IDs) to a ReportStore on a new SQLite file, for
+each write batch size, and waits until everything is on disk. Reports
+written per second, submit() latency (the cost seen by the request path),
+the deepest the write-behind queue got and the number of dropped reports
+are printed per batch size. With --rate, reports are submitted at that
+steady rate instead of as fast as possible. Unpaced submission drops
+reports once the queue is full; pass --max-queue at least --reports to
+measure the writer's capacity alone.
+
+Finally the list endpoint's queries are timed on the last database: the
+first page, a page 100 cursors deep, and a risk-level filtered page.
+
+Usage:
+    python benchmarks/bench_report_store.py --model heart_model_ensemble.pkl
+    python benchmarks/bench_report_store.py --batch-sizes 1,256 --rate 2000 --reports 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.patients import synthetic_patients
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+from utils.report_gen import generate_report
+from utils.report_store import ReportStore
+
+
+def run_writes(path, samples, n_reports, batch_size, max_queue, rate):
+    store = ReportStore(path, batch_size=batch_size, max_queue=max_queue)
+    store.start()
+
+    # Track the deepest the queue gets while submitting
+    peak_depth = 0
+    stop = threading.Event()
+
+    def watch_queue():
+        nonlocal peak_depth
+        while not stop.is_set():
+            peak_depth = max(peak_depth, store.queue_depth)
+            time.sleep(0.001)
+
+    watcher = threading.Thread(target=watch_queue)
+    watcher.start()
+
+    submit_times = np.empty(n_reports)
+    start = time.perf_counter()
+    for i in range(n_reports):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        result, report = samples[i % len(samples)]
+        submitted = time.perf_counter()
+        store.submit(uuid.uuid4().hex, result, report)
+        submit_times[i] = time.perf_counter() - submitted
+    submit_seconds = time.perf_counter() - start
+    store.close()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    watcher.join()
+
+    stats = store.stats()
+    return {
+        'batch_size': batch_size,
+        'written_per_s': stats['written'] / elapsed,
+        'submit_per_s': n_reports / submit_seconds,
+        'submit_p50_us': float(np.percentile(submit_times, 50) * 1e6),
+        'submit_p99_us': float(np.percentile(submit_times, 99) * 1e6),
+        'peak_queue': peak_depth,
+        'written': stats['written'],
+        'dropped': stats['dropped'],
+        'mean_batch': stats['mean_batch_size']
+    }
+
+
+def time_queries(path, repeats=50):
+    store = ReportStore(path)
+
+    def median_ms(function):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return float(np.median(timings) * 1e3)
+
+    cursor = None
+    for _ in range(100):
+        cursor = store.list_reports(limit=50, cursor=cursor)['next_cursor']
+    return {
+        'first_page_ms': median_ms(lambda: store.list_reports(limit=50)),
+        'page_100_ms': median_ms(lambda: store.list_reports(limit=50, cursor=cursor)),
+        'risk_level_page_ms': median_ms(lambda: store.list_reports(limit=50, risk_level='High')),
+        'get_ms': median_ms(lambda: store.get(store.list_reports(limit=1)['reports'][0]['id']))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to sample synthetic patients from')
+    parser.add_argument('--reports', type=int, default=50000, help='Reports submitted per batch size')
+    parser.add_argument('--batch-sizes', default='1,16,64,256', help='Comma-separated write batch sizes')
+    parser.add_argument('--max-queue', type=int, default=10000, help='Write-behind queue capacity')
+    parser.add_argument('--rate', type=float, help='Submit at this many reports per second')
+    parser.add_argument('--dir', help='Directory for the database files (default: a temporary directory)')
+    args = parser.parse_args()
+
+    model_components = load_model(args.model)
+    patients = synthetic_patients(args.data, 200, seed=0)
+    results = predict_heart_disease_batch(patients, model_components)
+    samples = [(result, generate_report(result)) for result in results]
+
+    directory = args.dir or tempfile.mkdtemp(prefix='report-store-')
+    os.makedirs(directory, exist_ok=True)
+    print(f"{'batch':>6} {'written/s':>10} {'submit/s':>10} {'p50 us':>8} {'p99 us':>8} "
+          f"{'peak queue':>10} {'dropped':>8} {'mean batch':>10}")
+    path = None
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        path = os.path.join(directory, f'reports-{batch_size}.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        row = run_writes(path, samples, args.reports, batch_size, args.max_queue, args.rate)
+        print(f"{row['batch_size']:>6} {row['written_per_s']:>10.0f} {row['submit_per_s']:>10.0f} "
+              f"{row['submit_p50_us']:>8.1f} {row['submit_p99_us']:>8.1f} {row['peak_queue']:>10} "
+              f"{row['dropped']:>8} {row['mean_batch']:>10.1f}")
+
+    queries = time_queries(path)
+    print(f"List queries on {row['written']} reports: first page {queries['first_page_ms']:.2f} ms, "
+          f"page 100 {queries['page_100_ms']:.2f} ms, risk level page {queries['risk_level_page_ms']:.2f} ms, "
+          f"get {queries['get_ms']:.2f} ms")
+    print(f"Database files in {directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Per-stage micro-benchmarks of the prediction pipeline.
+
+Times every stage of a single /predict request separately, on reproducible
+synthetic patients (see benchmarks/patients.py), and writes the results as
+JSON. A saved result file can be used as a baseline: stages whose median
+time grew by more than the threshold are reported as regressions and the
+script exits with status 1.
+
+Stages:
+    request_validation     PatientData validation of the request body
+    to_array               patient dict -> feature row (FeatureSchema.to_array)
+    scale                  StandardScaler transform of the row
+    ensemble_proba         soft-voting ensemble probability
+    bootstrap              noise generation and member scoring of the bootstrap rows
+    model_variance         member scoring of the clean row and the variance across members
+    abnormal_features      z-scores, abnormal-feature ordering and contributor ranking
+    attribution            exact tree attributions of the row (tree engine only)
+    clinical_insights      get_clinical_insights
+    predict_total          predict_heart_disease end to end
+    visualization_id       opaque plot ID (the plot fields, encrypted)
+    visualize              feature profile render to base64 PNG
+    response_serialization PredictionResponse validation and JSON encoding
+    generate_report        text report generation
+
+Usage:
+    python benchmarks/bench_stages.py run --output baseline.json
+    python benchmarks/bench_stages.py run --output current.json --baseline baseline.json
+    python benchmarks/bench_stages.py compare baseline.json current.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import sklearn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.patients import synthetic_patients
+from model.clinical_insights import get_clinical_insights
+from model.feature_schema import get_feature_schema
+from model.load_model import load_model
+from model.predict import input_seed, predict_heart_disease, predict_heart_disease_batch
+from schema import PatientData, PredictionResponse
+from utils.report_gen import generate_report
+from utils.virtualization import visualization_id, visualize_z_scores
+
+RESULT_FORMAT_VERSION = 1
+MEMBER_KEYS = ('rf_model1', 'rf_model2', 'gb_model1', 'gb_model2')
+
+
+def make_stages(model_components, patients, num_bootstrap_samples=50):
+    """
+    Build the benchmarked stages
+
+    Returns:
+        List of (name, function) pairs; each function takes a patient index
+    """
+    schema = get_feature_schema(model_components)
+    tree_engine = model_components.get('tree_engine')
+    tree_attribution = model_components.get('tree_attribution')
+
+    # Inputs of the later stages are precomputed so each stage is timed alone
+    values = schema.to_array(patients)
+    scaled = schema.scale(values)
+    results, z_scores = predict_heart_disease_batch(patients, model_components, return_z_scores=True)
+    for result, patient_z_scores in zip(results, z_scores):
+        result['visualization'] = f"/visualization/{visualization_id(patient_z_scores, schema, result)}"
+
+    if tree_engine is not None:
+        def ensemble_proba(rows):
+            return tree_engine['ensemble'].predict_proba(rows)[:, 0]
+
+        def member_proba(rows):
+            return tree_engine.get('members', tree_engine['ensemble']).member_proba(rows)
+    else:
+        import pandas as pd
+
+        def ensemble_proba(rows):
+            return model_components['ensemble'].predict_proba(pd.DataFrame(rows, columns=schema.features))[:, 1]
+
+        def member_proba(rows):
+            rows = pd.DataFrame(rows, columns=schema.features)
+            return np.column_stack([model_components[key].predict_proba(rows)[:, 1] for key in MEMBER_KEYS])
+
+    def bootstrap(i):
+        rng = np.random.default_rng(input_seed(values[i]))
+        noise = rng.normal(0, 0.05, size=(num_bootstrap_samples, values.shape[1]))
+        bootstrap_probs = member_proba(scaled[i] + noise).mean(axis=1)
+        return np.std(bootstrap_probs)
+
+    def abnormal_features(i):
+        patient_z_scores = schema.z_scores(values[i:i + 1])
+        abs_z = np.abs(patient_z_scores)
+        abnormal_order = np.argsort(-abs_z, axis=1, kind='stable')
+        contributions = np.round(schema.importances * (1 + 0.5 * abs_z), 3)
+        significant = schema.significant
+        contributor_order = significant[np.argsort(-contributions[:, significant], axis=1, kind='stable')]
+        return abnormal_order, contributor_order
+
+    def clinical_insights(i):
+        result = results[i]
+        return get_clinical_insights(
+            result['prediction']['heart_disease_probability'],
+            result['uncertainty']['uncertainty_percent'] / 100,
+            result['abnormal_features'],
+            result['key_contributors']
+        )
+
+    stages = [
+        ('request_validation', lambda i: PatientData.model_validate(patients[i])),
+        ('to_array', lambda i: schema.to_array([patients[i]])),
+        ('scale', lambda i: schema.scale(values[i:i + 1])),
+        ('ensemble_proba', lambda i: ensemble_proba(scaled[i:i + 1])),
+        ('bootstrap', bootstrap),
+        ('model_variance', lambda i: np.var(member_proba(scaled[i:i + 1]), axis=1)),
+        ('abnormal_features', abnormal_features),
+        ('attribution', lambda i: tree_attribution.attributions(scaled[i:i + 1])),
+        ('clinical_insights', clinical_insights),
+        ('predict_total', lambda i: predict_heart_disease(patients[i], model_components)),
+        ('visualization_id', lambda i: visualization_id(z_scores[i], schema, results[i])),
+        ('visualize', lambda i: visualize_z_scores(z_scores[i], schema, results[i])),
+        ('response_serialization', lambda i: PredictionResponse.model_validate(results[i]).model_dump_json()),
+        ('generate_report', lambda i: generate_report(results[i])),
+    ]
+    if tree_attribution is None:
+        stages = [(name, function) for name, function in stages if name != 'attribution']
+    return stages
+
+
+def time_stage(function, n_patients, iterations, warmup):
+    """Call function on patients in turn and return per-call times in milliseconds"""
+    for i in range(warmup):
+        function(i % n_patients)
+
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i % n_patients)
+        timings.append(time.perf_counter() - start)
+    timings = np.asarray(timings) * 1e3
+
+    return {
+        'iterations': iterations,
+        'min_ms': float(timings.min()),
+        'median_ms': float(np.median(timings)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'mean_ms': float(timings.mean())
+    }
+
+
+def run(args):
+    model_components = load_model(args.model, compile_trees=not args.no_tree_engine)
+    patients = synthetic_patients(args.data, args.patients, seed=args.seed)
+
+    stages = make_stages(model_components, patients)
+    selected = set(args.stages.split(',')) if args.stages else None
+
+    results = {}
+    for name, function in stages:
+        if selected is not None and name not in selected:
+            continue
+        # Slow stages get fewer iterations so a full run stays short
+        start = time.perf_counter()
+        function(0)
+        iterations = args.iterations if time.perf_counter() - start < 0.02 else max(args.iterations // 10, 10)
+        results[name] = time_stage(function, len(patients), iterations, args.warmup)
+        print(f"{name:<24} median={results[name]['median_ms']:9.3f} ms  p95={results[name]['p95_ms']:9.3f} ms")
+
+    output = {
+        'format_version': RESULT_FORMAT_VERSION,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'model_version': model_components['model_version'],
+            'tree_engine': 'tree_engine' in model_components,
+            'patients': args.patients,
+            'seed': args.seed
+        },
+        'stages': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return report_comparison(baseline, output, args.threshold, args.min_delta_ms)
+    return 0
+
+
+def report_comparison(baseline, current, threshold, min_delta_ms):
+    """
+    Print a per-stage comparison of median times
+
+    Returns:
+        1 if any stage regressed by more than threshold (a fraction) and
+        min_delta_ms (to ignore jitter on microsecond stages), else 0
+    """
+    if baseline['config'].get('model_version') != current['config'].get('model_version'):
+        print("Warning: results were produced with different model versions")
+    if baseline['environment'] != current['environment']:
+        print("Warning: results were produced in different environments")
+
+    regressions = []
+    print(f"{'stage':<24} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, stage in current['stages'].items():
+        if name not in baseline['stages']:
+            print(f"{name:<24} {'-':>12} {stage['median_ms']:9.3f} ms {'new':>8}")
+            continue
+        before = baseline['stages'][name]['median_ms']
+        after = stage['median_ms']
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > threshold and after - before > min_delta_ms:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<24} {before:9.3f} ms {after:9.3f} ms {change:+8.1%}{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"No stage regressed by more than {threshold:.0%}")
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return report_comparison(baseline, current, args.threshold, args.min_delta_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Time every stage and optionally compare with a baseline')
+    run_parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    run_parser.add_argument('--data', default='heart.csv', help='CSV to sample synthetic patients from')
+    run_parser.add_argument('--patients', type=int, default=50, help='Distinct synthetic patients to cycle through')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic patients')
+    run_parser.add_argument('--iterations', type=int, default=500, help='Timed calls per fast stage')
+    run_parser.add_argument('--warmup', type=int, default=5, help='Untimed calls before timing each stage')
+    run_parser.add_argument('--stages', help='Comma-separated subset of stages to run')
+    run_parser.add_argument('--no-tree-engine', action='store_true', help='Score with the sklearn models')
+    run_parser.add_argument('--output', help='Write results to this JSON file')
+    run_parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    run_parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Relative median slowdown reported as a regression')
+    run_parser.add_argument('--min-delta-ms', type=float, default=0.005,
+                            help='Smallest absolute median slowdown reported as a regression')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two saved result files')
+    compare_parser.add_argument('baseline', help='Baseline results JSON')
+    compare_parser.add_argument('current', help='Current results JSON')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Relative median slowdown reported as a regression')
+    compare_parser.add_argument('--min-delta-ms', type=float, default=0.005,
+                                help='Smallest absolute median slowdown reported as a regression')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
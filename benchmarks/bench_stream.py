@@ -0,0 +1,221 @@
+"""
+Benchmark of streaming bulk scoring (POST /predict/stream).
+
+Starts the app with uvicorn, waits for /readyz, and uploads a CSV (or
+NDJSON) body of --rows synthetic patients with chunked transfer encoding.
+The body is generated on the fly while the results are read concurrently,
+so neither side holds the whole file. Reports rows/s, time to the first
+result line, and RSS of the server process tree sampled during the upload;
+peak RSS staying flat as --rows grows shows that memory use is bounded.
+
+With --error-fraction, that share of rows is made invalid (sex=5) to
+check that bad rows are answered inline without stopping the stream.
+--error-fraction 1 checks that an all-invalid upload is still answered
+incrementally (time to first line) with flat memory.
+
+Usage:
+    python benchmarks/bench_stream.py --model heart_model_ensemble.pkl --rows 100000
+    python benchmarks/bench_stream.py --format ndjson --rows 20000 --error-fraction 0.01
+    python benchmarks/bench_stream.py --rows 200000 --error-fraction 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.load_test import process_sample, process_tree, start_server
+from benchmarks.patients import synthetic_patients
+
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def body_lines(patients, rows, fmt, error_fraction, seed=0):
+    """Encoded upload lines for rows patients, cycling through the synthetic set"""
+    rng = random.Random(seed)
+    features = list(patients[0])
+    if fmt == 'csv':
+        yield (','.join(features + ['target']) + '\n').encode()
+    for i in range(rows):
+        patient = patients[i % len(patients)]
+        if rng.random() < error_fraction:
+            patient = dict(patient, sex=5)
+        if fmt == 'csv':
+            yield (','.join(str(patient[feature]) for feature in features) + ',0\n').encode()
+        else:
+            yield (json.dumps(patient) + '\n').encode()
+
+
+async def upload(writer, lines, block_bytes=64 * 1024):
+    """Write the lines as a chunked request body in blocks of about block_bytes"""
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_bytes:
+            data = b''.join(block)
+            writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            await writer.drain()
+            block, size = [], 0
+    if block:
+        data = b''.join(block)
+        writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+async def read_chunked(reader):
+    """Yield the decoded chunks of a chunked response body"""
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+            await reader.readline()
+            return
+        data = await reader.readexactly(size)
+        await reader.readexactly(2)
+        yield data
+
+
+async def stream_once(args, patients):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    writer.write(
+        f'POST /predict/stream HTTP/1.1\r\nHost: {args.host}\r\n'
+        f'Content-Type: {CONTENT_TYPES[args.format]}\r\nTransfer-Encoding: chunked\r\n'
+        f'Connection: close\r\n\r\n'.encode()
+    )
+    start = time.perf_counter()
+    sending = asyncio.create_task(
+        upload(writer, body_lines(patients, args.rows, args.format, args.error_fraction, args.seed)))
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if status != 200:
+        sending.cancel()
+        sys.exit(f"Unexpected status {status}: {(await reader.read()).decode(errors='replace')}")
+
+    first_result = first_line = None
+    results = errors = 0
+    summary = None
+    buffer = b''
+    async for data in read_chunked(reader):
+        *lines, buffer = (buffer + data).split(b'\n')
+        for line in lines:
+            record = json.loads(line)
+            if first_line is None:
+                first_line = time.perf_counter() - start
+            if 'result' in record:
+                results += 1
+                if first_result is None:
+                    first_result = time.perf_counter() - start
+            elif 'row' in record:
+                errors += 1
+            elif 'summary' in record:
+                summary = record['summary']
+            else:
+                sys.exit(f"Stream failed: {record.get('error')}")
+    elapsed = time.perf_counter() - start
+    await sending
+    writer.close()
+    return elapsed, first_line, first_result, results, errors, summary
+
+
+async def sample_rss(root_pid, stop, samples, interval=0.25):
+    """Append the total RSS of the server process tree every interval seconds"""
+    while not stop.is_set():
+        total = 0
+        for pid in process_tree(root_pid):
+            sample = process_sample(pid)
+            if sample is not None and 'resource_tracker' not in sample[2]:
+                total += sample[1]
+        samples.append(total)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def measure(args, server):
+    patients = synthetic_patients(args.data, args.patients, seed=args.seed)
+    samples = []
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sample_rss(server.pid, stop, samples))
+    elapsed, first_line, first_result, results, errors, summary = await stream_once(args, patients)
+    stop.set()
+    await sampling
+
+    print(f"Rows:                    {args.rows} ({args.format}, {errors} rejected)")
+    print(f"Elapsed:                 {elapsed:8.2f} s")
+    print(f"Throughput:              {args.rows / elapsed:8.0f} rows/s")
+    print(f"Time to first line:      {first_line * 1000:8.1f} ms")
+    if first_result is not None:
+        print(f"Time to first result:    {first_result * 1000:8.1f} ms")
+    # The first quarter of the samples covers start-up of the stream
+    early = max(samples[:max(len(samples) // 4, 1)])
+    print(f"Server RSS (early/peak): {early / 1e6:8.1f} / {max(samples) / 1e6:.1f} MB")
+    print(f"Summary line:            {summary}")
+    return {
+        'rows': args.rows,
+        'format': args.format,
+        'rejected': errors,
+        'scored': results,
+        'elapsed_s': elapsed,
+        'rows_per_s': args.rows / elapsed,
+        'first_line_ms': first_line * 1000,
+        'first_result_ms': first_result * 1000 if first_result is not None else None,
+        'early_rss_mb': early / 1e6,
+        'peak_rss_mb': max(samples) / 1e6,
+        'summary': summary
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to sample synthetic patients from')
+    parser.add_argument('--app-dir', default=ROOT, help='Directory containing main.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rows', type=int, default=50000, help='Rows in the uploaded body')
+    parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='csv')
+    parser.add_argument('--error-fraction', type=float, default=0.0, help='Share of invalid rows')
+    parser.add_argument('--patients', type=int, default=1000, help='Distinct synthetic patients to cycle through')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--inference-workers', type=int, default=1)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+    # start_server reads these load-test options
+    args.keep_cache = False
+
+    server = start_server(args, 1, args.inference_workers)
+    try:
+        result = asyncio.run(measure(args, server))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
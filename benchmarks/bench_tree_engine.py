@@ -0,0 +1,77 @@
+"""
+Parity check and latency benchmark for the flat-array tree engine.
+
+Scores every row of heart.csv with both sklearn predict_proba and the
+compiled engine, reports the largest probability difference per model,
+then times single-patient scoring on each path. Exits non-zero if any
+difference exceeds --tolerance.
+
+Usage:
+    python benchmarks/bench_tree_engine.py --model heart_model_ensemble.pkl
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.load_model import load_model
+
+MODEL_KEYS = ['rf_model1', 'rf_model2', 'gb_model1', 'gb_model2']
+
+
+def median_ms(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to check parity on')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Maximum allowed probability difference')
+    parser.add_argument('--repeats', type=int, default=200, help='Timed single-row calls per path')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model_components = load_model(args.model, compile_trees=True)
+    print(f"Load + compile: {time.perf_counter() - start:.2f}s")
+    engine = model_components['tree_engine']
+
+    features = model_components['feature_means'].index.tolist()
+    data = pd.read_csv(args.data)[features]
+    scaled = model_components['scaler'].transform(data)
+    scaled_df = pd.DataFrame(scaled, columns=features)
+
+    diffs = {'ensemble': np.abs(
+        engine['ensemble'].predict_proba(scaled)[:, 0] - model_components['ensemble'].predict_proba(scaled_df)[:, 1]
+    ).max()}
+    member_probs = engine.get('members', engine['ensemble']).member_proba(scaled)
+    for i, key in enumerate(MODEL_KEYS):
+        diffs[key] = np.abs(member_probs[:, i] - model_components[key].predict_proba(scaled_df)[:, 1]).max()
+
+    print(f"Parity over {len(data)} rows (max |engine - sklearn|):")
+    for key, diff in diffs.items():
+        print(f"  {key:<10} {diff:.2e}")
+
+    row, row_df = scaled[:1], scaled_df.iloc[:1]
+    sklearn_ms = median_ms(lambda: model_components['ensemble'].predict_proba(row_df), args.repeats)
+    engine_ms = median_ms(lambda: engine['ensemble'].predict_proba(row), args.repeats)
+    print(f"Single-patient ensemble scoring: sklearn {sklearn_ms:.3f} ms, engine {engine_ms:.3f} ms "
+          f"({engine['ensemble'].n_trees} trees)")
+
+    if max(diffs.values()) > args.tolerance:
+        sys.exit("Parity check failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Concurrency stress test and per-render timing for visualize_patient_data.
+
+Renders a set of heart.csv patients serially to get reference images, then
+renders them again from many threads at once and checks that every
+concurrent image is byte-identical to its serial reference. Reports
+per-render latency percentiles for both runs.
+
+Usage:
+    python benchmarks/bench_visualization.py --threads 16 --renders 400
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.virtualization import visualize_patient_data
+
+
+def make_result(row):
+    """Synthetic prediction result with the fields the renderer reads"""
+    probability = (row * 0.137) % 1.0
+    return {
+        "prediction": {"heart_disease_probability": probability, "risk_level": "High" if probability >= 0.5 else "Low"},
+        "uncertainty": {"reliability_percent": 100 - (row % 40)},
+    }
+
+
+def timed_render(job):
+    patient, means, stds, result = job
+    start = time.perf_counter()
+    image = visualize_patient_data(patient, means, stds, result)
+    return image, time.perf_counter() - start
+
+
+def summarize(label, timings):
+    timings = np.asarray(timings) * 1e3
+    print(f"{label:<12} renders={len(timings):>5}  p50={np.percentile(timings, 50):7.1f} ms  "
+          f"p95={np.percentile(timings, 95):7.1f} ms  max={timings.max():7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='heart.csv', help='CSV to take patients from')
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent rendering threads')
+    parser.add_argument('--renders', type=int, default=400, help='Total concurrent renders')
+    parser.add_argument('--patients', type=int, default=20, help='Distinct patients to cycle through')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data).drop(columns=['target'])
+    means, stds = data.mean(), data.std()
+    patients = [data.iloc[i].to_dict() for i in range(args.patients)]
+    jobs = [(patients[i % args.patients], means, stds, make_result(i % args.patients)) for i in range(args.renders)]
+
+    reference, serial_timings = [], []
+    for job in jobs[:args.patients]:
+        image, seconds = timed_render(job)
+        reference.append(image)
+        serial_timings.append(seconds)
+    summarize('serial', serial_timings)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+        outputs = list(executor.map(timed_render, jobs))
+    wall = time.perf_counter() - start
+    summarize(f'{args.threads} threads', [seconds for _, seconds in outputs])
+    print(f"Concurrent throughput: {args.renders / wall:.1f} renders/s")
+
+    mismatches = sum(image != reference[i % args.patients] for i, (image, _) in enumerate(outputs))
+    print(f"Images differing from serial reference: {mismatches}")
+    if mismatches:
+        sys.exit("Concurrent renders are not identical to serial renders")
+
+
+if __name__ == '__main__':
+    main()
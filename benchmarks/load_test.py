@@ -0,0 +1,489 @@
+"""
+End-to-end load test of the API under concurrency.
+
+For every combination of uvicorn and inference worker counts, starts the
+app with uvicorn, waits for /readyz, drives /predict (and optionally
+/predict/batch) for a warm-up period and then for the measured duration,
+and stops the server. Reports throughput, p50/p95/p99 latency, error and
+429 rates per endpoint, plus CPU and peak RSS of every server process.
+
+With --swap-artifacts the server is started with admin access to the
+model registry (the directory of --model), and during the measurement the
+served model is swapped between the named artifacts every --swap-interval
+seconds. Requests sent while a swap is loading or draining are reported
+separately (endpoint "predict@swap"), so latency during a swap can be
+compared with the rest of the run.
+
+Two load models are supported:
+    closed loop (default)  --concurrency clients each send back-to-back requests
+    open loop (--rate)     requests arrive as a Poisson process at --rate req/s
+                           over at most --concurrency connections; latency is
+                           measured from the scheduled arrival time, so queueing
+                           in the client is not hidden
+
+The client is a minimal HTTP/1.1 keep-alive client on asyncio streams, and
+process stats are read from /proc (Linux only), so only the standard
+library and the app's own requirements are needed. The result cache is
+disabled in the server (RESULT_CACHE_SIZE=0) unless --keep-cache is given,
+so every request is scored.
+
+Usage:
+    python benchmarks/load_test.py --model heart_model_ensemble.pkl --uvicorn-workers 1,2,4,8
+    python benchmarks/load_test.py --inference-workers 1,2 --rate 50 --batch-fraction 0.1 --output load.json
+    python benchmarks/load_test.py --model models/a.pkl --swap-artifacts b.pkl,a.pkl --rate 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.patients import synthetic_patients
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class HTTPConnection:
+    """Keep-alive HTTP/1.1 connection for JSON requests"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        """Send a request and return (status, response body)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        payload = json.dumps(body).encode() if body is not None else b''
+        extra = ''.join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n{extra}"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n")
+        try:
+            self.writer.write(head.encode('ascii') + payload)
+            status_line = await self.reader.readuntil(b'\r\n')
+            status = int(status_line.split()[1])
+            length, close = 0, False
+            while True:
+                line = await self.reader.readuntil(b'\r\n')
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'connection' and value.strip().lower() == 'close':
+                    close = True
+            content = await self.reader.readexactly(length)
+        except Exception:
+            self.close()
+            raise
+
+        if close:
+            self.close()
+        return status, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class LoadRecorder:
+    """Latency and status counts per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.requests = []
+
+    def record(self, endpoint, status, seconds, started=None):
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+        self.requests.append((endpoint, status, seconds, started))
+
+    def split(self, windows):
+        """Recorder with requests started inside any (start, end) window moved to "<endpoint>@swap" """
+        recorder = LoadRecorder()
+        for endpoint, status, seconds, started in self.requests:
+            if started is not None and any(start <= started <= end for start, end in windows):
+                endpoint = f"{endpoint}@swap"
+            recorder.record(endpoint, status, seconds, started)
+        return recorder
+
+    def summary(self, duration):
+        summary = {}
+        for endpoint, statuses in self.statuses.items():
+            total = sum(statuses.values())
+            latencies = np.asarray(self.latencies.get(endpoint, [np.nan])) * 1e3
+            ok = statuses.get(200, 0)
+            summary[endpoint] = {
+                'requests': total,
+                'throughput_rps': ok / duration,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'error_rate': (total - ok - statuses.get(429, 0)) / total,
+                'rejected_429_rate': statuses.get(429, 0) / total,
+                'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)}
+            }
+        return summary
+
+
+class RequestMix:
+    """Picks the next request: /predict for one patient or /predict/batch"""
+
+    def __init__(self, patients, batch_fraction, batch_size, seed=0):
+        self.patients = patients
+        self.batch_fraction = batch_fraction
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.next_patient = 0
+
+    def _take(self, n):
+        start = self.next_patient
+        self.next_patient = (start + n) % len(self.patients)
+        return [self.patients[(start + i) % len(self.patients)] for i in range(n)]
+
+    def next_request(self):
+        if self.batch_fraction and self.random.random() < self.batch_fraction:
+            return 'batch', '/predict/batch', self._take(self.batch_size)
+        return 'predict', '/predict', self._take(1)[0]
+
+
+async def send(connection, recorder, mix, scheduled=None):
+    endpoint, path, body = mix.next_request()
+    start = time.perf_counter() if scheduled is None else scheduled
+    try:
+        status, _ = await connection.request('POST', path, body)
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        status = 'connection_error'
+    recorder.record(endpoint, status, time.perf_counter() - start, start)
+
+
+async def closed_loop(host, port, mix, concurrency, duration):
+    recorder = LoadRecorder()
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        connection = HTTPConnection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                await send(connection, recorder, mix)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return recorder, time.perf_counter() - start
+
+
+async def open_loop(host, port, mix, rate, max_connections, duration, seed=0):
+    recorder = LoadRecorder()
+    idle = asyncio.Queue()
+    for _ in range(max_connections):
+        idle.put_nowait(HTTPConnection(host, port))
+    arrivals = random.Random(seed)
+
+    async def arrival(scheduled):
+        connection = await idle.get()
+        try:
+            await send(connection, recorder, mix, scheduled)
+        finally:
+            idle.put_nowait(connection)
+
+    start = time.perf_counter()
+    scheduled = start
+    tasks = []
+    while True:
+        scheduled += arrivals.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(arrival(scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    while not idle.empty():
+        idle.get_nowait().close()
+    return recorder, elapsed
+
+
+def process_tree(root_pid):
+    """PIDs of root_pid and all its descendants with their depth in the tree"""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+        except OSError:
+            continue
+
+    tree, frontier = {root_pid: 0}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        for child in parents.get(pid, []):
+            tree[child] = tree[pid] + 1
+            frontier.append(child)
+    return tree
+
+
+def process_sample(pid):
+    """(cpu seconds, rss bytes, command line) of a process, or None if it exited"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = f.read().replace(b'\0', b' ').decode(errors='replace').strip()
+    except OSError:
+        return None
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu_seconds, int(fields[21]) * PAGE_SIZE, cmdline
+
+
+class ProcessMonitor:
+    """Samples CPU time and RSS of the server process tree in the background"""
+
+    def __init__(self, root_pid, uvicorn_workers, interval=0.25):
+        self.root_pid = root_pid
+        self.uvicorn_workers = uvicorn_workers
+        self.interval = interval
+        self.start_cpu = {}
+        self.last_cpu = {}
+        self.peak_rss = {}
+        self.roles = {}
+
+    def _role(self, depth):
+        if depth == 0:
+            return 'server'
+        if self.uvicorn_workers > 1 and depth == 1:
+            return 'uvicorn worker'
+        return 'inference worker'
+
+    def sample(self):
+        for pid, depth in process_tree(self.root_pid).items():
+            sample = process_sample(pid)
+            if sample is None or 'resource_tracker' in sample[2]:
+                continue
+            cpu_seconds, rss, _ = sample
+            self.roles.setdefault(pid, self._role(depth))
+            self.start_cpu.setdefault(pid, cpu_seconds)
+            self.last_cpu[pid] = cpu_seconds
+            self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+
+    async def run(self, stop):
+        while not stop.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self.sample()
+
+    def summary(self, duration):
+        return [
+            {
+                'pid': pid,
+                'role': self.roles[pid],
+                'cpu_percent': 100 * (self.last_cpu[pid] - self.start_cpu[pid]) / duration,
+                'peak_rss_mb': self.peak_rss[pid] / 1e6
+            }
+            for pid in sorted(self.roles, key=lambda pid: (self.roles[pid] != 'server', pid))
+        ]
+
+
+async def swap_models(args, names, stop):
+    """
+    Swap the served model to each name in turn, every swap_interval seconds, until stop is set
+
+    Returns:
+        (start, end) perf_counter times of every swap, from the request
+        until the new version is active and the old one is unloaded
+    """
+    headers = {'Authorization': f'Bearer {args.admin_token}'}
+    windows = []
+    swaps = 0
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), args.swap_interval)
+            break
+        except asyncio.TimeoutError:
+            pass
+        name = names[swaps % len(names)]
+        swaps += 1
+        # A new connection per swap: idle keep-alive connections are closed by the server
+        connection = HTTPConnection(args.host, args.port)
+        try:
+            start = time.perf_counter()
+            status, body = await connection.request('POST', '/admin/models/activate', {'artifact': name}, headers)
+            if status != 202:
+                print(f"Swap to {name} failed: {status} {body.decode(errors='replace')}")
+                continue
+            while True:
+                await asyncio.sleep(0.05)
+                _, body = await connection.request('GET', '/admin/models', headers=headers)
+                models = json.loads(body)
+                if models['loading'] is None and not models['draining']:
+                    break
+            windows.append((start, time.perf_counter()))
+        finally:
+            connection.close()
+    return windows
+
+
+def start_server(args, uvicorn_workers, inference_workers):
+    env = dict(os.environ, MODEL_PATH=os.path.abspath(args.model), INFERENCE_WORKERS=str(inference_workers))
+    if not args.keep_cache:
+        env['RESULT_CACHE_SIZE'] = '0'
+    # Other benchmarks reuse start_server without the swap options
+    if getattr(args, 'swap_artifacts', None):
+        env.update(MODEL_DIR=os.path.dirname(os.path.abspath(args.model)), ADMIN_TOKEN=args.admin_token,
+                   MODEL_WATCH_SECONDS='0')
+    command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', args.host, '--port', str(args.port),
+               '--workers', str(uvicorn_workers), '--log-level', 'warning']
+    server = subprocess.Popen(command, cwd=args.app_dir, env=env)
+
+    # With several uvicorn workers each one loads the model on its own;
+    # require a run of successful checks so they are all likely ready
+    ready_url = f'http://{args.host}:{args.port}/readyz'
+    deadline = time.perf_counter() + args.startup_timeout
+    consecutive = 0
+    while consecutive < 2 * uvicorn_workers:
+        if server.poll() is not None:
+            sys.exit("Server exited before becoming ready")
+        if time.perf_counter() > deadline:
+            server.terminate()
+            sys.exit(f"Server was not ready within {args.startup_timeout}s")
+        try:
+            urllib.request.urlopen(ready_url, timeout=5).read()
+            consecutive += 1
+        except (urllib.error.URLError, ConnectionError):
+            consecutive = 0
+            time.sleep(0.1)
+    return server
+
+
+async def measure(args, mix, server, uvicorn_workers):
+    async def drive(duration):
+        if args.rate:
+            return await open_loop(args.host, args.port, mix, args.rate, args.concurrency, duration)
+        return await closed_loop(args.host, args.port, mix, args.concurrency, duration)
+
+    if args.warmup > 0:
+        await drive(args.warmup)
+
+    monitor = ProcessMonitor(server.pid, uvicorn_workers)
+    stop = asyncio.Event()
+    monitoring = asyncio.create_task(monitor.run(stop))
+    swapping = None
+    if args.swap_artifacts:
+        swapping = asyncio.create_task(swap_models(args, args.swap_artifacts.split(','), stop))
+    recorder, elapsed = await drive(args.duration)
+    stop.set()
+    await monitoring
+    if swapping is not None:
+        windows = await swapping
+        print(f"{len(windows)} swap(s), " + ", ".join(f"{end - start:.1f}s" for start, end in windows))
+        recorder = recorder.split(windows)
+    return recorder.summary(elapsed), monitor.summary(elapsed), elapsed
+
+
+def print_table(runs):
+    print()
+    print(f"{'uvicorn':>7} {'infer':>5} {'endpoint':<13} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'err %':>6} {'429 %':>6} {'cpu %':>7} {'rss MB':>8}")
+    for run in runs:
+        cpu = sum(process['cpu_percent'] for process in run['processes'])
+        rss = sum(process['peak_rss_mb'] for process in run['processes'])
+        for endpoint, stats in run['endpoints'].items():
+            print(f"{run['uvicorn_workers']:>7} {run['inference_workers']:>5} {endpoint:<13} "
+                  f"{stats['throughput_rps']:8.1f} {stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} "
+                  f"{stats['p99_ms']:8.1f} {stats['error_rate'] * 100:6.2f} {stats['rejected_429_rate'] * 100:6.2f} "
+                  f"{cpu:7.0f} {rss:8.0f}")
+    print()
+    for run in runs:
+        print(f"uvicorn={run['uvicorn_workers']} inference={run['inference_workers']}: " + ", ".join(
+            f"{process['role']} {process['pid']} {process['cpu_percent']:.0f}% cpu {process['peak_rss_mb']:.0f} MB"
+            for process in run['processes']
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Path to the model artifact')
+    parser.add_argument('--data', default='heart.csv', help='CSV to sample synthetic patients from')
+    parser.add_argument('--app-dir', default=ROOT, help='Directory containing main.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--uvicorn-workers', default='1', help='Comma-separated uvicorn worker counts')
+    parser.add_argument('--inference-workers', default='1', help='Comma-separated INFERENCE_WORKERS values')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Concurrent clients (closed loop) or maximum connections (open loop)')
+    parser.add_argument('--rate', type=float, help='Open-loop arrival rate in requests per second')
+    parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds per configuration')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before each measurement')
+    parser.add_argument('--batch-fraction', type=float, default=0.0, help='Share of requests sent to /predict/batch')
+    parser.add_argument('--batch-size', type=int, default=50, help='Patients per /predict/batch request')
+    parser.add_argument('--patients', type=int, default=5000, help='Distinct synthetic patients to cycle through')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-cache', action='store_true', help='Leave the server result cache enabled')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--swap-artifacts',
+                        help='Comma-separated artifacts in the directory of --model to swap between')
+    parser.add_argument('--swap-interval', type=float, default=5.0, help='Seconds between model swaps')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+    args.admin_token = secrets.token_hex(16)
+
+    patients = synthetic_patients(args.data, args.patients, seed=args.seed)
+
+    runs = []
+    for uvicorn_workers in [int(w) for w in args.uvicorn_workers.split(',')]:
+        for inference_workers in [int(w) for w in args.inference_workers.split(',')]:
+            print(f"Running uvicorn_workers={uvicorn_workers} inference_workers={inference_workers}...")
+            mix = RequestMix(patients, args.batch_fraction, args.batch_size, seed=args.seed)
+            server = start_server(args, uvicorn_workers, inference_workers)
+            try:
+                endpoints, processes, elapsed = asyncio.run(measure(args, mix, server, uvicorn_workers))
+            finally:
+                server.terminate()
+                server.wait()
+            runs.append({
+                'uvicorn_workers': uvicorn_workers,
+                'inference_workers': inference_workers,
+                'duration_s': elapsed,
+                'endpoints': endpoints,
+                'processes': processes
+            })
+
+    print_table(runs)
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ('output', 'app_dir', 'admin_token')}
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'cpu_count': os.cpu_count(), 'runs': runs}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Reproducible synthetic patients for the benchmarks.
+
+Each feature is drawn independently from its empirical distribution in
+heart.csv, so the generated patients cover combinations that are not in
+the training data while every value stays valid for PatientData. The same
+seed always produces the same patients.
+"""
+import numpy as np
+import pandas as pd
+
+# PatientData declares oldpeak as a float and every other feature as an int
+FLOAT_FEATURES = {'oldpeak'}
+
+
+def synthetic_patients(data_path, n_patients, seed=0):
+    """
+    Generate patient feature dictionaries sampled from the training CSV
+
+    Args:
+        data_path: Path to heart.csv
+        n_patients: Number of patients to generate
+        seed: Random seed
+
+    Returns:
+        List of patient dictionaries with the same keys and value types as PatientData
+    """
+    data = pd.read_csv(data_path).drop(columns=['target'])
+    rng = np.random.default_rng(seed)
+    columns = {
+        feature: rng.choice(data[feature].to_numpy(), size=n_patients)
+        for feature in data.columns
+    }
+    return [
+        {
+            feature: float(values[i]) if feature in FLOAT_FEATURES else int(values[i])
+            for feature, values in columns.items()
+        }
+        for i in range(n_patients)
+    ]
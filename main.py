@@ -1,26 +1,249 @@
 from dataclasses import Field
-from http.client import HTTPException
-from typing import Any, Dict, List, Optional
-from fastapi import FastAPI, UploadFile,BackgroundTasks
+from typing import Any, Dict, List, Literal, Optional
+from fastapi import FastAPI, UploadFile, BackgroundTasks, HTTPException, Request
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, PlainTextResponse
 import uuid
 import os
+import hmac
+import datetime
 from pydantic import BaseModel
-import concurrent.futures
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
+from starlette.concurrency import run_in_threadpool
 
-from schema import PredictionResponse , PatientData
-from model.predict import predict_heart_disease
+from schema import PredictionResponse , PatientData, validate_matrix
 from model.load_model import load_model
+from model.surrogate import find_surrogate
 from utils.report_gen import generate_report
-from utils.virtualization import visualize_patient_data
+from utils.inference_pool import (InferencePool, PoolSaturatedError, PoolTimeoutError, PoolClosedError, predict_task,
+                                  predict_batch_task, predict_fast_task, predict_matrix_task)
+from utils.micro_batcher import MicroBatcher
+from utils.result_cache import ResultCache
+from utils.metrics import (registry, MetricsMiddleware, StageTimer, observe_stages, observe_scoring,
+                           inference_errors)
+from utils.columnar import parse_columnar, columnar_format, ColumnarFormatError
+from utils.stream_scoring import score_stream, stream_format, StreamAbortedError, UploadStreamingResponse
+from utils.report_store import ReportStore
+from utils.model_registry import ModelRegistry, ModelVersion, SwapInProgressError
+
+
+# Model artifact: a joblib pickle or a memory-mapped artifact directory (see model/artifact.py)
+MODEL_PATH = os.environ.get("MODEL_PATH", "heart_model_ensemble.pkl")
+
+# Directory of model artifacts that can be swapped in without a restart (see
+# utils/model_registry.py; defaults to the directory of MODEL_PATH), how often
+# it is checked for a changed artifact in seconds, and how long a replaced
+# version may keep serving its in-flight requests before it is unloaded. The
+# check is how every uvicorn worker process follows the `current` file that
+# /admin/models/activate writes; with 0 an activation only swaps the worker
+# that received it
+MODEL_DIR = os.environ.get("MODEL_DIR") or os.path.dirname(os.path.abspath(MODEL_PATH))
+MODEL_WATCH_SECONDS = float(os.environ.get("MODEL_WATCH_SECONDS", "5"))
+MODEL_DRAIN_TIMEOUT = float(os.environ.get("MODEL_DRAIN_TIMEOUT", "300"))
+
+# Niceness of a new model version's inference workers until they are warmed
+# up, so loading it takes CPU time from the serving version as little as possible
+MODEL_LOAD_NICE = int(os.environ.get("MODEL_LOAD_NICE", "10"))
+
+# Bearer token of the /admin and /reports endpoints (unset disables them)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Upper bound on the number of patients accepted by a single /predict/batch or /predict/columnar call
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "1000"))
+# Largest /predict/columnar body, enforced while it is received: MAX_BATCH_SIZE
+# rows of 13 values at up to 32 bytes each (JSON text), plus 64 KiB of headers
+MAX_COLUMNAR_BYTES = int(os.environ.get("MAX_COLUMNAR_BYTES", str(MAX_BATCH_SIZE * 13 * 32 + 65536)))
+
+# Rows (valid or not) per chunk of /predict/stream, and how long it waits
+# before retrying a chunk when the worker pool is saturated
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "500"))
+STREAM_RETRY_SECONDS = 0.05
+
+# Score with the flat-array tree engine instead of sklearn predict_proba (set to 0 to disable)
+USE_TREE_ENGINE = os.environ.get("USE_TREE_ENGINE", "1") == "1"
+
+# Let full-mode predictions exit after a first stage of trees when the
+# patient's result is already clear, using the cascade calibrated
+# for the artifact (see model/cascade.py; needs the tree engine)
+USE_CASCADE = os.environ.get("USE_CASCADE", "0") == "1"
+
+# Inference worker processes (0 runs inference on the server's thread pool),
+# extra requests allowed to wait for a worker, and per-request timeout in seconds
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_QUEUE_DEPTH = int(os.environ.get("INFERENCE_QUEUE_DEPTH", "16"))
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "30"))
+
+# Seconds clients are asked to wait before retrying a shed request
+RETRY_AFTER_SECONDS = 1
+
+# Coalesce concurrent /predict calls for up to this many milliseconds (0 disables)
+# or until this many requests are waiting
+MICRO_BATCH_WINDOW_MS = float(os.environ.get("MICRO_BATCH_WINDOW_MS", "0"))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", "32"))
+
+# Cached /predict results: maximum entries (0 disables) and time-to-live in seconds
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "3600"))
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+# SQLite file where /predict reports are persisted (empty disables the store),
+# reports inserted per transaction, and reports allowed to wait for the writer
+REPORT_STORE_PATH = os.environ.get("REPORT_STORE_PATH", "reports.db")
+REPORT_WRITE_BATCH = int(os.environ.get("REPORT_WRITE_BATCH", "256"))
+REPORT_QUEUE_SIZE = int(os.environ.get("REPORT_QUEUE_SIZE", "10000"))
+report_store = None
+
+# Send per-request stage durations in a Server-Timing response header
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Synthetic patients run through prediction and rendering before reporting ready
+WARMUP_PATIENTS = [
+    {'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1, 'restecg': 0,
+     'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0, 'ca': 0, 'thal': 1},
+    {'age': 41, 'sex': 0, 'cp': 1, 'trestbps': 130, 'chol': 204, 'fbs': 0, 'restecg': 0,
+     'thalach': 172, 'exang': 0, 'oldpeak': 1.4, 'slope': 2, 'ca': 0, 'thal': 2},
+    {'age': 67, 'sex': 1, 'cp': 0, 'trestbps': 160, 'chol': 286, 'fbs': 0, 'restecg': 0,
+     'thalach': 108, 'exang': 1, 'oldpeak': 1.5, 'slope': 1, 'ca': 3, 'thal': 2},
+]
+
+# Set once the model is loaded and the warm-up has finished (or failed)
+ready = False
+startup_error = None
+# Background task of the model swap started by /admin/models/activate
+swap_task = None
+
+
+def load_version(path, version):
+    """Start inference workers on a model artifact and warm them up"""
+    # The server process only needs the model itself for inline inference
+    model_components = None
+    if INFERENCE_WORKERS == 0:
+        print("Loading pre-trained model...")
+        model_components = load_model(path, compile_trees=USE_TREE_ENGINE, cascade=USE_CASCADE)
+    
+    print(f"Starting {INFERENCE_WORKERS} inference worker(s)...")
+    pool = InferencePool(
+        path,
+        model_components,
+        workers=INFERENCE_WORKERS,
+        queue_depth=INFERENCE_QUEUE_DEPTH,
+        timeout=INFERENCE_TIMEOUT,
+        compile_trees=USE_TREE_ENGINE,
+        cascade=USE_CASCADE
+    )
+    # Only a swap has another version serving requests meanwhile
+    swapping = model_registry.active is not None
+    pool.start(nice=MODEL_LOAD_NICE if swapping else 0)
+    
+    # Pay first-call costs (sklearn/numpy dispatch, matplotlib fonts) in every
+    # worker and in this process before taking traffic
+    print("Warming up...")
+    try:
+        visualization_plots = pool.warm_up(WARMUP_PATIENTS)
+    except Exception:
+        pool.shutdown()
+        raise
+    if swapping and MODEL_LOAD_NICE and not pool.restore_priority():
+        print(f"Cannot restore the priority of the new inference workers; they keep niceness +{MODEL_LOAD_NICE}")
+    from utils.virtualization import render_visualization, encode_visualization
+    for fields in visualization_plots:
+        render_visualization(encode_visualization(fields))
+    
+    micro_batcher = None
+    if MICRO_BATCH_WINDOW_MS > 0:
+        micro_batcher = MicroBatcher(pool, MICRO_BATCH_WINDOW_MS, MICRO_BATCH_MAX_SIZE)
+    
+    # The fast-mode surrogate is scored in this process; it is small
+    fast_model = find_surrogate(path, version)
+    if fast_model is not None:
+        predict_fast_task(WARMUP_PATIENTS[0], fast_model)
+        print(f"Fast mode available (mean |error| {fast_model['fidelity']['holdout']['mean_abs_error']:.3f})")
+    return ModelVersion(version, path, pool, micro_batcher, fast_model)
+
+
+# Cached results are only valid for the model version that produced them
+model_registry = ModelRegistry(MODEL_DIR, MODEL_PATH, load_version, drain_timeout=MODEL_DRAIN_TIMEOUT,
+                               on_activate=lambda version: result_cache.set_model_version(version.version))
+
+
+def prepare():
+    """Load the model, start inference workers and warm everything up"""
+    global ready
+    
+    model_registry.activate(model_registry.target())
+    ready = True
+    print("Ready.")
+
+
+async def prepare_in_background():
+    global startup_error
+    try:
+        await run_in_threadpool(prepare)
+    except Exception as e:
+        startup_error = f"{type(e).__name__}: {e}"
+        print(f"Startup failed: {startup_error}")
+
+
+async def swap_model(path, update_pointer=False):
+    """Load the artifact at path and swap it in once it is warm; requests keep being served meanwhile"""
+    try:
+        await run_in_threadpool(model_registry.activate, path, update_pointer)
+    except Exception as e:
+        print(f"Model swap to {path} failed: {type(e).__name__}: {e}")
+
+
+async def watch_models():
+    """Swap in the registry's target artifact whenever it changes"""
+    while True:
+        await asyncio.sleep(MODEL_WATCH_SECONDS)
+        if ready and model_registry.loading is None and model_registry.changed():
+            try:
+                path = model_registry.target()
+            except ValueError as e:
+                print(f"Model watch: {e}")
+                continue
+            await swap_model(path)
+
+
+def log_swap_failure(task):
+    """Report a swap task that ended with an exception swap_model did not handle"""
+    if not task.cancelled() and task.exception() is not None:
+        e = task.exception()
+        print(f"Model swap task failed: {type(e).__name__}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start loading and warm-up without blocking liveness; stop workers on shutdown"""
+    global report_store
+    if not os.path.exists(MODEL_PATH):
+        raise Exception("Model file not found. Please train the model first.")
+    
+    if REPORT_STORE_PATH:
+        report_store = ReportStore(REPORT_STORE_PATH, batch_size=REPORT_WRITE_BATCH, max_queue=REPORT_QUEUE_SIZE)
+        report_store.start()
+    
+    startup = asyncio.create_task(prepare_in_background())
+    watcher = asyncio.create_task(watch_models()) if MODEL_WATCH_SECONDS > 0 else None
+    yield
+    startup.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    model_registry.close()
+    if report_store is not None:
+        # Flush reports still waiting in the write-behind queue
+        report_store.close()
 
 
 app = FastAPI(
     title="Heart Disease Prediction API",
     description="API for predicting heart disease risk with clinical insights",
-    version="1.0.0")
+    version="1.0.0",
+    lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -31,61 +254,503 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-model_components = None
+# Request counts and latency per route for /metrics
+app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING)
 
-@app.on_event("startup")
-async def startup_event():
-    """Load model on startup"""
-    global model_components
-    model_path = 'heart_model_ensemble.pkl'
+registry.counter_callback('heart_result_cache_hits_total', '/predict result cache hits',
+                          lambda: result_cache.hits)
+registry.counter_callback('heart_result_cache_misses_total', '/predict result cache misses',
+                          lambda: result_cache.misses)
+registry.gauge_callback('heart_result_cache_entries', 'Entries in the /predict result cache',
+                        lambda: result_cache.stats()['size'])
+registry.gauge_callback('heart_inference_in_flight', 'Inference tasks queued or running on the worker pool',
+                        lambda: model_registry.active.pool.in_flight if model_registry.active is not None else None)
+registry.gauge_callback('heart_model_versions_loaded', 'Model versions loaded (the active one and those draining)',
+                        lambda: (model_registry.active is not None) + len(model_registry.draining))
+registry.counter_callback('heart_model_swaps_total', 'Model versions activated, including the first one',
+                          lambda: model_registry.swaps)
+registry.gauge_callback('heart_ready', 'Whether the model is loaded and warmed up',
+                        lambda: int(ready))
+registry.gauge_callback('heart_report_queue_depth', 'Reports waiting to be written to the report store',
+                        lambda: report_store.queue_depth if report_store is not None else None)
+registry.counter_callback('heart_reports_written_total', 'Reports written to the report store',
+                          lambda: report_store.written if report_store is not None else None)
+registry.counter_callback('heart_reports_dropped_total', 'Reports dropped because the write queue was full',
+                          lambda: report_store.dropped if report_store is not None else None)
+registry.counter_callback('heart_report_write_retries_total', 'Retried report store transactions',
+                          lambda: report_store.write_retries if report_store is not None else None)
+registry.counter_callback('heart_report_write_errors_total', 'Reports dropped because their writes kept failing',
+                          lambda: report_store.write_errors if report_store is not None else None)
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and warmed up"""
+    if not ready:
+        detail = startup_error or "Model is loading"
+        return JSONResponse(status_code=503, content={"status": "not ready", "detail": detail})
     
-    if os.path.exists(model_path):
-        print("Loading pre-trained model...")
-        model_components = load_model(model_path)
+    return {"status": "ready", "model_version": model_registry.active.version}
+
+
+def acquire_model():
+    """
+    The model version to serve a request with; pass it to
+    model_registry.release() when the request is done
+    """
+    version = model_registry.acquire()
+    if version is None:
+        raise HTTPException(status_code=503, detail="Model not loaded. Please try again later.")
+    return version
+
+
+async def run_inference(version, task, *args):
+    """
+    Run an inference task on a model version's worker pool, shedding load when it is saturated
+    
+    Returns:
+        The task's result and the time spent in each stage, in seconds
+    """
+    # Single-patient predictions are coalesced into batches when enabled
+    if version.micro_batcher is not None and task is predict_task:
+        pending = version.micro_batcher.predict(*args)
     else:
-        raise Exception("Model file not found. Please train the model first.")
+        pending = version.pool.run(task, *args)
+    
+    try:
+        return await pending
+    except PoolSaturatedError as e:
+        inference_errors.inc('saturated')
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    except (PoolTimeoutError, PoolClosedError, BrokenProcessPool) as e:
+        inference_errors.inc('timeout' if isinstance(e, PoolTimeoutError) else 'unavailable')
+        raise HTTPException(status_code=503, detail=str(e) or "Inference workers unavailable",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def with_visualization_url(result):
+    """Copy of a result whose plot fields are replaced by a /visualization/{id} URL carrying them"""
+    if 'visualization_fields' not in result:
+        return result
+    from utils.virtualization import encode_visualization
+    result = dict(result)
+    result['visualization'] = f"/visualization/{encode_visualization(result.pop('visualization_fields'))}"
+    return result
+
+
+async def run_fast_inference(version, patient_dict, include_visualization):
+    """
+    Score a patient with a model version's fast-mode surrogate
+    
+    The surrogate runs on the server's thread pool: it is faster than the
+    hop to a worker, and does not queue behind full-mode requests.
+    
+    Returns:
+        The result and the time spent in each stage, in seconds
+    """
+    if version.fast_model is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"No fast-mode model for model version {version.version}; "
+                   f"distill one with `python -m model.surrogate`"
+        )
+    return await run_in_threadpool(predict_fast_task, patient_dict, version.fast_model, include_visualization)
+
+
+def record_stages(request, stage_durations):
+    """Record stage durations in the metrics and keep them for the Server-Timing header"""
+    observe_stages(stage_durations)
+    request.state.stage_timings = {**getattr(request.state, 'stage_timings', {}), **stage_durations}
 
 
+def generate_report_timed(result, report_id=None):
+    """Generate the report of a prediction and queue it for the report store"""
+    timer = StageTimer()
+    report = generate_report(result)
+    timer.lap('report')
+    if report_id is not None:
+        report_store.submit(report_id, result, report, result['model_version'])
+        timer.lap('report_queue')
+    observe_stages(timer.durations)
 
 
 @app.post("/predict", response_model=PredictionResponse)
-async def predict(patient: PatientData, background_tasks: BackgroundTasks):
+async def predict(request: Request, patient: PatientData, background_tasks: BackgroundTasks,
+                  include_visualization: bool = False, mode: Literal['full', 'fast'] = 'full'):
     """
     Predict heart disease risk with uncertainty estimation
     
     This endpoint processes patient data to predict cardiovascular risk,
     estimate prediction uncertainty, and provide clinical insights.
-    """
-    global model_components
     
-    if model_components is None:
-        raise HTTPException(status_code=503, detail="Model not loaded. Please try again later.")
+    The `visualization` field holds a `/visualization/{id}` URL that renders
+    the feature profile on demand. Pass `include_visualization=true` to get
+    the plot inline as a base64 PNG data URI instead.
     
+    `mode=fast` scores with the surrogate distilled from the served model
+    (see model/surrogate.py) instead of the ensemble and its bootstrap:
+    sub-millisecond, approximate. The `mode` field of the response says
+    which one produced it.
+    """
     # Convert Pydantic model to dict
     patient_dict = patient.model_dump()
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Start both tasks simultaneously
-        prediction_future = executor.submit(predict_heart_disease, patient_dict, model_components)
-        visualization_future = executor.submit(
-            visualize_patient_data,
-            patient_dict,
-            model_components['feature_means'],
-            model_components['feature_stds'],
-            # Note: This will wait for prediction result, but starts the thread early
-            prediction_future.result()  
-        )
+    
+    # Repeat submissions are served from the result cache
+    version = acquire_model()
+    try:
+        timer = StageTimer()
+        cache_key = ResultCache.make_key(patient_dict, version.version, include_visualization, mode)
+        result = result_cache.get(cache_key)
+        timer.lap('cache')
         
-        # Get results
-        result = prediction_future.result()
-        img_base64 = visualization_future.result()
+        if result is None:
+            # Get prediction result (and inline visualization if requested) from a worker,
+            # or from the fast-mode surrogate
+            if mode == 'fast':
+                result, stage_durations = await run_fast_inference(version, patient_dict, include_visualization)
+            else:
+                result, stage_durations = await run_inference(version, predict_task, patient_dict,
+                                                              include_visualization)
+            result['model_version'] = version.version
+            timer.lap('inference')
+            record_stages(request, stage_durations)
+            observe_scoring([result])
+            result_cache.put(cache_key, result)
+        # Registered on every response, so cached results never hand out an expired ID
+        result = with_visualization_url(result)
+        record_stages(request, timer.durations)
+    finally:
+        model_registry.release(version)
+    
+    # Generate and persist the report in the background; it can be fetched
+    # from /reports/{report_id} once submitted
+    if report_store is not None:
+        report_id = uuid.uuid4().hex
+        background_tasks.add_task(generate_report_timed, result, report_id)
+        return {**result, "report_id": report_id}
+    
+    background_tasks.add_task(generate_report_timed, result)
+    return result
+
+
+@app.get("/visualization/{vis_id}")
+def get_visualization(request: Request, vis_id: str, format: str = "png"):
+    """
+    Render the patient feature profile behind a visualization ID
+    
+    IDs carry the plot encrypted under VISUALIZATION_KEY, so any server
+    process sharing the key renders them; responses may only be cached
+    privately. Supported formats are `png` and `svg`.
+    """
+    from utils.virtualization import render_visualization, MEDIA_TYPES
+    
+    timer = StageTimer()
+    try:
+        image = render_visualization(vis_id, format)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    timer.lap('render')
+    record_stages(request, timer.durations)
+    
+    return Response(
+        content=image,
+        media_type=MEDIA_TYPES[format],
+        headers={"Cache-Control": "private, max-age=3600"}
+    )
+
+
+@app.post("/predict/batch", response_model=List[PredictionResponse])
+async def predict_batch(request: Request, patients: List[PatientData]):
+    """
+    Predict heart disease risk for a list of patients
+    
+    All patients are scored together in one vectorized pass; results are
+    returned in the same order as the request. Visualizations are not
+    generated for batch requests.
+    """
+    if len(patients) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(patients)} patients exceeds the limit of {MAX_BATCH_SIZE}."
+        )
+    
+    patient_dicts = [patient.model_dump() for patient in patients]
+    
+    timer = StageTimer()
+    version = acquire_model()
+    try:
+        results, stage_durations = await run_inference(version, predict_batch_task, patient_dicts)
+    finally:
+        model_registry.release(version)
+    for result in results:
+        result['model_version'] = version.version
+    timer.lap('inference')
+    record_stages(request, stage_durations)
+    observe_scoring(results)
+    record_stages(request, timer.durations)
+    
+    return results
+
+
+@app.post("/predict/columnar", response_model=List[PredictionResponse])
+async def predict_columnar(request: Request, format: Optional[str] = None):
+    """
+    Predict heart disease risk for a columnar batch of patients
+    
+    Same results as `/predict/batch`, for a payload that is parsed and
+    validated as whole columns instead of one object per patient. Send the
+    13 heart.csv feature columns as the raw request body:
+    
+    - `application/json`: an object of column arrays, `{"age": [63, 37], ...}`
+    - `application/vnd.apache.arrow.stream` (or `.file`): an Arrow IPC table
+    - `application/x-npy`: an `(n, 13)` `.npy` matrix in heart.csv column order
     
-    # Add visualization to result
-    result['visualization'] = f"data:image/png;base64,{img_base64}"
+    or pass `format=columns|arrow|npy`. Values are checked like `/predict`
+    (non-finite `oldpeak` values are rejected too); any invalid row fails
+    the request with `422`, listing the first invalid rows (numbered from 1,
+    as in `/predict/stream`). Bodies over MAX_COLUMNAR_BYTES get `413`
+    without being read in full.
+    """
+    try:
+        fmt = columnar_format(request.headers.get("content-type"), format)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     
-    # Add visualization to result
-    result['visualization'] = f"data:image/png;base64,{img_base64}"
+    too_large = HTTPException(status_code=413, detail=f"Body exceeds the limit of {MAX_COLUMNAR_BYTES} bytes.")
+    try:
+        content_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_COLUMNAR_BYTES:
+        raise too_large
     
-    # Generate report in background (could be used for logging or other purposes)
-    background_tasks.add_task(generate_report, result)
+    timer = StageTimer()
+    # Counted as it arrives, for chunked uploads without a Content-Length
+    chunks, received = [], 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_COLUMNAR_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    body = b''.join(chunks)
+    timer.lap('receive')
+    try:
+        values = await run_in_threadpool(parse_columnar, body, fmt)
+    except ColumnarFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    timer.lap('parse')
+    if len(values) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(values)} patients exceeds the limit of {MAX_BATCH_SIZE}."
+        )
+    n_invalid, errors = validate_matrix(values)
+    timer.lap('validate')
+    if n_invalid:
+        raise HTTPException(
+            status_code=422,
+            detail={"invalid_rows": n_invalid, "errors": [{"row": row + 1, "error": error} for row, error in errors]}
+        )
     
-    return result
\ No newline at end of file
+    version = acquire_model()
+    try:
+        results, stage_durations = await run_inference(version, predict_matrix_task, values)
+    finally:
+        model_registry.release(version)
+    for result in results:
+        result['model_version'] = version.version
+    timer.lap('inference')
+    record_stages(request, stage_durations)
+    observe_scoring(results)
+    record_stages(request, timer.durations)
+    
+    return results
+
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, format: Optional[str] = None):
+    """
+    Score a CSV or NDJSON upload of any size, streaming results back as NDJSON
+    
+    Send the rows as the raw request body with `Content-Type: text/csv`
+    (header row with the heart.csv columns; extra columns such as `target`
+    are ignored) or `application/x-ndjson` (one patient object per line),
+    or pass `format=csv|ndjson`. Rows are validated like `/predict`, scored
+    in chunks while the upload is still being read, and answered in input
+    order as `{"row": n, "result": {...}}` or `{"row": n, "error": "..."}`
+    lines, followed by a `{"summary": {...}}` line.
+    """
+    try:
+        fmt = stream_format(request.headers.get("content-type"), format)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    # Every row of the upload is scored by the same model version
+    version = acquire_model()
+    
+    async def score_chunk(patient_dicts):
+        while True:
+            try:
+                results, stage_durations = await version.pool.run(predict_batch_task, patient_dicts)
+            except PoolSaturatedError:
+                # Bulk scoring waits for interactive traffic instead of failing rows
+                await asyncio.sleep(STREAM_RETRY_SECONDS)
+                continue
+            except (PoolTimeoutError, PoolClosedError, BrokenProcessPool) as e:
+                inference_errors.inc('timeout' if isinstance(e, PoolTimeoutError) else 'unavailable')
+                raise StreamAbortedError(str(e) or "Inference workers unavailable")
+            observe_stages(stage_durations)
+            observe_scoring(results)
+            for result in results:
+                result['model_version'] = version.version
+            return results
+    
+    async def content():
+        try:
+            async for line in score_stream(request.stream(), fmt, score_chunk, chunk_rows=STREAM_CHUNK_ROWS,
+                                           upload_finished=upload_finished):
+                yield line
+        finally:
+            model_registry.release(version)
+    
+    upload_finished = asyncio.Event()
+    return UploadStreamingResponse(content(), upload_finished, media_type="application/x-ndjson")
+
+
+@app.get("/reports/{report_id}")
+def get_report(request: Request, report_id: str, format: str = "json"):
+    """
+    Fetch a stored report by the `report_id` returned from `/predict`
+    
+    Returns the prediction JSON and report text, or just the text with
+    `format=text`. Needs the ADMIN_TOKEN bearer token.
+    """
+    check_admin(request)
+    if report_store is None:
+        raise HTTPException(status_code=404, detail="Report store is disabled")
+    
+    report = report_store.get(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Report not found: {report_id}")
+    if format == "text":
+        return PlainTextResponse(report['report'])
+    return report
+
+
+@app.get("/reports")
+def list_reports(request: Request, limit: int = 50, cursor: Optional[str] = None, risk_level: Optional[str] = None,
+                 date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """
+    List stored reports, newest first
+    
+    Filter by `risk_level` (e.g. `High`) and by creation date
+    (`date_from`/`date_to`, inclusive, UTC). Pass the returned `next_cursor`
+    as `cursor` to get the next page. Needs the ADMIN_TOKEN bearer token.
+    """
+    check_admin(request)
+    if report_store is None:
+        raise HTTPException(status_code=404, detail="Report store is disabled")
+    
+    def timestamp(date):
+        return datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc).timestamp()
+    
+    try:
+        return report_store.list_reports(
+            limit=limit,
+            cursor=cursor,
+            risk_level=risk_level,
+            since=timestamp(date_from) if date_from else None,
+            until=timestamp(date_to + datetime.timedelta(days=1)) if date_to else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/stats/reports")
+async def report_stats():
+    """Write-behind queue depth and write counters of the report store"""
+    if report_store is None:
+        return {"enabled": False}
+    
+    return {"enabled": True, **report_store.stats()}
+
+
+@app.get("/stats/batching")
+async def batching_stats():
+    """Batch size distribution and queue wait time of the /predict micro-batcher"""
+    active = model_registry.active
+    if active is None or active.micro_batcher is None:
+        return {"enabled": False}
+    
+    return {"enabled": True, **active.micro_batcher.stats()}
+
+
+@app.get("/stats/cache")
+async def cache_stats():
+    """Size, eviction policy and hit/miss counters of the /predict result cache"""
+    return result_cache.stats()
+
+
+def check_admin(request: Request):
+    """Reject admin requests without the ADMIN_TOKEN bearer token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+class ActivateModelRequest(BaseModel):
+    artifact: Optional[str] = None
+
+
+@app.get("/admin/models")
+async def list_models(request: Request):
+    """Artifacts of the model registry, the version being served and any still draining or loading"""
+    check_admin(request)
+    return model_registry.status()
+
+
+@app.post("/admin/models/activate", status_code=202)
+async def activate_model(request: Request, body: Optional[ActivateModelRequest] = None):
+    """
+    Swap to another model artifact without downtime
+    
+    `artifact` names an artifact in the registry directory; once it is
+    active the registry's `current` file names it, so it is also served
+    after a restart. Without it the registry's target (its `current` file,
+    or MODEL_PATH) is reloaded. The new version is loaded and warmed up in
+    the background while the current one keeps serving; progress is
+    reported by `GET /admin/models`.
+    
+    The swap runs in the uvicorn worker process that received the request.
+    The other workers swap when their registry check (MODEL_WATCH_SECONDS)
+    sees the updated `current` file or the changed artifact.
+    """
+    global swap_task
+    check_admin(request)
+    if not ready:
+        raise HTTPException(status_code=503, detail="Model not loaded. Please try again later.")
+    if (swap_task is not None and not swap_task.done()) or model_registry.loading is not None:
+        raise HTTPException(status_code=409, detail=str(SwapInProgressError("A model swap is already loading")))
+    try:
+        path = model_registry.resolve(body.artifact) if body and body.artifact else model_registry.target()
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    swap_task = asyncio.create_task(swap_model(path, update_pointer=bool(body and body.artifact)))
+    swap_task.add_done_callback(log_swap_failure)
+    return {"status": "loading", "artifact": os.path.basename(path.rstrip('/'))}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Request, stage latency, cache and queue metrics in the Prometheus text format"""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
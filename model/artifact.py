@@ -0,0 +1,233 @@
+"""
+Memory-mapped model artifact format.
+
+A memory-mapped artifact is a directory holding a small manifest.json and
+one uncompressed .npy file per numeric array: the flat tree-engine node
+arrays, the tree-attribution path arrays, the scaler parameters, the
+feature means/stds and the rf1 feature importances. Loading opens the
+arrays with mmap_mode='r' instead of unpickling sklearn objects, so
+start-up time does not grow with model size and workers on the same host
+share the read-only pages through the page cache.
+
+The artifact only supports scoring through the flat-array tree engine; the
+original sklearn estimators are not included.
+
+Convert an existing pickle with:
+    python -m model.artifact heart_model_ensemble.pkl heart_model_ensemble.mmap
+
+or rewrite it with every tree stored once (pickles written by the original
+notebook hold the ensemble's members and the individual models separately):
+    python -m model.artifact heart_model_ensemble.pkl heart_model_dedup.pkl --pickle
+"""
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import joblib
+import numpy as np
+import pandas as pd
+
+MANIFEST_NAME = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+class ArrayScaler:
+    """Drop-in for a fitted StandardScaler's transform, backed by plain arrays"""
+
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+def is_mmap_artifact(model_path):
+    return os.path.isfile(os.path.join(model_path, MANIFEST_NAME))
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def export_mmap_artifact(model_components, out_dir):
+    """
+    Write model components (with a compiled 'tree_engine') as a memory-mapped artifact
+
+    The artifact is written and fsynced in a hidden sibling directory, then
+    renamed to out_dir. An existing artifact there is moved aside first and
+    removed afterwards, never written to, so workers that have its arrays
+    memory-mapped keep reading the old files.
+
+    Args:
+        model_components: Components returned by load_model(..., compile_trees=True)
+        out_dir: Directory to create or replace
+    """
+    from model.tree_engine import compile_tree_engine
+    from model.tree_attribution import compile_tree_attribution
+
+    tree_engine = model_components.get('tree_engine') or compile_tree_engine(model_components)
+    tree_attribution = (model_components.get('tree_attribution')
+                        or compile_tree_attribution(model_components, tree_engine['ensemble']))
+    scaler = model_components['scaler']
+
+    arrays = {
+        'scaler_mean': scaler.mean_,
+        'scaler_scale': scaler.scale_,
+        'feature_means': model_components['feature_means'].to_numpy(),
+        'feature_stds': model_components['feature_stds'].to_numpy(),
+        'feature_importances': model_components['ensemble'].named_estimators_['rf1'].feature_importances_
+    }
+    engines = {}
+    for name, engine in tree_engine.items():
+        engines[name] = {'max_depth': int(engine.max_depth)}
+        for field, array in engine.to_arrays().items():
+            arrays[f'{name}_{field}'] = array
+    for field, array in tree_attribution.to_arrays().items():
+        arrays[f'attribution_{field}'] = array
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_version': model_components.get('model_version'),
+        'features': model_components['feature_means'].index.tolist(),
+        'accuracy': model_components.get('accuracy'),
+        'engines': engines,
+        'arrays': sorted(arrays)
+    }
+
+    out_dir = os.path.abspath(out_dir.rstrip('/'))
+    parent, name = os.path.split(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    # Hidden, so the model registry does not list it while it is written
+    staging = tempfile.mkdtemp(prefix=f'.{name}.', suffix='.tmp', dir=parent)
+    try:
+        for key, array in arrays.items():
+            with open(os.path.join(staging, f'{key}.npy'), 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+                f.flush()
+                os.fsync(f.fileno())
+        # The manifest is written last so a partially written artifact is never loadable
+        with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(staging)
+        os.chmod(staging, 0o755)
+
+        # A directory cannot be renamed over a non-empty one: move the old
+        # artifact aside, put the new one in place, then delete the old files
+        if os.path.exists(out_dir):
+            previous = tempfile.mkdtemp(prefix=f'.{name}.', suffix='.old', dir=parent)
+            os.rename(out_dir, os.path.join(previous, name))
+            try:
+                os.rename(staging, out_dir)
+            except OSError:
+                os.rename(os.path.join(previous, name), out_dir)
+                raise
+            shutil.rmtree(previous)
+        else:
+            os.rename(staging, out_dir)
+        _fsync_dir(parent)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def load_mmap_artifact(model_path):
+    """Open a memory-mapped artifact and return model components ready for scoring"""
+    from model.tree_engine import FlatTreeEnsemble
+    from model.tree_attribution import TreeAttribution
+    from model.feature_schema import FeatureSchema
+
+    with open(os.path.join(model_path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version: {manifest['format_version']}")
+
+    arrays = {
+        key: np.load(os.path.join(model_path, f'{key}.npy'), mmap_mode='r')
+        for key in manifest['arrays']
+    }
+    features = manifest['features']
+
+    tree_engine = {}
+    for name, meta in manifest['engines'].items():
+        engine_arrays = {field: arrays[f'{name}_{field}'] for field in FlatTreeEnsemble.ARRAY_FIELDS}
+        tree_engine[name] = FlatTreeEnsemble.from_arrays(engine_arrays, meta['max_depth'])
+
+    # Artifacts exported before attributions existed fall back to the importance heuristic
+    tree_attribution = None
+    if all(f'attribution_{field}' in arrays for field in TreeAttribution.ARRAY_FIELDS):
+        attribution_arrays = {field: arrays[f'attribution_{field}'] for field in TreeAttribution.ARRAY_FIELDS}
+        tree_attribution = TreeAttribution.from_arrays(attribution_arrays, len(features))
+
+    model_components = {
+        'scaler': ArrayScaler(arrays['scaler_mean'], arrays['scaler_scale']),
+        'feature_means': pd.Series(arrays['feature_means'], index=features),
+        'feature_stds': pd.Series(arrays['feature_stds'], index=features),
+        'feature_importances': arrays['feature_importances'],
+        'tree_engine': tree_engine,
+        'tree_attribution': tree_attribution,
+        'model_version': manifest['model_version'],
+        'accuracy': manifest['accuracy'],
+        # Artifacts of models with shared ensemble members export their trees
+        # once, in the 'ensemble' engine only
+        'shared_members': 'members' not in tree_engine,
+        'voting_weights': np.asarray(tree_engine['ensemble'].member_to_output[:, 0])
+    }
+    model_components['feature_schema'] = FeatureSchema(model_components)
+    return model_components
+
+
+# Components load_model derives from the artifact rather than reads from it
+DERIVED_KEYS = ('model_version', 'feature_schema', 'shared_members', 'voting_weights',
+                'tree_engine', 'tree_attribution')
+
+
+def export_pickle_artifact(model_components, path):
+    """
+    Write model components loaded from a pickle back as a joblib pickle
+
+    Derived components are left out. The pickler stores an object referenced
+    twice only once, so after load_model has shared the ensemble's members
+    with rf_model1, rf_model2, gb_model1 and gb_model2, every tree is
+    written a single time.
+    """
+    joblib.dump({key: value for key, value in model_components.items() if key not in DERIVED_KEYS}, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a joblib model pickle into a memory-mapped artifact")
+    parser.add_argument('source', help='Path to the joblib model pickle')
+    parser.add_argument('target', help='Directory to write the memory-mapped artifact to')
+    parser.add_argument('--pickle', action='store_true',
+                        help='Write a deduplicated joblib pickle to target instead')
+    args = parser.parse_args()
+
+    from model.load_model import load_model
+
+    if args.pickle:
+        model_components = load_model(args.source)
+        if not model_components['shared_members']:
+            print("Ensemble members differ from the individual models; both copies are kept")
+        export_pickle_artifact(model_components, args.target)
+        print(f"Wrote {args.target} ({os.path.getsize(args.target) / 1e6:.1f} MB, "
+              f"was {os.path.getsize(args.source) / 1e6:.1f} MB)")
+        return
+
+    model_components = load_model(args.source, compile_trees=True)
+    export_mmap_artifact(model_components, args.target)
+    size = sum(os.path.getsize(os.path.join(args.target, name)) for name in os.listdir(args.target))
+    print(f"Wrote {args.target} ({size / 1e6:.1f} MB, model version {model_components['model_version']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+Offline batch scoring of CSV or Parquet files, without the HTTP server.
+
+    python -m model.batch_score patients.csv scores.parquet --workers 8
+
+The input is read in chunks of --chunk-rows rows. Each chunk is validated
+like a /predict request and scored by predict_heart_disease_batch in one of
+--workers processes, each of which loads the model artifact once. Every
+finished chunk is written to its own part file under <output>.parts/ so a
+crashed or interrupted job resumes from the first unfinished chunk when the
+same command is run again. When all chunks are done the parts are merged
+into the output file in input order and removed.
+
+Output rows carry the 1-based input row number, any --keep-columns, and
+either the prediction fields or the validation error of the row. CSV and
+Parquet outputs are flat (nested fields are JSON strings); JSONL lines hold
+the full result dictionary, as returned by /predict. Key contributors are
+ranked by the importance heuristic unless --attributions is given.
+
+Parquet input and output need pyarrow.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from model.feature_info import FEATURE_INFO
+from model.load_model import load_model
+from model.tree_attribution import compile_tree_attribution
+from model.predict import predict_heart_disease_batch
+from schema import validate_patient
+
+# File extensions of the supported input and output formats
+INPUT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet'}
+OUTPUT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+PART_EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'jsonl': 'jsonl'}
+
+JOB_FILE = 'job.json'
+
+# Result columns of flat (CSV and Parquet) outputs and their types, so every
+# part file has the same columns whichever of its rows are invalid
+RESULT_COLUMNS = {
+    'heart_disease_probability': 'float64',
+    'binary_prediction': 'Int8',
+    'risk_level': 'string',
+    'risk_category': 'string',
+    'uncertainty_percent': 'float64',
+    'reliability_percent': 'float64',
+    'assessment': 'string',
+    'abnormal_features': 'string',
+    'key_contributors': 'string',
+    'clinical_insights': 'string',
+    'visualization': 'string'
+}
+
+# Model components of a scoring process, loaded once by _init_worker
+_worker_components = None
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit("Parquet files need pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def file_format(path, formats, requested=None):
+    """Resolve a file format from an explicit choice or the path's extension"""
+    if requested:
+        return requested
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in formats:
+        raise ValueError(f"Cannot tell the format of {path}; pass it explicitly")
+    return formats[extension]
+
+
+def iter_input_chunks(path, fmt, chunk_rows, columns):
+    """Yield DataFrames of up to chunk_rows rows with the given columns"""
+    if fmt == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+    else:
+        _, parquet = _require_pyarrow()
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+
+
+def input_rows(path, fmt):
+    """Number of input rows when known up front (Parquet metadata), else None"""
+    if fmt != 'parquet':
+        return None
+    _, parquet = _require_pyarrow()
+    return parquet.ParquetFile(path).metadata.num_rows
+
+
+def _init_worker(model_path, compile_trees, attributions):
+    global _worker_components
+    _worker_components = load_model(model_path, compile_trees=compile_trees)
+    _add_attribution(_worker_components, attributions)
+
+
+def _add_attribution(model_components, attributions):
+    # Pickles loaded without the tree engine need the attribution engine
+    # compiled on its own (memory-mapped artifacts carry it)
+    if attributions and model_components.get('tree_attribution') is None and 'ensemble' in model_components:
+        model_components['tree_attribution'] = compile_tree_attribution(model_components)
+
+
+def flatten_result(result):
+    """Flat column values of one prediction result for CSV and Parquet output"""
+    prediction = result['prediction']
+    uncertainty = result['uncertainty']
+    row = {
+        'heart_disease_probability': float(prediction['heart_disease_probability']),
+        'binary_prediction': prediction['binary_prediction'],
+        'risk_level': prediction['risk_level'],
+        'risk_category': prediction['risk_category'],
+        'uncertainty_percent': float(uncertainty['uncertainty_percent']),
+        'reliability_percent': float(uncertainty['reliability_percent']),
+        'assessment': uncertainty['assessment'],
+        'abnormal_features': json.dumps(result['abnormal_features']),
+        'key_contributors': json.dumps(result['key_contributors'])
+    }
+    if result['clinical_insights'] is not None:
+        row['clinical_insights'] = json.dumps(result['clinical_insights'])
+    if 'visualization' in result:
+        row['visualization'] = result['visualization']
+    return row
+
+
+def result_columns(options):
+    """Result columns of flat outputs with the given options, and their types"""
+    columns = dict(RESULT_COLUMNS)
+    if not options['insights']:
+        del columns['clinical_insights']
+    if not options['visualization_dir']:
+        del columns['visualization']
+    return columns
+
+
+def score_frame(frame, first_row, options):
+    """
+    Validate and score one chunk
+
+    Returns:
+        List of output records (dicts) in input order; rows are numbered
+        from first_row
+    """
+    records = frame.to_dict('records')
+    validated = [validate_patient({feature: record[feature] for feature in FEATURE_INFO}) for record in records]
+    patients = [patient for patient, _ in validated if patient is not None]
+
+    results, z_scores = predict_heart_disease_batch(
+        patients, _worker_components,
+        return_z_scores=True,
+        include_insights=options['insights'],
+        include_attributions=options['attributions']
+    )
+    if options['visualization_dir']:
+        from utils.virtualization import visualization_id, visualize_z_scores
+        import base64
+        schema = _worker_components['feature_schema']
+        for result, patient_z_scores in zip(results, z_scores):
+            # IDs are content-addressed, so identical plots are rendered once
+            name = f"{visualization_id(patient_z_scores, schema, result)}.png"
+            path = os.path.join(options['visualization_dir'], name)
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(base64.b64decode(visualize_z_scores(patient_z_scores, schema, result)))
+            result['visualization'] = name
+
+    output = []
+    results = iter(results)
+    for offset, (record, (patient, error)) in enumerate(zip(records, validated)):
+        row = {'row': first_row + offset}
+        row.update((column, record[column]) for column in options['keep_columns'])
+        if patient is None:
+            row['error'] = error
+        elif options['output_format'] == 'jsonl':
+            row['result'] = next(results)
+        else:
+            row['error'] = None
+            row.update(flatten_result(next(results)))
+        output.append(row)
+    return output
+
+
+def write_part(records, path, options):
+    """Write one chunk's output records to path, atomically"""
+    fmt = options['output_format']
+    temp_path = path + '.tmp'
+    if fmt == 'jsonl':
+        with open(temp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, default=_json_default) + '\n')
+    else:
+        dtypes = {'error': 'string', **result_columns(options)}
+        columns = ['row'] + options['keep_columns'] + list(dtypes)
+        frame = pd.DataFrame.from_records(records, columns=columns).astype(dtypes)
+        if fmt == 'csv':
+            frame.to_csv(temp_path, index=False)
+        else:
+            pyarrow, parquet = _require_pyarrow()
+            parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), temp_path)
+    os.replace(temp_path, path)
+
+
+def _json_default(value):
+    # Kept input columns may hold numpy scalars
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def score_chunk_task(index, first_row, frame, part_path, options):
+    """Score one chunk in a scoring process and write its part file"""
+    start = time.perf_counter()
+    records = score_frame(frame, first_row, options)
+    write_part(records, part_path, options)
+    errors = sum(1 for record in records if record.get('error') is not None)
+    return index, len(records), errors, time.perf_counter() - start
+
+
+def merge_parts(part_paths, output_path, fmt):
+    """Concatenate part files, in order, into the output file"""
+    temp_path = output_path + '.tmp'
+    if fmt == 'parquet':
+        _, parquet = _require_pyarrow()
+        writer = None
+        for part_path in part_paths:
+            table = parquet.read_table(part_path)
+            if writer is None:
+                writer = parquet.ParquetWriter(temp_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is not None:
+            writer.close()
+    else:
+        with open(temp_path, 'wb') as out:
+            for i, part_path in enumerate(part_paths):
+                with open(part_path, 'rb') as part:
+                    if fmt == 'csv' and i > 0:
+                        part.readline()  # header
+                    shutil.copyfileobj(part, out, 1 << 20)
+    os.replace(temp_path, output_path)
+
+
+def job_description(args, input_format, output_format, model_version):
+    """Settings that must match for a job to resume from existing part files"""
+    stat = os.stat(args.input)
+    return {
+        'input': os.path.abspath(args.input),
+        'input_size': stat.st_size,
+        'input_mtime': stat.st_mtime,
+        'input_format': input_format,
+        'output_format': output_format,
+        'chunk_rows': args.chunk_rows,
+        'keep_columns': args.keep_columns,
+        'insights': not args.no_insights,
+        'attributions': args.attributions,
+        'visualization_dir': args.visualization_dir,
+        'model_version': model_version
+    }
+
+
+def prepare_parts_dir(parts_dir, job, restart):
+    """
+    Create or reuse the part-file directory of a job
+
+    Returns:
+        Set of chunk indices already completed by a previous run
+    """
+    job_path = os.path.join(parts_dir, JOB_FILE)
+    if os.path.isdir(parts_dir) and not restart:
+        with open(job_path) as f:
+            previous = json.load(f)
+        if previous != job:
+            changed = ', '.join(key for key in job if previous.get(key) != job[key])
+            sys.exit(f"{parts_dir} belongs to a job with different settings ({changed}); "
+                     f"use --restart to discard it")
+        extension = '.' + PART_EXTENSIONS[job['output_format']]
+        return {
+            int(name[len('chunk-'):-len(extension)])
+            for name in os.listdir(parts_dir)
+            if name.startswith('chunk-') and name.endswith(extension)
+        }
+
+    if os.path.isdir(parts_dir):
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir)
+    with open(job_path, 'w') as f:
+        json.dump(job, f, indent=2)
+    return set()
+
+
+class Progress:
+    """Prints rows/s and, when the input size is known, the remaining time"""
+
+    def __init__(self, total_rows, done_rows, interval):
+        self.total_rows = total_rows
+        self.done_rows = done_rows
+        self.rows = 0
+        self.errors = 0
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, rows, errors):
+        self.rows += rows
+        self.errors += errors
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        done = self.done_rows + self.rows
+        invalid = f"{self.errors:,} invalid" + (" this run" if self.done_rows else "")
+        line = f"{done:,} rows scored ({invalid}), {rate:,.0f} rows/s"
+        if self.total_rows and rate > 0:
+            remaining = (self.total_rows - done) / rate
+            line += f", {100 * done / self.total_rows:.1f}%, ~{remaining / 60:.1f} min left"
+        print(line, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        print(f"Scored {self.rows:,} rows ({self.errors:,} invalid) in {elapsed:.1f} s: {rate:,.0f} rows/s")
+        if self.done_rows:
+            print(f"Resumed after {self.done_rows:,} rows completed by a previous run")
+
+
+def run(args):
+    input_format = file_format(args.input, INPUT_FORMATS, args.input_format)
+    output_format = file_format(args.output, OUTPUT_FORMATS, args.output_format)
+    if 'parquet' in (input_format, output_format):
+        _require_pyarrow()
+    if args.visualization_dir:
+        os.makedirs(args.visualization_dir, exist_ok=True)
+
+    # Chunks are large enough to be scored with the sklearn models, so the
+    # tree engine is not compiled (memory-mapped artifacts always carry it)
+    print("Loading model...")
+    model_components = load_model(args.model)
+    job = job_description(args, input_format, output_format, model_components['model_version'])
+    parts_dir = args.output + '.parts'
+    completed = prepare_parts_dir(parts_dir, job, args.restart)
+
+    options = {
+        'output_format': output_format,
+        'keep_columns': args.keep_columns,
+        'insights': not args.no_insights,
+        'attributions': args.attributions,
+        'visualization_dir': args.visualization_dir
+    }
+    columns = list(dict.fromkeys(list(FEATURE_INFO) + args.keep_columns))
+    part_name = 'chunk-{:08d}.' + PART_EXTENSIONS[output_format]
+
+    if args.workers == 0:
+        # Score in this process, reusing the model already loaded
+        global _worker_components
+        _worker_components = model_components
+        _add_attribution(_worker_components, args.attributions)
+        executor = None
+    else:
+        del model_components
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(args.model, False, args.attributions)
+        )
+
+    total_rows = input_rows(args.input, input_format)
+    done_rows = 0
+    progress = None
+    pending = set()
+    n_chunks = 0
+    try:
+        first_row = 1
+        for index, frame in enumerate(iter_input_chunks(args.input, input_format, args.chunk_rows, columns)):
+            n_chunks = index + 1
+            chunk_first_row = first_row
+            first_row += len(frame)
+            if index in completed:
+                done_rows += len(frame)
+                continue
+            if progress is None:
+                progress = Progress(total_rows, done_rows, args.progress_interval)
+
+            part_path = os.path.join(parts_dir, part_name.format(index))
+            if executor is None:
+                _, rows, errors, _ = score_chunk_task(index, chunk_first_row, frame, part_path, options)
+                progress.update(rows, errors)
+                continue
+
+            # Keep a bounded number of chunks in memory
+            while len(pending) >= 2 * args.workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _, rows, errors, _ = future.result()
+                    progress.update(rows, errors)
+            pending.add(executor.submit(score_chunk_task, index, chunk_first_row, frame, part_path, options))
+
+        for future in pending:
+            _, rows, errors, _ = future.result()
+            progress.update(rows, errors)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if n_chunks == 0:
+        sys.exit(f"{args.input} has no rows")
+    if progress is None:
+        progress = Progress(total_rows, done_rows, args.progress_interval)
+    progress.report(time.perf_counter())
+
+    print(f"Merging {n_chunks} chunk(s) into {args.output}...")
+    merge_parts([os.path.join(parts_dir, part_name.format(i)) for i in range(n_chunks)], args.output, output_format)
+    shutil.rmtree(parts_dir)
+    progress.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV or Parquet file with the heart.csv feature columns')
+    parser.add_argument('output', help='Output file (.csv, .parquet or .jsonl)')
+    parser.add_argument('--model', default='heart_model_ensemble.pkl', help='Model artifact (pickle or .mmap directory)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Scoring processes; 0 scores in this process')
+    parser.add_argument('--chunk-rows', type=int, default=20000, help='Rows per chunk (and per part file)')
+    parser.add_argument('--input-format', choices=sorted(set(INPUT_FORMATS.values())))
+    parser.add_argument('--output-format', choices=sorted(set(OUTPUT_FORMATS.values())))
+    parser.add_argument('--keep-columns', default='', help='Comma-separated input columns copied to the output')
+    parser.add_argument('--no-insights', action='store_true', help='Skip clinical insights')
+    parser.add_argument('--attributions', action='store_true',
+                        help='Rank key contributors by exact tree attributions (about 4 ms per row)')
+    parser.add_argument('--visualization-dir', help='Render feature profile PNGs into this directory (slow)')
+    parser.add_argument('--restart', action='store_true', help='Discard part files of a previous run')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+    args.keep_columns = [column for column in args.keep_columns.split(',') if column]
+
+    try:
+        run(args)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
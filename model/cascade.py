@@ -0,0 +1,452 @@
+"""
+Early-exit cascade over the ensemble's trees.
+
+    python -m model.cascade heart_model_ensemble.pkl heart.csv --target 0.99
+
+A full prediction evaluates every tree of the four base models on the
+patient and on its 50 bootstrap rows. The cascade first evaluates a
+prefix of each base model's trees on the same rows: the first trees of
+each random forest, and the first stages of each gradient-boosted model
+(its staged prediction). Each base model's partial tree sum is mapped onto
+an estimate of its full sum by a linear fit, and the estimates are
+combined exactly like full predictions (soft vote, bootstrap uncertainty).
+A patient exits with the estimate when its estimated probability lies at
+least `margin` away from every probability threshold a result depends on
+(the RISK_LEVELS bands, the binary prediction and the clinical insight
+bands) and its estimated uncertainty is at most `max_uncertainty`. The
+bootstrap spread of a few trees is a poor estimate of the full one except
+where it is small, hence the cap. Otherwise the remaining trees are
+evaluated and added to the partial sums, which gives exactly the full
+prediction.
+
+The prefix share, the linear maps, the margin and the uncertainty cap are
+calibrated offline. The unique rows of heart.csv are first split into a
+calibration and a held-out share, and each share gets its own synthetic
+patients mixed from its rows only (as for the fast-mode surrogate, see
+model/surrogate.py). An exit agrees with the full path when the risk
+level, binary prediction, insight band, reliability assessment and
+uncertainty insight all come out the same. On the calibration rows: for
+every candidate prefix share and uncertainty cap, the smallest margin
+whose exits agree with the full path on at least the target share of rows
+while their uncertainty is off by at most MAX_UNCERTAINTY_MAE points on
+average (both with headroom, see CONFIDENCE_Z); of those, the one evaluating
+the fewest trees per patient on average wins. The winner is then checked
+on the held-out rows, and the calibration fails unless it meets both
+bounds there too. The calibration is saved next to its artifact
+(<base>.cascade.json, see cascade_path) and only used with the model
+version it was calibrated for.
+
+The cascade needs the flat-array tree engine and an ensemble whose members
+are the base models ('shared_members'); without them the model is served
+without the cascade. It applies where the engine scores the bootstrap rows
+(see TREE_ENGINE_MAX_ROWS in model/predict.py).
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+CASCADE_FORMAT_VERSION = 2
+CASCADE_SUFFIX = '.cascade.json'
+
+# Candidate shares of each base model's trees in the first stage
+STAGE_FRACTIONS = (0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5)
+DEFAULT_AGREEMENT_TARGET = 0.99
+
+# Candidate caps on the estimated uncertainty percent of early exits, and
+# the largest mean uncertainty error (in points) allowed on early exits
+UNCERTAINTY_CAPS = tuple(np.arange(2.5, 50.1, 2.5))
+MAX_UNCERTAINTY_MAE = 1.0
+
+# Synthetic patients added to the data rows for calibration (see
+# distillation_rows in model/surrogate.py), and share of the data rows (and
+# of the synthetic patients) held out to check the calibrated cascade
+SYNTHETIC_ROWS = 3000
+HOLDOUT_FRACTION = 0.25
+
+# The margin is picked so that the one-sided 95% confidence bounds of the
+# agreement and of the mean uncertainty error of exits on the calibration
+# rows (normal approximation) meet their limits, leaving headroom for rows
+# the calibration has not seen
+CONFIDENCE_Z = 1.645
+
+
+def cascade_path(model_path):
+    """Path of the cascade calibration of a model artifact (pickle or mmap directory)"""
+    return os.path.splitext(model_path.rstrip('/'))[0] + CASCADE_SUFFIX
+
+
+def cascade_engine(model_components):
+    """
+    The tree engine exporting the ensemble's base models
+
+    Raises:
+        ValueError: If the model has no tree engine or its ensemble members
+            are not the base models
+    """
+    tree_engine = model_components.get('tree_engine')
+    if tree_engine is None:
+        raise ValueError("The early-exit cascade needs the tree engine (load the model with compile_trees=True)")
+    if not model_components.get('shared_members'):
+        raise ValueError("The early-exit cascade needs an ensemble whose members are the base models")
+    return tree_engine['ensemble']
+
+
+def first_stage_trees(engine, fraction):
+    """Indices of the first ceil(fraction * n) trees of each base model of a tree engine"""
+    tree_members = np.argmax(engine.tree_to_member, axis=1)
+    trees = []
+    for member in range(engine.tree_to_member.shape[1]):
+        member_trees = np.flatnonzero(tree_members == member)
+        trees.append(member_trees[:int(np.ceil(fraction * len(member_trees)))])
+    return np.sort(np.concatenate(trees))
+
+
+def probability_thresholds():
+    """Probabilities at which a result changes: RISK_LEVELS edges, the binary threshold and insight bands"""
+    from model.predict import RISK_LEVELS, BINARY_THRESHOLD
+    from model.clinical_insights import RISK_BAND_RULES
+
+    edges = ([high for _, high in RISK_LEVELS][:-1] + [BINARY_THRESHOLD]
+             + [bound for bound, _, _ in RISK_BAND_RULES][:-1])
+    return np.unique(edges)
+
+
+def decision_margin(probabilities, thresholds):
+    """Distance of each probability to the nearest threshold"""
+    return np.abs(np.asarray(probabilities)[:, np.newaxis] - thresholds).min(axis=1)
+
+
+def decisions(probabilities, uncertainty_percents, thresholds):
+    """
+    (n_patients, n_decisions) matrix of the thresholded outcomes of results:
+    which side of each probability threshold, reliability assessment bound
+    and the uncertainty insight bound (UNCERTAINTY_RULE) each patient is on
+    """
+    from model.predict import RELIABILITY_LEVELS
+    from model.clinical_insights import UNCERTAINTY_RULE
+
+    return np.column_stack(
+        [probabilities >= threshold for threshold in thresholds]
+        + [uncertainty_percents >= bound for bound, _ in RELIABILITY_LEVELS[:-1]]
+        + [uncertainty_percents > UNCERTAINTY_RULE[0] * 100]
+    )
+
+
+def summarize(member_probs, voting_weights):
+    """
+    Probability and uncertainty percent of per-patient base-model
+    probabilities, as predict computes them
+
+    Args:
+        member_probs: (n_patients, 1 + bootstrap samples, n_members): the
+            clean row, then the bootstrap rows of each patient
+        voting_weights: Soft-vote weights of the members
+    """
+    proba = member_probs[:, 0] @ voting_weights
+    bootstrap_std = np.std(member_probs[:, 1:].mean(axis=2), axis=1)
+    uncertainty = np.minimum(np.sqrt(bootstrap_std**2 + np.var(member_probs[:, 0], axis=1)) * 400, 100)
+    return proba, uncertainty
+
+
+class EarlyExitCascade:
+    """Calibrated two-stage evaluation of a tree engine (see the module docstring)"""
+
+    def __init__(self, engine, calibration):
+        self.engine = engine
+        self.calibration = calibration
+        self.first_trees = first_stage_trees(engine, calibration['stage_fraction'])
+        self.rest_trees = np.setdiff1d(np.arange(engine.n_trees), self.first_trees)
+        self.slope = np.asarray(calibration['slope'])
+        self.intercept = np.asarray(calibration['intercept'])
+        self.margin = calibration['margin']
+        self.max_uncertainty = calibration['max_uncertainty']
+        self.voting_weights = np.asarray(engine.member_to_output[:, 0])
+        self.thresholds = probability_thresholds()
+
+    def member_proba(self, batch, n_patients):
+        """
+        Base-model probabilities of a bootstrap batch, exiting early where confident
+
+        Args:
+            batch: Scaled rows: the n_patients clean rows, then the same
+                number of bootstrap rows for every patient, patient by patient
+            n_patients: Number of patients in the batch
+
+        Returns:
+            (member probabilities of shape (len(batch), n_members): estimates
+            for the rows of patients that exited, exact for the others;
+            boolean mask of the patients that exited)
+        """
+        first = self.engine.tree_sums(batch, self.first_trees)
+        member_probs = self.engine.sums_to_proba(first * self.slope + self.intercept)
+        n_samples = (len(batch) - n_patients) // n_patients
+        proba, uncertainty = summarize(
+            np.concatenate([member_probs[:n_patients, np.newaxis],
+                            member_probs[n_patients:].reshape(n_patients, n_samples, -1)], axis=1),
+            self.voting_weights)
+        exited = ((decision_margin(proba, self.thresholds) >= self.margin)
+                  & (uncertainty <= self.max_uncertainty))
+        if exited.all():
+            return member_probs, exited
+
+        # Clean and bootstrap rows of the patients going on to the full evaluation
+        bootstrap_rows = n_patients + np.arange(n_patients * n_samples).reshape(n_patients, n_samples)
+        rows = np.concatenate([np.flatnonzero(~exited), bootstrap_rows[~exited].ravel()])
+        sums = first[rows] + self.engine.tree_sums(batch[rows], self.rest_trees)
+        member_probs[rows] = self.engine.sums_to_proba(sums)
+        return member_probs, exited
+
+
+def load_cascade(model_components, path):
+    """
+    Attach the cascade calibrated at path to loaded model components, if it
+    was calibrated for their model version and they support it
+
+    Returns:
+        The EarlyExitCascade, or None
+    """
+    with open(path) as f:
+        calibration = json.load(f)
+    if calibration.get('format_version') != CASCADE_FORMAT_VERSION:
+        print(f"Ignoring {path}: cascade format version {calibration.get('format_version')}, not "
+              f"{CASCADE_FORMAT_VERSION}; recalibrate with python -m model.cascade")
+        return None
+    if calibration['source_version'] != model_components['model_version']:
+        print(f"Ignoring {path}: calibrated for model version {calibration['source_version']}, "
+              f"not {model_components['model_version']}")
+        return None
+    try:
+        engine = cascade_engine(model_components)
+    except ValueError as e:
+        print(f"Ignoring {path}: {e}; serving without the cascade")
+        return None
+    return EarlyExitCascade(engine, calibration)
+
+
+def _stage_tree_sums(engine, schema, values, stages, num_bootstrap_samples):
+    """
+    Member tree sums of every patient's clean and bootstrap rows, over all
+    trees and over each stage's trees
+
+    Returns:
+        (full sums of shape (n_patients, 1 + samples, n_members), list of
+        the same per stage)
+    """
+    from model.predict import input_seed
+
+    full_sums, stage_sums = [], [[] for _ in stages]
+    for row in values:
+        scaled = schema.scale(row[np.newaxis, :])
+        noise = np.random.default_rng(input_seed(row)).normal(0, 0.05, size=(num_bootstrap_samples, len(row)))
+        leaves = engine.value[engine.apply(np.vstack([scaled, scaled + noise]))]
+        full_sums.append(leaves @ engine.tree_to_member)
+        for sums, trees in zip(stage_sums, stages):
+            sums.append(leaves[:, trees] @ engine.tree_to_member[trees])
+    return np.array(full_sums), [np.array(sums) for sums in stage_sums]
+
+
+def _stage_report(engine, trees, stage_sums, full_sums, slope, intercept, margin, max_uncertainty,
+                  voting_weights, thresholds):
+    """Exit rate, tree count and agreement with the full path of one stage, margin and cap on some rows"""
+    full_proba, full_uncertainty = summarize(engine.sums_to_proba(full_sums), voting_weights)
+    proba, uncertainty = summarize(engine.sums_to_proba(stage_sums * slope + intercept), voting_weights)
+    # Patients that do not exit get the full evaluation, which always agrees
+    exited = (decision_margin(proba, thresholds) >= margin) & (uncertainty <= max_uncertainty)
+    wrong = (decisions(proba, uncertainty, thresholds)
+             != decisions(full_proba, full_uncertainty, thresholds)).any(axis=1)
+    error = np.abs(proba - full_proba)[exited]
+    uncertainty_error = np.abs(uncertainty - full_uncertainty)[exited]
+    return {
+        'rows': int(len(proba)),
+        'first_stage_trees': int(len(trees)),
+        'full_trees': int(engine.n_trees),
+        'mean_trees': float(len(trees) + np.mean(~exited) * (engine.n_trees - len(trees))),
+        'exit_rate': float(np.mean(exited)),
+        'decision_agreement': float(1 - np.mean(exited & wrong)),
+        'max_abs_error': float(error.max()) if exited.any() else 0.0,
+        'mean_abs_error': float(error.mean()) if exited.any() else 0.0,
+        'uncertainty_mae': float(uncertainty_error.mean()) if exited.any() else 0.0,
+        'max_uncertainty_error': float(uncertainty_error.max()) if exited.any() else 0.0
+    }
+
+
+def _smallest_margin(margins, wrong, uncertainty_error, n_rows, target):
+    """
+    Smallest exit margin over some candidate exits that keeps the agreement
+    at the target and the mean uncertainty error within MAX_UNCERTAINTY_MAE,
+    both at their one-sided confidence bound (see CONFIDENCE_Z), or None
+
+    Args:
+        margins, wrong, uncertainty_error: Per candidate exit: its decision
+            margin, whether any decision differs from the full path, and its
+            uncertainty error
+        n_rows: Rows the agreement is measured over (exits and others)
+        target: Minimum agreement
+    """
+    order = np.argsort(margins)
+    margins, wrong, uncertainty_error = margins[order], wrong[order], uncertainty_error[order]
+    # With the margin at margins[i], candidates i onwards exit
+    n_exits = np.arange(len(margins), 0, -1)
+    agreement = 1 - np.cumsum(wrong[::-1])[::-1] / n_rows
+    mean_error = np.cumsum(uncertainty_error[::-1])[::-1] / n_exits
+    error_variance = np.maximum(np.cumsum(uncertainty_error[::-1]**2)[::-1] / n_exits - mean_error**2, 0)
+    valid = ((agreement - CONFIDENCE_Z * np.sqrt(agreement * (1 - agreement) / n_rows) >= target)
+             & (mean_error + CONFIDENCE_Z * np.sqrt(error_variance / n_exits) <= MAX_UNCERTAINTY_MAE)
+             & np.concatenate([[True], margins[1:] != margins[:-1]]))
+    return float(margins[np.argmax(valid)]) if valid.any() else None
+
+
+def calibrate(model_components, data_path, target=DEFAULT_AGREEMENT_TARGET, n_synthetic=SYNTHETIC_ROWS,
+              num_bootstrap_samples=50, seed=42):
+    """
+    Calibrate the cascade of a loaded model on the unique rows of a CSV and
+    synthetic mixes of them, and check it on held-out rows
+
+    Args:
+        model_components: Components from load_model(..., compile_trees=True)
+        data_path: CSV with the model's feature columns (extra columns are ignored)
+        target: Minimum share of rows whose thresholded results (risk level,
+            binary prediction, insight band, reliability assessment,
+            uncertainty insight) must match the full path, on the
+            calibration rows and on the held-out rows
+        n_synthetic: Synthetic rows added to the data rows (split like them)
+        num_bootstrap_samples: Bootstrap rows per patient, as in predict
+        seed: Seed of the split and the synthetic rows
+
+    Returns:
+        Calibration dictionary, as saved by save_cascade
+
+    Raises:
+        ValueError: If the model does not support the cascade, or no stage
+            reaches the target within MAX_UNCERTAINTY_MAE on the
+            calibration rows and then on the held-out rows
+    """
+    import pandas as pd
+    from model.feature_schema import get_feature_schema
+    from model.surrogate import distillation_rows
+
+    engine = cascade_engine(model_components)
+    schema = get_feature_schema(model_components)
+    voting_weights = np.asarray(engine.member_to_output[:, 0])
+    thresholds = probability_thresholds()
+    stages = [first_stage_trees(engine, fraction) for fraction in STAGE_FRACTIONS]
+
+    # Split the data rows before synthesizing, so no held-out row is a mix of calibration rows
+    data = pd.read_csv(data_path)[schema.features].dropna().drop_duplicates()
+    order = np.random.default_rng(seed).permutation(len(data))
+    n_holdout = int(len(data) * HOLDOUT_FRACTION)
+    n_holdout_synthetic = int(n_synthetic * HOLDOUT_FRACTION)
+    values, _ = distillation_rows(data.iloc[order[n_holdout:]], schema.features,
+                                  n_synthetic - n_holdout_synthetic, seed=seed)
+    holdout_values, _ = distillation_rows(data.iloc[order[:n_holdout]], schema.features,
+                                          n_holdout_synthetic, seed=seed + 1)
+
+    full_sums, stage_sums = _stage_tree_sums(engine, schema, values, stages, num_bootstrap_samples)
+    full_proba, full_uncertainty = summarize(engine.sums_to_proba(full_sums), voting_weights)
+    full_decisions = decisions(full_proba, full_uncertainty, thresholds)
+
+    best = None
+    for fraction, trees, first_sums in zip(STAGE_FRACTIONS, stages, stage_sums):
+        # Least-squares map of each base model's partial sum onto its full sum
+        fits = [np.polyfit(first_sums[:, :, m].ravel(), full_sums[:, :, m].ravel(), 1)
+                for m in range(full_sums.shape[2])]
+        slope, intercept = np.array(fits).T
+        proba, uncertainty = summarize(engine.sums_to_proba(first_sums * slope + intercept), voting_weights)
+        margins = decision_margin(proba, thresholds)
+        wrong = (decisions(proba, uncertainty, thresholds) != full_decisions).any(axis=1)
+        uncertainty_error = np.abs(uncertainty - full_uncertainty)
+
+        for max_uncertainty in UNCERTAINTY_CAPS:
+            capped = uncertainty <= max_uncertainty
+            margin = _smallest_margin(margins[capped], wrong[capped], uncertainty_error[capped], len(values),
+                                      target)
+            if margin is None:
+                continue
+            report = _stage_report(engine, trees, first_sums, full_sums, slope, intercept, margin,
+                                   max_uncertainty, voting_weights, thresholds)
+            if best is None or report['mean_trees'] < best['calibration']['mean_trees']:
+                best = {
+                    'stage_fraction': fraction,
+                    'slope': slope.tolist(),
+                    'intercept': intercept.tolist(),
+                    'margin': margin,
+                    'max_uncertainty': float(max_uncertainty),
+                    'calibration': report
+                }
+    if best is None:
+        raise ValueError(f"No cascade stage reaches {target:.1%} agreement with an uncertainty MAE of at most "
+                         f"{MAX_UNCERTAINTY_MAE} points")
+
+    trees = first_stage_trees(engine, best['stage_fraction'])
+    holdout_full_sums, (holdout_stage_sums,) = _stage_tree_sums(engine, schema, holdout_values, [trees],
+                                                                num_bootstrap_samples)
+    holdout = best['holdout'] = _stage_report(engine, trees, holdout_stage_sums, holdout_full_sums,
+                                              np.array(best['slope']), np.array(best['intercept']),
+                                              best['margin'], best['max_uncertainty'], voting_weights, thresholds)
+    if holdout['decision_agreement'] < target:
+        raise ValueError(f"The calibrated cascade agrees on {holdout['decision_agreement']:.1%} of "
+                         f"{holdout['rows']} held-out rows, below the {target:.1%} target")
+    if holdout['uncertainty_mae'] > MAX_UNCERTAINTY_MAE:
+        raise ValueError(f"The calibrated cascade's early exits on held-out rows are off by "
+                         f"{holdout['uncertainty_mae']:.2f} uncertainty points on average, above "
+                         f"{MAX_UNCERTAINTY_MAE}")
+
+    return {
+        'format_version': CASCADE_FORMAT_VERSION,
+        'source_version': model_components['model_version'],
+        'agreement_target': target,
+        'max_uncertainty_mae': MAX_UNCERTAINTY_MAE,
+        'data': os.path.abspath(data_path),
+        'holdout_fraction': HOLDOUT_FRACTION,
+        'seed': seed,
+        **best
+    }
+
+
+def save_cascade(calibration, path):
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+
+
+def print_calibration(calibration):
+    report = calibration['calibration']
+    print(f"  first stage: {calibration['stage_fraction']:.0%} of each base model's trees "
+          f"({report['first_stage_trees']} of {report['full_trees']}), exit margin {calibration['margin']:.3f}, "
+          f"estimated uncertainty at most {calibration['max_uncertainty']:g}%")
+    for name in ('calibration', 'holdout'):
+        report = calibration[name]
+        print(f"  {name} ({report['rows']} rows): {report['exit_rate']:.1%} exit early, {report['mean_trees']:.0f} "
+              f"trees per patient on average, decision agreement {report['decision_agreement']:.1%}")
+        print(f"    early exits: max |error| {report['max_abs_error']:.3f}, mean |error| "
+              f"{report['mean_abs_error']:.4f}, uncertainty MAE {report['uncertainty_mae']:.2f} points "
+              f"(max {report['max_uncertainty_error']:.1f})")
+
+
+def main():
+    from model.load_model import load_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('artifact', help='Model artifact (pickle file or mmap directory)')
+    parser.add_argument('data', help='CSV with the feature columns (e.g. heart.csv)')
+    parser.add_argument('--target', type=float, default=DEFAULT_AGREEMENT_TARGET,
+                        help='Minimum decision agreement with the full path (default 0.99)')
+    parser.add_argument('--output', help='Calibration file to write (default: <artifact base>.cascade.json)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data):
+        sys.exit(f"Data not found at {args.data}")
+    model_components = load_model(args.artifact, compile_trees=True)
+    try:
+        calibration = calibrate(model_components, args.data, target=args.target)
+    except ValueError as e:
+        sys.exit(str(e))
+    output = args.output or cascade_path(args.artifact)
+    save_cascade(calibration, output)
+    print(f"Wrote {output}")
+    print_calibration(calibration)
+
+
+if __name__ == '__main__':
+    main()
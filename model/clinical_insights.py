@@ -1,69 +1,239 @@
-def get_clinical_insights(risk_prob, uncertainty, abnormal_features, key_contributors):
-    """Generate clinical insights and recommendations based on prediction results"""
-    
-    insights = []
-    recommendations = []
-    
-    # Risk level assessment
-    if risk_prob < 0.2:
-        insights.append("Patient shows minimal indicators of heart disease.")
-        recommendations.append("Standard preventive care and lifestyle counseling advised.")
-    elif risk_prob < 0.4:
-        insights.append("Patient shows some risk factors for heart disease.")
-        recommendations.append("Consider lifestyle modifications and monitoring of risk factors.")
-    elif risk_prob < 0.6:
-        insights.append("Patient shows moderate risk factors for heart disease.")
-        recommendations.append("Further cardiac assessment recommended. Consider non-invasive testing.")
-    elif risk_prob < 0.8:
-        insights.append("Patient shows significant risk factors for heart disease.")
-        recommendations.append("Comprehensive cardiac evaluation indicated. Consider stress test and echocardiogram.")
-    else:
-        insights.append("Patient shows strong indicators of heart disease.")
-        recommendations.append("Urgent cardiology referral advised. Consider cardiac catheterization if symptomatic.")
-    
-    # Uncertainty insights
-    if uncertainty > 0.5:
-        insights.append("Model shows significant uncertainty in this prediction.")
-        recommendations.append("Consider additional diagnostic tests to confirm cardiovascular status.")
-    
-    # Feature-specific insights
-    for feature, details in abnormal_features.items():
-        if feature == 'cp' and details['value'] in [0, 1, 2]:
-            insights.append(f"Patient reports {details.get('readable_value', details['value'])}, which may indicate angina.")
-            if details['value'] == 0:  # Typical angina
-                recommendations.append("Evaluate for stable coronary artery disease.")
-        
-        elif feature == 'thalach' and details['direction'] == 'low':
-            insights.append("Maximum heart rate during exercise is abnormally low, suggesting reduced cardiac capacity.")
-            recommendations.append("Consider evaluation for chronotropic incompetence or ischemic heart disease.")
-        
-        elif feature == 'oldpeak' and details['direction'] == 'high':
-            insights.append("Significant ST depression observed during exercise, suggesting myocardial ischemia.")
-            recommendations.append("ECG monitoring during exercise recommended to assess for ischemic changes.")
-        
-        elif feature == 'chol' and details['direction'] == 'high':
-            insights.append("Elevated cholesterol levels may contribute to atherosclerotic disease.")
-            recommendations.append("Lipid management indicated. Consider statin therapy if appropriate.")
-        
-        elif feature == 'trestbps' and details['direction'] == 'high':
-            insights.append("Elevated resting blood pressure increases cardiac workload and stroke risk.")
-            recommendations.append("Blood pressure management recommended. Target <130/80 mmHg.")
-        
-        elif feature == 'ca' and details['value'] > 0:
-            insights.append(f"Fluoroscopy shows {int(details['value'])} major vessel(s) with calcium deposits.")
-            recommendations.append("Presence of calcified vessels indicates atherosclerotic disease.")
-        
-        elif feature == 'exang' and details['value'] == 1:
-            insights.append("Patient experiences angina during exercise, strongly associated with CAD.")
-            recommendations.append("Anti-anginal medication may be indicated.")
-            
-        elif feature == 'thal' and details['value'] in [1, 2]:
-            thal_value = details.get('readable_value', details['value'])
-            insights.append(f"Thallium scan shows {thal_value}, indicating abnormal blood flow.")
-            recommendations.append("Consider myocardial perfusion imaging to assess for reversible ischemia.")
-    
-    # Return combined insights
-    return {
-        "key_insights": insights[:5],  # Limit to top 5 insights
-        "recommendations": recommendations[:5]  # Limit to top 5 recommendations
-    }
\ No newline at end of file
+"""
+Clinical insights and recommendations as declarative rule tables.
+
+Every patient gets the insight and recommendation of its risk band, those
+of the uncertainty rule when the prediction is uncertain, and those of each
+FEATURE_RULES rule that fires on one of its abnormal features. Feature
+rules are applied in the order of the patient's abnormal features (most
+severe first) and, for the same feature, in table order. Each list is
+capped at MAX_INSIGHTS entries.
+
+InsightRules compiles the tables against a model's feature order (once, in
+FeatureSchema) into condition arrays and text ids. It evaluates them as
+boolean masks over a whole batch and places each patient's text ids by
+array indexing, so only the final lists are built per patient.
+"""
+from functools import lru_cache
+import numpy as np
+from model.feature_info import FEATURE_INFO
+
+# Risk bands: (upper probability bound, insight, recommendation); a patient
+# falls in the first band whose bound is above its probability
+RISK_BAND_RULES = [
+    (0.2, "Patient shows minimal indicators of heart disease.",
+     "Standard preventive care and lifestyle counseling advised."),
+    (0.4, "Patient shows some risk factors for heart disease.",
+     "Consider lifestyle modifications and monitoring of risk factors."),
+    (0.6, "Patient shows moderate risk factors for heart disease.",
+     "Further cardiac assessment recommended. Consider non-invasive testing."),
+    (0.8, "Patient shows significant risk factors for heart disease.",
+     "Comprehensive cardiac evaluation indicated. Consider stress test and echocardiogram."),
+    (np.inf, "Patient shows strong indicators of heart disease.",
+     "Urgent cardiology referral advised. Consider cardiac catheterization if symptomatic.")
+]
+
+# Added when the bootstrap uncertainty (as a fraction) is above the bound
+UNCERTAINTY_RULE = (0.5, "Model shows significant uncertainty in this prediction.",
+                    "Consider additional diagnostic tests to confirm cardiovascular status.")
+
+# Rules over abnormal features (FEATURE_INFO names). A rule fires when its
+# feature is abnormal and its condition holds:
+#   'values': the value is one of these FEATURE_INFO codes
+#   'above': the value is greater than this
+#   'direction': the z-score is 'high' (positive) or 'low'
+# In the texts, {label} is the FEATURE_INFO label of the value and {count}
+# the value as an integer. A rule may add only an insight or only a
+# recommendation.
+FEATURE_RULES = [
+    {'feature': 'cp', 'values': (0, 1, 2),
+     'insight': "Patient reports {label}, which may indicate angina."},
+    {'feature': 'cp', 'values': (0,),  # Typical angina
+     'recommendation': "Evaluate for stable coronary artery disease."},
+    {'feature': 'thalach', 'direction': 'low',
+     'insight': "Maximum heart rate during exercise is abnormally low, suggesting reduced cardiac capacity.",
+     'recommendation': "Consider evaluation for chronotropic incompetence or ischemic heart disease."},
+    {'feature': 'oldpeak', 'direction': 'high',
+     'insight': "Significant ST depression observed during exercise, suggesting myocardial ischemia.",
+     'recommendation': "ECG monitoring during exercise recommended to assess for ischemic changes."},
+    {'feature': 'chol', 'direction': 'high',
+     'insight': "Elevated cholesterol levels may contribute to atherosclerotic disease.",
+     'recommendation': "Lipid management indicated. Consider statin therapy if appropriate."},
+    {'feature': 'trestbps', 'direction': 'high',
+     'insight': "Elevated resting blood pressure increases cardiac workload and stroke risk.",
+     'recommendation': "Blood pressure management recommended. Target <130/80 mmHg."},
+    {'feature': 'ca', 'above': 0,
+     'insight': "Fluoroscopy shows {count} major vessel(s) with calcium deposits.",
+     'recommendation': "Presence of calcified vessels indicates atherosclerotic disease."},
+    {'feature': 'exang', 'values': (1,),
+     'insight': "Patient experiences angina during exercise, strongly associated with CAD.",
+     'recommendation': "Anti-anginal medication may be indicated."},
+    {'feature': 'thal', 'values': (1, 2),
+     'insight': "Thallium scan shows {label}, indicating abnormal blood flow.",
+     'recommendation': "Consider myocardial perfusion imaging to assess for reversible ischemia."}
+]
+
+# Insights and recommendations kept per patient
+MAX_INSIGHTS = 5
+
+
+def _text(template, labels, value):
+    """Fill a rule text for a feature value"""
+    return template.format(label=labels.get(int(value), value) if labels else value, count=int(value))
+
+
+class InsightRules:
+    """
+    The rule tables compiled against a feature order.
+
+    Feature rules whose feature the model does not have are dropped; rules
+    naming features or values FEATURE_INFO does not know raise ValueError.
+    """
+
+    def __init__(self, features):
+        features = list(features)
+        self.band_bounds = np.array([bound for bound, _, _ in RISK_BAND_RULES[:-1]])
+        self.band_texts = [(insight, recommendation) for _, insight, recommendation in RISK_BAND_RULES]
+
+        self.rules = []
+        for rule in FEATURE_RULES:
+            info = FEATURE_INFO.get(rule['feature'])
+            if info is None:
+                raise ValueError(f"Insight rule for unknown feature: {rule['feature']}")
+            if 'values' in rule and not set(rule['values']) <= set(info.get('values', ())):
+                raise ValueError(f"Insight rule for {rule['feature']} names values FEATURE_INFO does not define")
+            if rule['feature'] in features:
+                self.rules.append(rule)
+        self.columns = np.array([features.index(rule['feature']) for rule in self.rules], dtype=np.intp)
+        # Each feature has rules_per_feature text slots, one per rule in table
+        # order (slot_in_feature)
+        self.slot_in_feature = np.array([list(self.columns[:k]).count(column) for k, column in enumerate(self.columns)],
+                                        dtype=np.intp)
+        self.rules_per_feature = int(self.slot_in_feature.max(initial=-1)) + 1
+
+        # Conditions as arrays over the rules: allowed values (NaN-padded,
+        # all NaN when any value is allowed), lower bounds and the z-score
+        # direction required (any_direction when there is none)
+        width = max([len(rule.get('values', ())) for rule in self.rules] + [1])
+        self.allowed = np.full((len(self.rules), width), np.nan)
+        for k, rule in enumerate(self.rules):
+            self.allowed[k, :len(rule.get('values', ()))] = rule.get('values', ())
+        self.any_value = np.isnan(self.allowed).all(axis=1)
+        self.above = np.array([rule.get('above', -np.inf) for rule in self.rules], dtype=np.float64)
+        self.any_direction = np.array(['direction' not in rule for rule in self.rules], dtype=bool)
+        self.want_high = np.array([rule.get('direction') == 'high' for rule in self.rules], dtype=bool)
+
+        # Every fixed text has an id in self.texts; -1 means no text. Texts
+        # with placeholders are filled per batch, once per distinct value
+        self.texts = []
+        self.band_ids = np.stack([self._ids([insight for insight, _ in self.band_texts]),
+                                  self._ids([recommendation for _, recommendation in self.band_texts])])
+        self.uncertain_ids = self._ids(UNCERTAINTY_RULE[1:])[:, np.newaxis]
+        self.rule_ids = np.stack([self._ids([rule.get('insight') for rule in self.rules]),
+                                  self._ids([rule.get('recommendation') for rule in self.rules])])[:, np.newaxis]
+        # (rule, 0 for the insight or 1 for the recommendation, template, value labels)
+        self.templates = [(k, kind, rule[key], FEATURE_INFO[rule['feature']].get('values'))
+                          for k, rule in enumerate(self.rules)
+                          for kind, key in enumerate(('insight', 'recommendation')) if '{' in (rule.get(key) or '')]
+        self.text_array = np.array(self.texts, dtype=object)
+
+    def _ids(self, texts):
+        """Ids of texts in self.texts (added as needed), -1 for None and templates"""
+        ids = []
+        for text in texts:
+            if text is None or '{' in text:
+                ids.append(-1)
+            else:
+                if text not in self.texts:
+                    self.texts.append(text)
+                ids.append(self.texts.index(text))
+        return np.array(ids, dtype=np.int32)
+
+    def fired(self, values, z_scores, abnormal):
+        """(n_patients, n_rules) mask of the feature rules firing for each patient"""
+        rule_values = values[:, self.columns]
+        allowed = self.any_value | (rule_values == self.allowed[:, 0])
+        for column in self.allowed.T[1:]:
+            allowed |= rule_values == column
+        return (abnormal[:, self.columns] & allowed & (rule_values > self.above)
+                & (self.any_direction | ((z_scores[:, self.columns] > 0) == self.want_high)))
+
+    def evaluate(self, probabilities, uncertainties, values, z_scores, abnormal, abnormal_order):
+        """
+        Clinical insights of a batch of patients
+
+        Args:
+            probabilities: (n_patients,) predicted probabilities
+            uncertainties: (n_patients,) bootstrap uncertainties as fractions
+            values: (n_patients, n_features) feature values
+            z_scores: (n_patients, n_features) z-scores of the values
+            abnormal: (n_patients, n_features) mask of the abnormal features
+            abnormal_order: (n_patients, n_features) feature indices, most
+                severe first (the order of abnormal_features)
+
+        Returns:
+            List of {"key_insights": [...], "recommendations": [...]} per patient
+        """
+        band = np.searchsorted(self.band_bounds, probabilities, side='right')
+        uncertain = np.asarray(uncertainties) > UNCERTAINTY_RULE[0]
+        n_patients, n_features = abnormal_order.shape
+
+        # Insight (ids[0]) and recommendation (ids[1]) text ids of each patient
+        # in output order: band, uncertainty, then the slots of each feature in
+        # the patient's abnormal_order. -1 is no text. Batches without an
+        # abnormal rule feature (often a single patient) only fill the first two
+        texts = self.texts
+        ids = np.full((2, n_patients, 2 + n_features * self.rules_per_feature), -1, dtype=np.int32)
+        ids[:, :, 0] = self.band_ids[:, band]
+        ids[:, uncertain, 1] = self.uncertain_ids
+        if len(self.rules) and abnormal[:, self.columns].any():
+            fired = self.fired(values, z_scores, abnormal)
+            rule_ids = np.where(fired, self.rule_ids, -1)
+            for k, kind, template, labels in self.templates:
+                rows = fired[:, k]
+                if rows.any():
+                    rule_values = values[rows, self.columns[k]].tolist()
+                    filled = {value: len(texts) + i for i, value in enumerate(dict.fromkeys(rule_values))}
+                    texts = texts + [_text(template, labels, value) for value in filled]
+                    rule_ids[kind, rows, k] = [filled[value] for value in rule_values]
+            patients = np.arange(n_patients)[:, np.newaxis]
+            rank = np.empty_like(abnormal_order)
+            rank[patients, abnormal_order] = np.arange(n_features)
+            ids[:, patients, 2 + rank[:, self.columns] * self.rules_per_feature + self.slot_in_feature] = rule_ids
+
+        # The texts of all patients as one flat list, without the missing ones;
+        # each patient's lists are slices of it, capped
+        ids = ids.reshape(2 * n_patients, ids.shape[2])
+        kept = np.flatnonzero(ids >= 0)
+        counts = np.bincount(kept // ids.shape[1], minlength=2 * n_patients)
+        starts = np.cumsum(counts) - counts
+        ends = starts + np.minimum(counts, MAX_INSIGHTS)
+        text_array = self.text_array if texts is self.texts else np.array(texts, dtype=object)
+        texts = text_array[ids.ravel()[kept]].tolist()
+        starts, ends = starts.tolist(), ends.tolist()
+        return [{"key_insights": texts[insight_start:insight_end],
+                 "recommendations": texts[recommendation_start:recommendation_end]}
+                for insight_start, insight_end, recommendation_start, recommendation_end
+                in zip(starts[:n_patients], ends[:n_patients], starts[n_patients:], ends[n_patients:])]
+
+
+@lru_cache(maxsize=64)
+def _rules_for(features):
+    return InsightRules(features)
+
+
+def get_clinical_insights(risk_prob, uncertainty, abnormal_features, key_contributors=None):
+    """
+    Generate clinical insights and recommendations for one prediction result
+
+    Args:
+        risk_prob: Predicted probability
+        uncertainty: Bootstrap uncertainty as a fraction
+        abnormal_features: The result's abnormal_features (most severe first)
+        key_contributors: Unused; kept for existing callers
+    """
+    rules = _rules_for(tuple(abnormal_features))
+    details = list(abnormal_features.values())
+    values = np.array([[item['value'] for item in details]], dtype=np.float64).reshape(1, len(details))
+    z_signs = np.array([[1.0 if item['direction'] == 'high' else -1.0 for item in details]]).reshape(1, len(details))
+    return rules.evaluate(np.array([risk_prob]), np.array([uncertainty]), values, z_signs,
+                          np.ones(values.shape, dtype=bool), np.arange(len(details))[np.newaxis])[0]
@@ -0,0 +1,86 @@
+import numpy as np
+from model.feature_info import FEATURE_INFO
+from model.clinical_insights import InsightRules
+
+# Features below this importance are left out of the key contributors
+SIGNIFICANT_IMPORTANCE = 0.02
+
+
+class FeatureSchema:
+    """
+    Per-feature metadata of a loaded model, precompiled into arrays and lists.
+
+    Built once at model load so the request path works on plain NumPy rows
+    instead of DataFrames, Series alignment and FEATURE_INFO lookups. All
+    arrays and lists are in the model's feature order.
+    """
+
+    def __init__(self, model_components):
+        feature_means = model_components['feature_means']
+        scaler = model_components['scaler']
+
+        self.features = list(feature_means.index)
+        self.index = {feature: j for j, feature in enumerate(self.features)}
+
+        # Population statistics for z-scores and the fitted scaler parameters
+        self.means = np.asarray(feature_means, dtype=np.float64)
+        self.stds = np.asarray(model_components['feature_stds'], dtype=np.float64)
+        self.scaler_mean = np.asarray(scaler.mean_, dtype=np.float64)
+        self.scaler_scale = np.asarray(scaler.scale_, dtype=np.float64)
+
+        # Memory-mapped artifacts carry the importances without the sklearn models
+        importances = model_components.get('feature_importances')
+        if importances is None:
+            importances = model_components['ensemble'].named_estimators_['rf1'].feature_importances_
+        self.importances = np.asarray(importances, dtype=np.float64)
+        self.rounded_importances = [round(importance, 3) for importance in self.importances]
+        self.significant = np.flatnonzero(self.importances > SIGNIFICANT_IMPORTANCE)
+
+        # Display lookups from FEATURE_INFO; empty units are stored as None
+        info = [FEATURE_INFO[feature] for feature in self.features]
+        self.names = [item['name'] for item in info]
+        self.clinical_contexts = [item['clinical_context'] for item in info]
+        self.value_labels = [item.get('values') for item in info]
+        self.units = [item.get('unit') or None for item in info]
+
+        # Clinical insight rules compiled against the feature order
+        self.insight_rules = InsightRules(self.features)
+
+    def to_array(self, patients):
+        """
+        Convert patients to a float64 array of shape (n_patients, n_features)
+
+        Args:
+            patients: List of patient feature dictionaries or a DataFrame
+
+        Raises:
+            ValueError: If a required feature is missing
+        """
+        if hasattr(patients, 'columns'):
+            for feature in self.features:
+                if feature not in patients.columns:
+                    raise ValueError(f"Missing required feature: {feature}")
+            return patients[self.features].to_numpy(dtype=np.float64)
+
+        patients = list(patients)
+        try:
+            rows = [[patient[feature] for feature in self.features] for patient in patients]
+        except KeyError as e:
+            raise ValueError(f"Missing required feature: {e.args[0]}")
+        return np.array(rows, dtype=np.float64).reshape(len(patients), len(self.features))
+
+    def scale(self, values):
+        """Apply the fitted StandardScaler to feature rows"""
+        return (values - self.scaler_mean) / self.scaler_scale
+
+    def z_scores(self, values):
+        """Z-scores of feature rows against the training population"""
+        return (values - self.means) / self.stds
+
+
+def get_feature_schema(model_components):
+    """Precompiled schema of the model components, building it if the loader did not"""
+    feature_schema = model_components.get('feature_schema')
+    if feature_schema is None:
+        feature_schema = FeatureSchema(model_components)
+    return feature_schema
@@ -1,10 +1,143 @@
 import os
+import json
+import hashlib
 import joblib
+import numpy as np
+from model.tree_engine import compile_tree_engine
+from model.tree_attribution import compile_tree_attribution
+from model.feature_schema import FeatureSchema
+from model.artifact import MANIFEST_NAME, is_mmap_artifact, load_mmap_artifact
+from model.cascade import cascade_path, load_cascade
 
 
-def load_model(model_path='heart_model_ensemble.pkl'):
-    """Load the trained model components from disk"""
+def artifact_version(model_path):
+    """Content hash identifying a model artifact file"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def model_version(model_path):
+    """The 'model_version' load_model reports for an artifact, without loading it"""
+    if is_mmap_artifact(model_path):
+        with open(os.path.join(model_path, MANIFEST_NAME)) as f:
+            return json.load(f)['model_version']
+    return artifact_version(model_path)
+
+
+# Voting member names of the ensemble and the standalone model each one duplicates
+ENSEMBLE_MEMBERS = (('rf1', 'rf_model1'), ('rf2', 'rf_model2'), ('gb1', 'gb_model1'), ('gb2', 'gb_model2'))
+
+
+def hash_trees(digest, model):
+    """
+    Add a fitted tree ensemble's parameters, every tree's node fields and
+    values, to a hashlib digest
+
+    Node records are hashed field by field because pickled sklearn trees
+    include uninitialized padding bytes, so identical models do not always
+    have identical bytes.
+    """
+    for estimator in np.ravel(model.estimators_):
+        state = estimator.tree_.__getstate__()
+        for field in state['nodes'].dtype.names:
+            digest.update(np.ascontiguousarray(state['nodes'][field]).tobytes())
+        digest.update(np.ascontiguousarray(state['values']).tobytes())
+
+
+def estimator_fingerprint(model):
+    """Hash of a fitted tree ensemble's parameters (see hash_trees)"""
+    digest = hashlib.sha256()
+    hash_trees(digest, model)
+    return digest.hexdigest()
+
+
+def share_ensemble_members(model_components):
+    """
+    Make the ensemble use the standalone base models as its members
+
+    Artifacts trained by the original notebook hold each base model twice:
+    rf_model1 etc., and the clones the VotingClassifier fitted for itself.
+    When a clone has exactly the same trees as its standalone model, the
+    ensemble is pointed at the standalone model and the clone is released.
+
+    Returns:
+        True if all members are shared (soft voting over rf_model1,
+        rf_model2, gb_model1 and gb_model2 then equals the ensemble)
+    """
+    ensemble = model_components['ensemble']
+    if [name for name, _ in ensemble.estimators] != [name for name, _ in ENSEMBLE_MEMBERS]:
+        return False
+
+    shared = True
+    for index, (name, key) in enumerate(ENSEMBLE_MEMBERS):
+        member, model = ensemble.estimators_[index], model_components[key]
+        if member is model:
+            continue
+        if type(member) is not type(model) or estimator_fingerprint(member) != estimator_fingerprint(model):
+            print(f"Ensemble member {name} differs from {key}; keeping both copies")
+            shared = False
+            continue
+        ensemble.estimators_[index] = model
+        ensemble.named_estimators_[name] = model
+        # The unfitted templates in `estimators` are replaced as well; in
+        # notebook artifacts they are the standalone models already
+        ensemble.estimators[index] = (name, model)
+    return shared
+
+
+def voting_weights(ensemble):
+    """Normalized soft-voting weights of the ensemble members"""
+    weights = ensemble._weights_not_none
+    weights = np.ones(len(ensemble.estimators_)) if weights is None else np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def load_model(model_path='heart_model_ensemble.pkl', compile_trees=False, share_members=True, cascade=False):
+    """
+    Load the trained model components from disk
+    
+    Args:
+        model_path: Path to the joblib model artifact, or to a memory-mapped
+            artifact directory (see model/artifact.py)
+        compile_trees: Also export every tree into the flat-array inference
+            engine (stored under 'tree_engine') for fast scoring, and the tree
+            paths into the per-patient attribution engine (stored under
+            'tree_attribution'). Memory-mapped artifacts always come with the
+            engine and ignore this flag
+        share_members: Deduplicate the ensemble's members (see below); off
+            only to measure the duplicated layout
+        cascade: Score with the early-exit cascade calibrated for this
+            artifact (<base>.cascade.json next to it, see model/cascade.py),
+            stored under 'cascade', when there is one. Needs the tree engine
+    
+    The artifact's content hash is stored under 'model_version' and the
+    precompiled feature metadata under 'feature_schema'. When the ensemble's
+    members are the same fitted models as rf_model1, rf_model2, gb_model1 and
+    gb_model2, one copy is kept (see share_ensemble_members),
+    'shared_members' is set and the ensemble probability is computed by soft
+    voting over those models with 'voting_weights'.
+    """
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found at {model_path}")
     
-    return joblib.load(model_path)
+    if is_mmap_artifact(model_path):
+        model_components = load_mmap_artifact(model_path)
+    else:
+        model_components = joblib.load(model_path)
+        model_components['model_version'] = artifact_version(model_path)
+        model_components['feature_schema'] = FeatureSchema(model_components)
+        model_components['shared_members'] = share_members and share_ensemble_members(model_components)
+        model_components['voting_weights'] = voting_weights(model_components['ensemble'])
+        
+        if compile_trees:
+            model_components['tree_engine'] = compile_tree_engine(model_components)
+            model_components['tree_attribution'] = compile_tree_attribution(
+                model_components, model_components['tree_engine']['ensemble'])
+    
+    if cascade and os.path.isfile(cascade_path(model_path)):
+        model_components['cascade'] = load_cascade(model_components, cascade_path(model_path))
+    
+    return model_components
@@ -1,10 +1,65 @@
-from model.feature_info import FEATURE_INFO
-import pandas as pd
 import numpy as np
 import datetime
-from model.clinical_insights import get_clinical_insights
+import hashlib
+from model.feature_schema import get_feature_schema
+from model.surrogate import surrogate_scores
+from utils.metrics import StageTimer
 
-def predict_heart_disease(patient_data, model_components, num_bootstrap_samples=50, z_score_threshold=1.5):
+# Risk bands on the ensemble probability; the last band is closed at 1.0
+RISK_LEVELS = {
+    (0, 0.05): "Very Low",
+    (0.05, 0.2): "Low", 
+    (0.2, 0.4): "Moderate",
+    (0.4, 0.6): "High",
+    (0.6, 1.0): "Very High"
+}
+
+# Probability at and above which the binary prediction is positive
+BINARY_THRESHOLD = 0.5
+
+# Reliability assessments: (upper uncertainty percent bound, assessment); a
+# prediction gets the first one whose bound is above its uncertainty
+RELIABILITY_LEVELS = [
+    (20, "highly reliable"),
+    (50, "moderately reliable"),
+    (np.inf, "uncertain - consider additional tests")
+]
+
+# Scoring calls with more rows than this use the sklearn models when they
+# are loaded: past ~250 rows sklearn's compiled traversal overtakes the
+# level-by-level NumPy walk of the tree engine (memory-mapped artifacts
+# carry only the engine and always use it)
+TREE_ENGINE_MAX_ROWS = 256
+MEMBER_KEYS = ('rf_model1', 'rf_model2', 'gb_model1', 'gb_model2')
+
+# Scoring modes: the full ensemble with bootstrap uncertainty, or the
+# distilled surrogate of model/surrogate.py
+PREDICTION_MODES = ('full', 'fast')
+
+
+def input_seed(values):
+    """Deterministic bootstrap seed for one patient's exact feature values"""
+    # Adding 0.0 turns -0.0 into 0.0, which compares (and caches) equal to it
+    canonical = np.asarray(values, dtype='<f8') + 0.0
+    return int.from_bytes(hashlib.blake2b(canonical.tobytes(), digest_size=8).digest(), 'little')
+
+
+def risk_level_index(probabilities):
+    """Index into RISK_LEVELS of the band holding each probability"""
+    risk_edges = np.array([range_vals[1] for range_vals in RISK_LEVELS][:-1])
+    return np.searchsorted(risk_edges, probabilities, side='right')
+
+
+def base_tree_count(model_components):
+    """Trees of the four base models, all of which a full prediction evaluates for every patient"""
+    tree_engine = model_components.get('tree_engine')
+    if tree_engine is not None:
+        return tree_engine.get('members', tree_engine['ensemble']).n_trees
+    return sum(np.ravel(model_components[key].estimators_).size for key in MEMBER_KEYS)
+
+
+def predict_heart_disease(patient_data, model_components, num_bootstrap_samples=50, z_score_threshold=1.5,
+                          random_state=None, mode='full'):
     """
     Predict heart disease risk with uncertainty quantification and clinical insights.
     
@@ -13,190 +68,301 @@ def predict_heart_disease(patient_data, model_components, num_bootstrap_samples=
         model_components: Dictionary containing trained model components
         num_bootstrap_samples: Number of bootstrap samples for uncertainty estimation
         z_score_threshold: Threshold for flagging abnormal features
+        random_state: Seed or numpy Generator for the bootstrap noise; when None
+            each patient's noise is seeded from its own feature values, so
+            identical inputs always produce identical results
+        mode: 'full', or 'fast' to score with the distilled surrogate (see
+            predict_heart_disease_batch)
         
     Returns:
         Dictionary with prediction results and clinical insights
     """
-    # Extract components
-    ensemble = model_components['ensemble']
-    rf_model1 = model_components['rf_model1']
-    rf_model2 = model_components['rf_model2']
-    gb_model1 = model_components['gb_model1']
-    gb_model2 = model_components['gb_model2']
-    scaler = model_components['scaler']
-    feature_means = model_components['feature_means']
-    feature_stds = model_components['feature_stds']
-    
-    # Convert dict to DataFrame if needed
+    # Convert dict to a one-row batch; only the first row of a DataFrame is scored
     if isinstance(patient_data, dict):
-        patient_data = pd.DataFrame([patient_data])
+        patient_data = [patient_data]
+    else:
+        patient_data = patient_data.iloc[:1]
+    
+    return predict_heart_disease_batch(
+        patient_data, model_components,
+        num_bootstrap_samples=num_bootstrap_samples,
+        z_score_threshold=z_score_threshold,
+        random_state=random_state,
+        mode=mode
+    )[0]
+
+
+def predict_heart_disease_batch(patients, model_components, num_bootstrap_samples=50, z_score_threshold=1.5,
+                                random_state=None, return_z_scores=False, stage_timer=None,
+                                include_insights=True, include_attributions=True, mode='full'):
+    """
+    Predict heart disease risk for a batch of patients.
     
-    # Ensure all required features are present
-    expected_features = feature_means.index.tolist()
-    for feature in expected_features:
-        if feature not in patient_data.columns:
-            raise ValueError(f"Missing required feature: {feature}")
+    Scaling, ensemble scoring, bootstrap uncertainty, z-scores and contributor
+    ranking run as array operations over the whole batch; only the final
+    per-patient result dictionaries are built row by row.
     
-    # Scale patient data
-    patient_data_scaled = pd.DataFrame(
-        scaler.transform(patient_data),
-        columns=patient_data.columns
-    )
-    
-    # Basic prediction with the ensemble
-    prediction_proba = ensemble.predict_proba(patient_data_scaled)[0, 1]
-    prediction = 1 if prediction_proba >= 0.5 else 0
-    
-    # --- Enhanced uncertainty estimation ---
-    # 1. Bootstrap sampling with noise
-    bootstrap_probs = []
-    for _ in range(num_bootstrap_samples):
-        # Create bootstrapped sample with noise
-        bootstrap_sample = patient_data_scaled.copy()
-        for col in bootstrap_sample.columns:
-            noise = np.random.normal(0, 0.05)  # Small gaussian noise
-            if bootstrap_sample[col].dtype in [np.float64, np.int64]:
-                bootstrap_sample[col] = bootstrap_sample[col] + noise
-        
-        # Get predictions from all individual models
-        rf1_prob = rf_model1.predict_proba(bootstrap_sample)[0, 1]
-        rf2_prob = rf_model2.predict_proba(bootstrap_sample)[0, 1]
-        gb1_prob = gb_model1.predict_proba(bootstrap_sample)[0, 1]
-        gb2_prob = gb_model2.predict_proba(bootstrap_sample)[0, 1]
+    Args:
+        patients: List of patient feature dictionaries or a DataFrame (one row per patient)
+        model_components: Dictionary containing trained model components
+        num_bootstrap_samples: Number of bootstrap samples for uncertainty estimation
+        z_score_threshold: Threshold for flagging abnormal features
+        random_state: Seed or numpy Generator for the bootstrap noise; when None
+            each patient's noise is seeded from its own feature values, so
+            identical inputs always produce identical results
+        return_z_scores: Also return the (n_patients, n_features) z-score array,
+            in model feature order, for reuse by the visualization
+        stage_timer: Optional utils.metrics.StageTimer charged with the time
+            spent in each stage
+        include_insights: Generate clinical insights; when False the
+            'clinical_insights' field is None
+        include_attributions: Rank key contributors by their exact tree
+            attribution (see model/tree_attribution.py) when the model was
+            loaded with one; otherwise (and for patients that exit the
+            early-exit cascade early, see model/cascade.py) the importance
+            heuristic orders them
+        mode: 'full' scores the ensemble and the bootstrap; 'fast' takes the
+            probability and uncertainty from the distilled surrogate instead
+            (model_components are then the ones load_surrogate returns, and
+            contributors are ordered by the importance heuristic). The mode
+            is reported in each result's 'mode' field, and the number of
+            trees evaluated for the patient in 'trees_evaluated'
         
-        # Average the predictions
-        avg_prob = (rf1_prob + rf2_prob + gb1_prob + gb2_prob) / 4
-        bootstrap_probs.append(avg_prob)
-    
-    # 2. Calculate variance across models for this sample
-    model_probs = [
-        rf_model1.predict_proba(patient_data_scaled)[0, 1],
-        rf_model2.predict_proba(patient_data_scaled)[0, 1],
-        gb_model1.predict_proba(patient_data_scaled)[0, 1],
-        gb_model2.predict_proba(patient_data_scaled)[0, 1]
-    ]
-    model_variance = np.var(model_probs)
-    
-    # 3. Combine both uncertainty measures (bootstrap and model variance)
-    bootstrap_std = np.std(bootstrap_probs)
-    combined_uncertainty = np.sqrt(bootstrap_std**2 + model_variance)
-    
-    # Scale to percentage (0-100%)
-    # The scaling factor 4.0 is chosen to make typical uncertainty values range from 0-100%
-    # Higher values might exceed 100% for extremely uncertain predictions
-    uncertainty_percent = min(combined_uncertainty * 400, 100)
-    reliability_percent = 100 - uncertainty_percent
+    Returns:
+        List of prediction result dictionaries, in the same order as the input
+        (and the z-score array when return_z_scores is set)
+    """
+    if mode not in PREDICTION_MODES:
+        raise ValueError(f"Unknown prediction mode: {mode}")
+    timer = stage_timer if stage_timer is not None else StageTimer()
+    timer.start()
+    
+    # Precompiled feature metadata (the sklearn models are only needed without the tree engine)
+    schema = get_feature_schema(model_components)
+    expected_features = schema.features
+    
+    # Flat-array tree engine, when compiled at load time, replaces sklearn predict_proba
+    # for small batches
+    tree_engine = model_components.get('tree_engine')
+    has_sklearn_models = 'ensemble' in model_components
+    
+    # Feature rows in model order; raises ValueError on missing features
+    values = schema.to_array(patients)
+    n_patients, n_features = values.shape
+    if n_patients == 0:
+        return ([], values) if return_z_scores else []
+    
+    # Scale patient data
+    scaled = schema.scale(values)
+    timer.lap('prepare')
+    
+    attributions = None
+    exited = np.zeros(n_patients, dtype=bool)
+    if mode == 'fast':
+        # One pass of the surrogate's shallow trees replaces the ensemble,
+        # bootstrap and attribution stages
+        prediction_proba, uncertainty_percent = surrogate_scores(model_components, scaled)
+        reliability_percent = 100 - uncertainty_percent
+        trees_evaluated = np.full(n_patients, model_components['surrogate_engine'].n_trees)
+        timer.lap('surrogate')
+    else:
+        # Basic prediction with the ensemble. When the ensemble's members are the
+        # individual models ('shared_members'), it is the soft vote of their
+        # clean-row probabilities, computed below with the bootstrap rows
+        shared_members = model_components.get('shared_members', False)
+        if shared_members:
+            prediction_proba = None
+        elif tree_engine is not None and (n_patients <= TREE_ENGINE_MAX_ROWS or not has_sklearn_models):
+            prediction_proba = tree_engine['ensemble'].predict_proba(scaled)[:, 0]
+        else:
+            import pandas as pd
+            patients_scaled = pd.DataFrame(scaled, columns=expected_features)
+            prediction_proba = model_components['ensemble'].predict_proba(patients_scaled)[:, 1]
+        timer.lap('ensemble')
+    
+        # --- Enhanced uncertainty estimation ---
+        # Score the clean rows and every noisy bootstrap row in one batched
+        # predict_proba call per model: the first n_patients rows are the
+        # unperturbed patients, followed by num_bootstrap_samples rows per
+        # patient carrying small gaussian noise on every (scaled) feature.
+        if random_state is None:
+            noise = np.stack([
+                np.random.default_rng(input_seed(row)).normal(0, 0.05, size=(num_bootstrap_samples, n_features))
+                for row in values
+            ])
+        else:
+            rng = np.random.default_rng(random_state)
+            noise = rng.normal(0, 0.05, size=(n_patients, num_bootstrap_samples, n_features))
+        bootstrap_rows = (scaled[:, np.newaxis, :] + noise).reshape(-1, n_features)
+        bootstrap_batch = np.vstack([scaled, bootstrap_rows])
+        trees_evaluated = np.full(n_patients, base_tree_count(model_components))
+        cascade = model_components.get('cascade')
+        if tree_engine is not None and (len(bootstrap_batch) <= TREE_ENGINE_MAX_ROWS or not has_sklearn_models):
+            if cascade is not None:
+                # Patients whose result is already clear exit after the
+                # cascade's first stage of trees, with estimated probabilities
+                member_probs, exited = cascade.member_proba(bootstrap_batch, n_patients)
+                trees_evaluated[exited] = len(cascade.first_trees)
+            else:
+                # Without a separate members engine, the ensemble engine exports the same models
+                member_probs = tree_engine.get('members', tree_engine['ensemble']).member_proba(bootstrap_batch)
+        else:
+            import pandas as pd
+            bootstrap_batch = pd.DataFrame(bootstrap_batch, columns=expected_features)
+            member_probs = np.column_stack([
+                model_components[key].predict_proba(bootstrap_batch)[:, 1]
+                for key in MEMBER_KEYS
+            ])
+        if prediction_proba is None:
+            prediction_proba = member_probs[:n_patients] @ model_components['voting_weights']
+        timer.lap('bootstrap')
+    
+        # 1. Bootstrap sampling with noise: average of the individual models
+        bootstrap_probs = member_probs[n_patients:].mean(axis=1).reshape(n_patients, num_bootstrap_samples)
+    
+        # 2. Calculate variance across models for each patient
+        model_variance = np.var(member_probs[:n_patients], axis=1)
+    
+        # 3. Combine both uncertainty measures (bootstrap and model variance)
+        bootstrap_std = np.std(bootstrap_probs, axis=1)
+        combined_uncertainty = np.sqrt(bootstrap_std**2 + model_variance)
+    
+        # Scale to percentage (0-100%)
+        # The scaling factor 4.0 is chosen to make typical uncertainty values range from 0-100%
+        # Higher values might exceed 100% for extremely uncertain predictions
+        uncertainty_percent = np.minimum(combined_uncertainty * 400, 100)
+        reliability_percent = 100 - uncertainty_percent
+        timer.lap('uncertainty')
+    
+        # --- Per-patient attributions ---
+        # Signed share of each feature in the ensemble probability (relative to
+        # the training average), from the compiled tree paths
+        tree_attribution = model_components.get('tree_attribution')
+        # Patients that exited the cascade early skip them too
+        if include_attributions and tree_attribution is not None and not exited.all():
+            attributions = np.full((n_patients, n_features), np.nan)
+            attributions[~exited] = tree_attribution.attributions(scaled[~exited])[0]
+            timer.lap('attribution')
     
     # --- Abnormal feature detection ---
     # Calculate z-scores using original (unscaled) data
-    z_scores = (patient_data - feature_means) / feature_stds
-    
-    # Identify abnormal features
-    abnormal_features = {}
-    for col in z_scores.columns:
-        z_val = z_scores.iloc[0][col]
-        if abs(z_val) >= z_score_threshold:
-            abnormal_features[col] = {
-                'feature_name': FEATURE_INFO[col]['name'],
-                'value': patient_data.iloc[0][col],
+    z_scores = schema.z_scores(values)
+    abs_z = np.abs(z_scores)
+    abnormal_mask = abs_z >= z_score_threshold
+    # Most severe (largest absolute z-score) first
+    abnormal_order = np.argsort(-abs_z, axis=1, kind='stable')
+    
+    # --- Feature importance for this prediction ---
+    # Calculate personalized feature importances (only significant features are ranked)
+    contributions = np.round(schema.importances * (1 + 0.5 * abs_z), 3)
+    significant = schema.significant
+    if attributions is not None:
+        # Largest absolute attribution first
+        ranking = np.where(exited[:, np.newaxis], -contributions[:, significant],
+                           -np.abs(attributions[:, significant]))
+    else:
+        ranking = -contributions[:, significant]
+    contributor_order = significant[np.argsort(ranking, axis=1, kind='stable')]
+    
+    # --- Format results for clinical use ---
+    risk_names = list(RISK_LEVELS.values())
+    risk_index = risk_level_index(prediction_proba)
+    
+    # Format date for the report
+    today = datetime.datetime.now().strftime("%B %d, %Y")
+    timer.lap('features')
+    
+    # Generate clinical insights for the whole batch
+    clinical_insights = [None] * n_patients
+    if include_insights:
+        clinical_insights = schema.insight_rules.evaluate(prediction_proba, uncertainty_percent / 100, values,
+                                                          z_scores, abnormal_mask, abnormal_order)
+        timer.lap('insights')
+    
+    results = []
+    for row in range(n_patients):
+        abnormal_features = {}
+        for j in abnormal_order[row]:
+            if not abnormal_mask[row, j]:
+                continue
+            z_val = z_scores[row, j]
+            entry = {
+                'feature_name': schema.names[j],
+                'value': values[row, j],
                 'z_score': z_val,
                 'direction': 'high' if z_val > 0 else 'low',
-                'severity': 'severe' if abs(z_val) > 2.5 else 'moderate',
-                'clinical_context': FEATURE_INFO[col]['clinical_context']
+                'severity': 'severe' if abs_z[row, j] > 2.5 else 'moderate',
+                'clinical_context': schema.clinical_contexts[j]
             }
             
             # Add human-readable value for categorical features
-            if 'values' in FEATURE_INFO[col]:
-                value = int(patient_data.iloc[0][col])
-                if value in FEATURE_INFO[col]['values']:
-                    abnormal_features[col]['readable_value'] = FEATURE_INFO[col]['values'][value]
+            value_labels = schema.value_labels[j]
+            if value_labels is not None:
+                value = int(values[row, j])
+                if value in value_labels:
+                    entry['readable_value'] = value_labels[value]
             
             # Add units where applicable
-            if 'unit' in FEATURE_INFO[col] and FEATURE_INFO[col]['unit']:
-                abnormal_features[col]['unit'] = FEATURE_INFO[col]['unit']
-    
-    # Sort abnormal features by severity (absolute z-score)
-    abnormal_features = dict(sorted(
-        abnormal_features.items(), 
-        key=lambda x: abs(x[1]['z_score']), 
-        reverse=True
-    ))
-    
-    # --- Feature importance for this prediction ---
-    # Calculate feature importances
-    feature_importances = ensemble.named_estimators_['rf1'].feature_importances_
-    
-    feature_contributions = {}
-    for i, col in enumerate(feature_means.index):
-        # Calculate personalized feature importance
-        importance = feature_importances[i]
-        contribution = importance * (1 + 0.5 * abs(z_scores.iloc[0][col]))
+            if schema.units[j]:
+                entry['unit'] = schema.units[j]
+            abnormal_features[expected_features[j]] = entry
         
-        if importance > 0.02:  # Only include significant contributions
-            feature_contributions[col] = {
-                'feature_name': FEATURE_INFO[col]['name'],
-                'importance': round(importance, 3),
-                'contribution': round(contribution, 3)
+        feature_contributions = {}
+        for j in contributor_order[row]:
+            entry = {
+                'feature_name': schema.names[j],
+                'importance': schema.rounded_importances[j],
+                'contribution': contributions[row, j]
             }
+            if attributions is not None and not exited[row]:
+                entry['attribution'] = round(float(attributions[row, j]), 3)
             
             # Add human-readable value for categorical features
-            if 'values' in FEATURE_INFO[col]:
-                value = int(patient_data.iloc[0][col])
-                if value in FEATURE_INFO[col]['values']:
-                    feature_contributions[col]['value'] = FEATURE_INFO[col]['values'][value]
+            value_labels = schema.value_labels[j]
+            if value_labels is not None:
+                value = int(values[row, j])
+                if value in value_labels:
+                    entry['value'] = value_labels[value]
             else:
-                feature_contributions[col]['value'] = float(patient_data.iloc[0][col])
+                entry['value'] = float(values[row, j])
                 
                 # Add units where applicable
-                if 'unit' in FEATURE_INFO[col] and FEATURE_INFO[col]['unit']:
-                    feature_contributions[col]['unit'] = FEATURE_INFO[col]['unit']
-    
-    # Sort feature contributions
-    feature_contributions = dict(sorted(
-        feature_contributions.items(),
-        key=lambda x: x[1]['contribution'],
-        reverse=True
-    ))
-    
-    # --- Format results for clinical use ---
-    risk_levels = {
-        (0, 0.05): "Very Low",
-        (0.05, 0.2): "Low", 
-        (0.2, 0.4): "Moderate",
-        (0.4, 0.6): "High",
-        (0.6, 1.0): "Very High"
-    }
-    
-    risk_level = next(level for range_vals, level in risk_levels.items() 
-                     if range_vals[0] <= prediction_proba < range_vals[1] or range_vals[1] == 1.0)
+                if schema.units[j]:
+                    entry['unit'] = schema.units[j]
+            feature_contributions[expected_features[j]] = entry
+        
+        probability = prediction_proba[row]
+        uncertainty = uncertainty_percent[row]
+        
+        timer.lap('format')
+        
+        # Format final results
+        results.append({
+            "prediction": {
+                "heart_disease_probability": round(probability, 3),
+                "binary_prediction": int(probability >= BINARY_THRESHOLD),
+                "risk_level": risk_names[risk_index[row]],
+                "risk_category": "High Risk" if probability >= BINARY_THRESHOLD else "Low Risk"
+            },
+            "uncertainty": {
+                "uncertainty_percent": round(uncertainty, 1),
+                "reliability_percent": round(reliability_percent[row], 1),
+                "assessment": "Prediction is " + next(
+                    (assessment for bound, assessment in RELIABILITY_LEVELS if uncertainty < bound),
+                    RELIABILITY_LEVELS[-1][1]
+                )
+            },
+            "abnormal_features": abnormal_features,
+            "key_contributors": feature_contributions,
+            "report_date": today,
+            "clinical_insights": clinical_insights[row],
+            "mode": mode,
+            "trees_evaluated": int(trees_evaluated[row]),
+            "early_exit": bool(exited[row])
+        })
     
-    # Format date for the report
-    today = datetime.datetime.now().strftime("%B %d, %Y")
-
+    timer.lap('format')
     
-    # Generate clinical insights
-    clinical_insights = get_clinical_insights(prediction_proba, uncertainty_percent/100, 
-                                             abnormal_features, feature_contributions)
-    
-    # Format final results
-    return {
-        "prediction": {
-            "heart_disease_probability": round(prediction_proba, 3),
-            "binary_prediction": int(prediction),
-            "risk_level": risk_level,
-            "risk_category": "High Risk" if prediction_proba >= 0.5 else "Low Risk"
-        },
-        "uncertainty": {
-            "uncertainty_percent": round(uncertainty_percent, 1),
-            "reliability_percent": round(reliability_percent, 1),
-            "assessment": "Prediction is " + (
-                "highly reliable" if uncertainty_percent < 20 else
-                "moderately reliable" if uncertainty_percent < 50 else
-                "uncertain - consider additional tests"
-            )
-        },
-        "abnormal_features": abnormal_features,
-        "key_contributors": feature_contributions,
-        "report_date": today,
-        "clinical_insights": clinical_insights
-    }
+    if return_z_scores:
+        return results, z_scores
+    return results
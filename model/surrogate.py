@@ -0,0 +1,326 @@
+"""
+Distilled fast-mode surrogate of the ensemble.
+
+    python -m model.surrogate heart_model_ensemble.pkl heart.csv
+
+A full prediction scores the four base models on the patient and on 50
+noisy bootstrap copies of it. The surrogate replaces all of that with two
+shallow gradient-boosted regressors on the scaled features: one fitted to
+the log-odds of the ensemble probability, one to the bootstrap
+uncertainty_percent, both as the full prediction path reports them
+(input-seeded bootstrap).
+
+The distillation set is the unique rows of the training CSV plus synthetic
+patients: copies of real rows with a share of their features taken from
+other real rows, so feature combinations the data lacks are covered while
+every value stays a realistic one. A share of the real rows is held out
+before synthesizing, and gets its own synthetic patients mixed from the
+held-out rows only. These held-out rows measure the surrogate's fidelity
+to the full model: maximum and mean absolute probability error, risk-level
+and binary-prediction agreement, and the mean absolute uncertainty error.
+Distillation fails when the held-out rows, or the held-out data rows alone,
+miss FIDELITY_THRESHOLDS.
+
+The surrogate is saved next to its source artifact (<base>.fast.pkl, see
+surrogate_path) as a small joblib dict: the two regressors, the scaler and
+feature statistics of the source model, the source's model_version and the
+fidelity report. It is only served with the model version it was distilled
+from.
+"""
+import os
+import sys
+import time
+import argparse
+import joblib
+import numpy as np
+
+SURROGATE_FORMAT_VERSION = 2
+SURROGATE_SUFFIX = '.fast.pkl'
+
+# Distillation set: synthetic patients generated per run, share of each
+# synthetic patient's features taken from another real row, and share of
+# real (and synthetic) rows held out to measure fidelity
+SYNTHETIC_ROWS = 20000
+MIX_FRACTION = 0.5
+HOLDOUT_FRACTION = 0.2
+
+# Held-out fidelity a surrogate needs to be saved: fast mode is meant for
+# triage, so the binary prediction must almost always match while the risk
+# level (five bands) may be one band off for some patients
+FIDELITY_THRESHOLDS = {
+    'min_binary_agreement': 0.9,
+    'min_risk_level_agreement': 0.7,
+    'max_mean_abs_error': 0.08
+}
+
+# Hyperparameters of both regressors (the probability and the uncertainty percent)
+REGRESSOR_PARAMS = {'n_estimators': 100, 'max_depth': 5, 'learning_rate': 0.3}
+
+# The probability regressor is fitted to log-odds, so that the many near-certain
+# predictions of the ensemble stay reachable; targets are clipped to
+# [PROBA_CLIP, 1 - PROBA_CLIP] to keep them finite
+PROBA_CLIP = 1e-3
+
+# Patients scored per call of the full model when computing targets
+TARGET_CHUNK_ROWS = 200
+
+
+def surrogate_path(model_path):
+    """Path of the fast-mode surrogate of a model artifact (pickle or mmap directory)"""
+    return os.path.splitext(model_path.rstrip('/'))[0] + SURROGATE_SUFFIX
+
+
+def distillation_rows(data, features, n_synthetic=SYNTHETIC_ROWS, mix_fraction=MIX_FRACTION, seed=42):
+    """
+    Feature rows to distill on: the unique data rows followed by synthetic ones
+
+    Args:
+        data: DataFrame with (at least) the model's feature columns
+        features: Feature names in model order
+        n_synthetic: Synthetic rows to add
+        mix_fraction: Probability of each synthetic feature value coming
+            from another (random) real row instead of the base row
+        seed: Seed of the row and feature choices
+
+    Returns:
+        (rows, number of real rows first in rows)
+    """
+    real = data[features].dropna().drop_duplicates().to_numpy(dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    base = real[rng.integers(len(real), size=n_synthetic)]
+    donors = real[rng.integers(len(real), size=n_synthetic)]
+    synthetic = np.where(rng.random(base.shape) < mix_fraction, donors, base)
+    return np.vstack([real, synthetic]), len(real)
+
+
+def split_distillation_rows(data, features, n_synthetic=SYNTHETIC_ROWS, holdout_fraction=HOLDOUT_FRACTION, seed=42):
+    """
+    Distillation rows of a training and a held-out split of the unique data
+    rows, each synthesized from its own real rows only
+
+    Returns:
+        ((training rows, number of real rows first), (held-out rows, number
+        of real rows first)), as distillation_rows returns them
+    """
+    real = data[features].dropna().drop_duplicates()
+    order = np.random.default_rng(seed).permutation(len(real))
+    n_holdout = int(len(real) * holdout_fraction)
+    n_holdout_synthetic = int(n_synthetic * holdout_fraction)
+    return (distillation_rows(real.iloc[order[n_holdout:]], features, n_synthetic - n_holdout_synthetic, seed=seed),
+            distillation_rows(real.iloc[order[:n_holdout]], features, n_holdout_synthetic, seed=seed + 1))
+
+
+def full_model_targets(model_components, rows, features):
+    """Probability and uncertainty percent the full prediction path reports for each row"""
+    import pandas as pd
+    from model.predict import predict_heart_disease_batch
+
+    proba, uncertainty = [], []
+    for start in range(0, len(rows), TARGET_CHUNK_ROWS):
+        chunk = pd.DataFrame(rows[start:start + TARGET_CHUNK_ROWS], columns=features)
+        for result in predict_heart_disease_batch(chunk, model_components, include_insights=False,
+                                                  include_attributions=False):
+            proba.append(result['prediction']['heart_disease_probability'])
+            uncertainty.append(result['uncertainty']['uncertainty_percent'])
+    return np.array(proba), np.array(uncertainty)
+
+
+def fidelity(proba, uncertainty, target_proba, target_uncertainty):
+    """Agreement of surrogate outputs with the full model's"""
+    from model.predict import risk_level_index
+
+    error = np.abs(proba - target_proba)
+    return {
+        'rows': int(len(proba)),
+        'max_abs_error': float(error.max()),
+        'mean_abs_error': float(error.mean()),
+        'risk_level_agreement': float(np.mean(risk_level_index(proba) == risk_level_index(target_proba))),
+        'binary_agreement': float(np.mean((proba >= 0.5) == (target_proba >= 0.5))),
+        'uncertainty_mae': float(np.mean(np.abs(uncertainty - target_uncertainty)))
+    }
+
+
+def check_fidelity(report):
+    """Ways a fidelity report misses FIDELITY_THRESHOLDS (empty when it meets them)"""
+    failures = []
+    if report['binary_agreement'] < FIDELITY_THRESHOLDS['min_binary_agreement']:
+        failures.append(f"binary agreement {report['binary_agreement']:.1%} < "
+                        f"{FIDELITY_THRESHOLDS['min_binary_agreement']:.0%}")
+    if report['risk_level_agreement'] < FIDELITY_THRESHOLDS['min_risk_level_agreement']:
+        failures.append(f"risk level agreement {report['risk_level_agreement']:.1%} < "
+                        f"{FIDELITY_THRESHOLDS['min_risk_level_agreement']:.0%}")
+    if report['mean_abs_error'] > FIDELITY_THRESHOLDS['max_mean_abs_error']:
+        failures.append(f"mean |error| {report['mean_abs_error']:.3f} > {FIDELITY_THRESHOLDS['max_mean_abs_error']}")
+    return failures
+
+
+def distill(model_components, data_path, source_version, n_synthetic=SYNTHETIC_ROWS, seed=42):
+    """
+    Fit the fast-mode surrogate of a loaded model
+
+    Args:
+        model_components: Components of the full model (load_model or model.train)
+        data_path: CSV with the model's feature columns (extra columns are ignored)
+        source_version: model_version of the artifact the components come from
+        n_synthetic: Synthetic rows added to the data rows
+        seed: Seed of the synthetic rows, the held-out split and the regressors
+
+    Returns:
+        Surrogate components, as saved by save_surrogate
+
+    Raises:
+        ValueError: If the fidelity on the held-out rows, or on the held-out
+            data rows alone, misses FIDELITY_THRESHOLDS
+    """
+    import pandas as pd
+    from sklearn.ensemble import GradientBoostingRegressor
+    from model.artifact import ArrayScaler
+    from model.feature_schema import get_feature_schema
+
+    started = time.perf_counter()
+    schema = get_feature_schema(model_components)
+    (rows, n_real), (holdout_rows, n_holdout_real) = split_distillation_rows(
+        pd.read_csv(data_path), schema.features, n_synthetic, seed=seed)
+    target_proba, target_uncertainty = full_model_targets(model_components, rows, schema.features)
+    holdout_proba, holdout_uncertainty = full_model_targets(model_components, holdout_rows, schema.features)
+    targets_seconds = time.perf_counter() - started
+
+    scaled = schema.scale(rows)
+    clipped = np.clip(target_proba, PROBA_CLIP, 1 - PROBA_CLIP)
+    proba_model = GradientBoostingRegressor(random_state=seed, **REGRESSOR_PARAMS)
+    proba_model.fit(scaled, np.log(clipped / (1 - clipped)))
+    uncertainty_model = GradientBoostingRegressor(random_state=seed, **REGRESSOR_PARAMS)
+    uncertainty_model.fit(scaled, target_uncertainty)
+
+    surrogate = {
+        'format_version': SURROGATE_FORMAT_VERSION,
+        'source_version': source_version,
+        'proba_model': proba_model,
+        'uncertainty_model': uncertainty_model,
+        'scaler': ArrayScaler(schema.scaler_mean, schema.scaler_scale),
+        'feature_means': pd.Series(schema.means, index=schema.features),
+        'feature_stds': pd.Series(schema.stds, index=schema.features),
+        'feature_importances': schema.importances
+    }
+    proba, uncertainty = surrogate_scores(compile_surrogate(surrogate), schema.scale(holdout_rows))
+    surrogate['fidelity'] = {
+        'holdout': fidelity(proba, uncertainty, holdout_proba, holdout_uncertainty),
+        'holdout_data_rows': fidelity(proba[:n_holdout_real], uncertainty[:n_holdout_real],
+                                      holdout_proba[:n_holdout_real], holdout_uncertainty[:n_holdout_real])
+    }
+    failures = [f"{name} ({report['rows']} rows): {failure}"
+                for name, report in surrogate['fidelity'].items() for failure in check_fidelity(report)]
+    if failures:
+        raise ValueError(f"Surrogate fidelity is too low: {'; '.join(failures)}")
+    surrogate['distillation'] = {
+        'data': os.path.abspath(data_path),
+        'data_rows': n_real + n_holdout_real,
+        'holdout_data_rows': n_holdout_real,
+        'synthetic_rows': n_synthetic,
+        'mix_fraction': MIX_FRACTION,
+        'holdout_fraction': HOLDOUT_FRACTION,
+        'fidelity_thresholds': FIDELITY_THRESHOLDS,
+        'seed': seed,
+        'regressor_params': REGRESSOR_PARAMS,
+        'proba_clip': PROBA_CLIP,
+        'targets_seconds': targets_seconds,
+        'total_seconds': time.perf_counter() - started
+    }
+    return surrogate
+
+
+def save_surrogate(surrogate, path):
+    """Write surrogate components (without the compiled engine) with joblib"""
+    joblib.dump({key: value for key, value in surrogate.items() if key not in ('surrogate_engine', 'feature_schema')},
+                path)
+
+
+def compile_surrogate(surrogate):
+    """Add the flat-array engine of both regressors and the feature schema to surrogate components"""
+    from model.tree_engine import FlatTreeEnsemble
+    from model.feature_schema import FeatureSchema
+
+    surrogate['surrogate_engine'] = FlatTreeEnsemble([surrogate['proba_model'], surrogate['uncertainty_model']])
+    surrogate['feature_schema'] = FeatureSchema(surrogate)
+    return surrogate
+
+
+def load_surrogate(path):
+    """Load surrogate components saved by save_surrogate, ready for predict_heart_disease_batch(..., mode='fast')"""
+    surrogate = joblib.load(path)
+    if surrogate.get('format_version') != SURROGATE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported surrogate format version: {surrogate.get('format_version')}")
+    return compile_surrogate(surrogate)
+
+
+def find_surrogate(model_path, model_version):
+    """
+    The surrogate distilled from a model version, loaded from next to its artifact
+
+    Returns:
+        Surrogate components, or None when there is none for this version
+        (or only one in an older format)
+    """
+    path = surrogate_path(model_path)
+    if not os.path.isfile(path):
+        return None
+    try:
+        surrogate = load_surrogate(path)
+    except ValueError as e:
+        print(f"Ignoring {path}: {e}")
+        return None
+    if surrogate['source_version'] != model_version:
+        print(f"Ignoring {path}: distilled from model version {surrogate['source_version']}, not {model_version}")
+        return None
+    return surrogate
+
+
+def surrogate_scores(surrogate, scaled):
+    """
+    Probability and uncertainty percent of scaled feature rows
+
+    Returns:
+        (probabilities, uncertainty percents), the latter clipped to [0, 100]
+    """
+    outputs = surrogate['surrogate_engine'].predict_proba(scaled)
+    return 1.0 / (1.0 + np.exp(-outputs[:, 0])), np.clip(outputs[:, 1], 0, 100)
+
+
+def print_fidelity(surrogate):
+    for name, report in surrogate['fidelity'].items():
+        print(f"  {name} ({report['rows']} rows): max |error| {report['max_abs_error']:.3f}, "
+              f"mean |error| {report['mean_abs_error']:.4f}, risk level agreement "
+              f"{report['risk_level_agreement']:.1%}, binary agreement {report['binary_agreement']:.1%}, "
+              f"uncertainty MAE {report['uncertainty_mae']:.1f} points")
+
+
+def main():
+    from model.load_model import load_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('artifact', help='Model artifact (pickle file or mmap directory)')
+    parser.add_argument('data', help='CSV with the feature columns (e.g. heart.csv)')
+    parser.add_argument('--output', help='Surrogate file to write (default: <artifact base>.fast.pkl)')
+    parser.add_argument('--synthetic', type=int, default=SYNTHETIC_ROWS, help='Synthetic rows to distill on')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic rows and the regressors')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data):
+        sys.exit(f"Data not found at {args.data}")
+    model_components = load_model(args.artifact, compile_trees=True)
+    print(f"Distilling model version {model_components['model_version']} on {args.data} "
+          f"plus {args.synthetic} synthetic rows...")
+    try:
+        surrogate = distill(model_components, args.data, model_components['model_version'],
+                            n_synthetic=args.synthetic, seed=args.seed)
+    except ValueError as e:
+        sys.exit(str(e))
+    output = args.output or surrogate_path(args.artifact)
+    save_surrogate(surrogate, output)
+    print(f"Wrote {output} ({os.path.getsize(output) / 1e6:.2f} MB) in "
+          f"{surrogate['distillation']['total_seconds']:.1f} s")
+    print_fidelity(surrogate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+Training pipeline for the heart disease ensemble.
+
+    python -m model.train heart.csv heart_model_ensemble.pkl --jobs 4
+
+Builds the model_components artifact loaded by model/load_model.py:
+the soft-voting 'ensemble', its four base models 'rf_model1', 'rf_model2',
+'gb_model1', 'gb_model2', the fitted 'scaler', the training 'feature_means'
+and 'feature_stds', and the ensemble's test 'accuracy'.
+
+The four base models are independent, so each is fitted in its own process
+(up to --jobs at a time). The voting ensemble is then assembled from those
+fitted models instead of refitting clones of them: the ensemble and the
+individual models share the same trees, in memory and in the pickle.
+
+Every random choice (train/test split, bootstrap samples, feature and row
+subsampling) is seeded from --seed, so the same data, seed and library
+versions always produce the same models. The default seed reproduces the
+models of the original Heart_disease_prediction.ipynb.
+
+Fit times, test metrics and the training settings are written to a JSON
+manifest next to the artifact (<output>.manifest.json).
+
+The fast-mode surrogate (see model/surrogate.py) is then distilled from the
+new models over the same data and saved next to the artifact
+(<output>.fast.pkl); its fidelity to the ensemble is added to the manifest.
+No surrogate is saved when its fidelity misses the thresholds of
+model/surrogate.py. Pass --no-fast-model to skip it.
+
+Last, the early-exit cascade (see model/cascade.py) is calibrated for the
+saved artifact (<output>.cascade.json) and its calibration report added to
+the manifest; when it misses its agreement target on the held-out rows no
+cascade is saved. Pass --no-cascade to skip it.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, VotingClassifier
+from sklearn.metrics import accuracy_score, brier_score_loss, log_loss, roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.utils import Bunch
+
+from model.load_model import artifact_version, hash_trees, load_model
+from model.cascade import calibrate, save_cascade, cascade_path, print_calibration
+from model.surrogate import distill, save_surrogate, surrogate_path, print_fidelity
+
+MANIFEST_FORMAT_VERSION = 1
+
+# Base models of the ensemble: (ensemble name, component key, class,
+# hyperparameters, seed multiplier). Each model's random_state is the
+# training seed times its multiplier (42 and 84 with the default seed).
+MEMBERS = [
+    ('rf1', 'rf_model1', RandomForestClassifier,
+     {'n_estimators': 200, 'max_depth': 10, 'class_weight': 'balanced'}, 1),
+    ('rf2', 'rf_model2', RandomForestClassifier,
+     {'n_estimators': 200, 'max_depth': 8, 'min_samples_leaf': 3, 'class_weight': 'balanced'}, 2),
+    ('gb1', 'gb_model1', GradientBoostingClassifier,
+     {'n_estimators': 200, 'learning_rate': 0.05, 'max_depth': 5, 'subsample': 0.8, 'min_samples_split': 5}, 1),
+    ('gb2', 'gb_model2', GradientBoostingClassifier,
+     {'n_estimators': 200, 'learning_rate': 0.1, 'max_depth': 4, 'subsample': 0.7, 'min_samples_split': 10}, 2),
+]
+
+DEFAULT_SEED = 42
+
+
+def fit_member(name, model_class, params, random_state, X, y):
+    """
+    Fit one base model (runs in a worker process)
+
+    Returns:
+        (name, fitted model, fit time in seconds)
+    """
+    model = model_class(random_state=random_state, **params)
+    start = time.perf_counter()
+    model.fit(X, y)
+    return name, model, time.perf_counter() - start
+
+
+def assemble_ensemble(members, y):
+    """
+    Build a fitted soft-voting VotingClassifier around already fitted models
+
+    Sets the attributes VotingClassifier.fit would, without cloning and
+    refitting the members.
+
+    Args:
+        members: List of (name, fitted model) pairs, in voting order
+        y: Training labels the members were fitted on
+    """
+    ensemble = VotingClassifier(estimators=members, voting='soft')
+    ensemble.le_ = LabelEncoder().fit(y)
+    ensemble.classes_ = ensemble.le_.classes_
+    ensemble.estimators_ = [model for _, model in members]
+    ensemble.named_estimators_ = Bunch(**dict(members))
+    first = ensemble.estimators_[0]
+    if hasattr(first, 'feature_names_in_'):
+        ensemble.feature_names_in_ = first.feature_names_in_
+    return ensemble
+
+
+def classification_metrics(y_true, proba):
+    """Test metrics of positive-class probabilities"""
+    return {
+        'accuracy': float(accuracy_score(y_true, proba >= 0.5)),
+        'roc_auc': float(roc_auc_score(y_true, proba)),
+        'log_loss': float(log_loss(y_true, proba, labels=[0, 1])),
+        'brier': float(brier_score_loss(y_true, proba))
+    }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_fingerprint(model_components):
+    """
+    Hash of the fitted parameters: every tree's node fields and values, the
+    scaler and the feature statistics
+
+    Pickled sklearn trees include uninitialized padding bytes of their node
+    records, so two runs that fit identical models can still write
+    different artifact bytes (and get a different model_version). Equal
+    fingerprints mean equal models.
+    """
+    digest = hashlib.sha256()
+    for key in ('rf_model1', 'rf_model2', 'gb_model1', 'gb_model2'):
+        hash_trees(digest, model_components[key])
+    scaler = model_components['scaler']
+    for array in (scaler.mean_, scaler.scale_, model_components['feature_means'], model_components['feature_stds']):
+        digest.update(np.ascontiguousarray(np.asarray(array, dtype=np.float64)).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def train(data_path, seed=DEFAULT_SEED, jobs=None, test_size=0.2):
+    """
+    Train the ensemble and its base models
+
+    Args:
+        data_path: CSV with the feature columns and a 'target' column
+        seed: Seed of the train/test split and of every model
+        jobs: Processes fitting base models in parallel (None: one per
+            CPU, at most one per model; 1 fits them in this process)
+        test_size: Share of rows held out for the test metrics
+
+    Returns:
+        (model_components, training report for the manifest)
+    """
+    started = time.perf_counter()
+    df = pd.read_csv(data_path).dropna()
+    X = df.drop(columns=['target'])
+    le = LabelEncoder().fit(df['target'])
+    y = le.transform(df['target'])
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=seed, stratify=y
+    )
+
+    # Scaled DataFrames keep the column names the models are fitted with
+    scaler = StandardScaler()
+    X_train_scaled = pd.DataFrame(scaler.fit_transform(X_train), columns=X.columns)
+    X_test_scaled = pd.DataFrame(scaler.transform(X_test), columns=X.columns)
+
+    jobs = min(jobs or os.cpu_count() or 1, len(MEMBERS))
+    tasks = [
+        (name, model_class, params, seed * multiplier, X_train_scaled, y_train)
+        for name, _, model_class, params, multiplier in MEMBERS
+    ]
+    print(f"Fitting {len(MEMBERS)} base models on {len(X_train)} rows with {jobs} process(es)...")
+    fit_start = time.perf_counter()
+    if jobs == 1:
+        fitted = [fit_member(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            fitted = list(executor.map(fit_member, *zip(*tasks)))
+    fit_wall = time.perf_counter() - fit_start
+    for name, _, seconds in fitted:
+        print(f"  {name}: {seconds:.2f} s")
+
+    members = [(name, model) for name, model, _ in fitted]
+    ensemble = assemble_ensemble(members, y_train)
+
+    member_metrics = {}
+    for name, model in members:
+        member_metrics[name] = classification_metrics(y_test, model.predict_proba(X_test_scaled)[:, 1])
+    ensemble_metrics = classification_metrics(y_test, ensemble.predict_proba(X_test_scaled)[:, 1])
+    print(f"Ensemble test accuracy: {ensemble_metrics['accuracy']:.4f}, ROC AUC: {ensemble_metrics['roc_auc']:.4f}")
+
+    model_components = {'ensemble': ensemble}
+    for (name, model), (_, key, _, _, _) in zip(members, MEMBERS):
+        model_components[key] = model
+    model_components.update({
+        'scaler': scaler,
+        'feature_means': X_train.mean(),
+        'feature_stds': X_train.std(),
+        'accuracy': ensemble_metrics['accuracy']
+    })
+
+    report = {
+        'data': {
+            'path': os.path.abspath(data_path),
+            'sha256': file_sha256(data_path),
+            'rows': len(df),
+            'train_rows': len(X_train),
+            'test_rows': len(X_test),
+            'features': X.columns.tolist()
+        },
+        'seed': seed,
+        'test_size': test_size,
+        'jobs': jobs,
+        'members': {
+            name: {
+                'component': key,
+                'class': model_class.__name__,
+                'params': params,
+                'random_state': seed * multiplier,
+                'fit_seconds': seconds,
+                'metrics': member_metrics[name]
+            }
+            for (name, key, model_class, params, multiplier), (_, _, seconds) in zip(MEMBERS, fitted)
+        },
+        'ensemble': {'voting': 'soft', 'metrics': ensemble_metrics},
+        'timing': {
+            'fit_wall_seconds': fit_wall,
+            'fit_seconds_sum': sum(seconds for _, _, seconds in fitted),
+            'total_seconds': time.perf_counter() - started
+        }
+    }
+    return model_components, report
+
+
+def manifest_path(output_path):
+    return os.path.splitext(output_path)[0] + '.manifest.json'
+
+
+def save(model_components, report, output_path):
+    """Write the artifact and its manifest; returns the manifest"""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    joblib.dump(model_components, output_path)
+
+    manifest = {
+        'format_version': MANIFEST_FORMAT_VERSION,
+        'artifact': os.path.basename(output_path),
+        # Same content hash load_model reports as the model version
+        'model_version': artifact_version(output_path),
+        'fingerprint': model_fingerprint(model_components),
+        'artifact_bytes': os.path.getsize(output_path),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        **report
+    }
+    write_manifest(manifest, output_path)
+    return manifest
+
+
+def write_manifest(manifest, output_path):
+    with open(manifest_path(output_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def save_fast_model(model_components, data_path, manifest, output_path, seed=DEFAULT_SEED):
+    """Distill and save the fast-mode surrogate of a saved artifact, recording it in the manifest"""
+    surrogate = distill(model_components, data_path, manifest['model_version'], seed=seed)
+    path = surrogate_path(output_path)
+    save_surrogate(surrogate, path)
+    manifest['fast_model'] = {
+        'artifact': os.path.basename(path),
+        'artifact_bytes': os.path.getsize(path),
+        'fidelity': surrogate['fidelity'],
+        'distillation': surrogate['distillation']
+    }
+    write_manifest(manifest, output_path)
+    return surrogate
+
+
+def save_cascade_calibration(data_path, manifest, output_path):
+    """Calibrate and save the early-exit cascade of a saved artifact, recording it in the manifest"""
+    calibration = calibrate(load_model(output_path, compile_trees=True), data_path)
+    path = cascade_path(output_path)
+    save_cascade(calibration, path)
+    manifest['cascade'] = {
+        'artifact': os.path.basename(path),
+        'agreement_target': calibration['agreement_target'],
+        'stage_fraction': calibration['stage_fraction'],
+        'margin': calibration['margin'],
+        'max_uncertainty': calibration['max_uncertainty'],
+        'calibration': calibration['calibration'],
+        'holdout': calibration['holdout']
+    }
+    write_manifest(manifest, output_path)
+    return calibration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data', help='Training CSV (heart.csv columns plus target)')
+    parser.add_argument('output', nargs='?', default='heart_model_ensemble.pkl', help='Artifact to write')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Seed of the split and all models')
+    parser.add_argument('--jobs', type=int, help='Parallel fitting processes (default: CPU count, at most 4)')
+    parser.add_argument('--test-size', type=float, default=0.2, help='Share of rows held out for metrics')
+    parser.add_argument('--no-fast-model', action='store_true', help='Do not distill the fast-mode surrogate')
+    parser.add_argument('--no-cascade', action='store_true', help='Do not calibrate the early-exit cascade')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data):
+        sys.exit(f"Training data not found at {args.data}")
+    model_components, report = train(args.data, seed=args.seed, jobs=args.jobs, test_size=args.test_size)
+    manifest = save(model_components, report, args.output)
+    print(f"Wrote {args.output} ({manifest['artifact_bytes'] / 1e6:.1f} MB, model version "
+          f"{manifest['model_version']}) and {manifest_path(args.output)}")
+    print(f"Base model fits: {report['timing']['fit_seconds_sum']:.1f} s of work in "
+          f"{report['timing']['fit_wall_seconds']:.1f} s wall time")
+
+    if not args.no_fast_model:
+        print("Distilling the fast-mode surrogate...")
+        try:
+            surrogate = save_fast_model(model_components, args.data, manifest, args.output, seed=args.seed)
+        except ValueError as e:
+            # The artifact is still complete; mode=fast answers 409 without a surrogate
+            print(f"No fast-mode surrogate saved: {e}")
+        else:
+            print(f"Wrote {surrogate_path(args.output)} in {surrogate['distillation']['total_seconds']:.1f} s")
+            print_fidelity(surrogate)
+
+    if not args.no_cascade:
+        print("Calibrating the early-exit cascade...")
+        try:
+            calibration = save_cascade_calibration(args.data, manifest, args.output)
+        except ValueError as e:
+            # The artifact is still complete; it is served without the cascade
+            print(f"No early-exit cascade saved: {e}")
+        else:
+            print(f"Wrote {cascade_path(args.output)}")
+            print_calibration(calibration)
+
+
+if __name__ == '__main__':
+    main()
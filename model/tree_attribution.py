@@ -0,0 +1,228 @@
+import functools
+import numpy as np
+
+# Rows evaluated together, and upper bound on rows x leaves per step; small
+# steps keep the temporaries in cache
+CHUNK_ROWS = 8
+MAX_BLOCK_CELLS = 8192
+
+
+@functools.lru_cache(maxsize=None)
+def quadrature(length):
+    """Gauss-Legendre nodes and weights on [0, 1] exact for polynomials of degree length - 1"""
+    nodes, weights = np.polynomial.legendre.leggauss((length + 1) // 2)
+    shape = (-1, 1, 1, 1)  # broadcast against (length, rows, leaves) arrays
+    return ((nodes + 1) / 2).astype(np.float32).reshape(shape), (weights / 2).astype(np.float32).reshape(shape)
+
+
+class TreeAttribution:
+    """
+    Exact path-dependent feature attributions (TreeSHAP values) of a tree ensemble.
+
+    Built from a compiled FlatTreeEnsemble and the training cover (weighted
+    sample count) of every node. At build time every leaf is reduced to its
+    path: for each distinct feature split on the way down, the interval
+    (lo, hi] a row must fall in to follow the path, and the fraction of
+    training cover that followed it. A leaf with value v and path features
+    1..d then contributes to feature i
+
+        v * (o_i - z_i) * integral_0^1 prod_{j != i} (z_j (1 - t) + o_j t) dt
+
+    where o_j says whether the row satisfies the interval of feature j and
+    z_j is its cover fraction. The integrand is a polynomial of degree d - 1,
+    so a Gauss-Legendre rule with ceil(d / 2) nodes evaluates it exactly.
+    Leaves are grouped by path length and every group is evaluated for all
+    rows at once, in float32.
+
+    Attributions of each model are in its raw score space (probability for
+    random forests, log-odds for gradient boosting) and sum with the model's
+    expected value to its raw score. attributions() maps them onto the
+    ensemble probability, so that base + attributions.sum() equals the
+    ensemble's predict_proba.
+    """
+
+    def __init__(self, engine, cover):
+        """
+        Args:
+            engine: FlatTreeEnsemble with a single output
+            cover: Training cover of every engine node, in engine node order
+        """
+        if engine.n_outputs != 1:
+            raise ValueError("Attributions need an engine with a single output")
+        cover = np.asarray(cover, dtype=np.float64)
+        n_features = int(engine.feature.max()) + 1
+        tree_member = engine.tree_to_member.argmax(axis=1)
+
+        # Walk all trees together, one level per step, carrying each path's
+        # per-feature interval and cover fraction
+        nodes = engine.roots
+        root_cover = cover[engine.roots]
+        member = tree_member
+        lo = np.full((len(nodes), n_features), -np.inf)
+        hi = np.full((len(nodes), n_features), np.inf)
+        fraction = np.ones((len(nodes), n_features))
+        split = np.zeros((len(nodes), n_features), dtype=bool)
+        leaves = []
+        while len(nodes):
+            is_leaf = engine.left[nodes] == nodes
+            leaves.append((nodes[is_leaf], root_cover[is_leaf], member[is_leaf],
+                           lo[is_leaf], hi[is_leaf], fraction[is_leaf], split[is_leaf]))
+            inner = ~is_leaf
+            nodes, root_cover, member = nodes[inner], root_cover[inner], member[inner]
+            lo, hi, fraction, split = lo[inner], hi[inner], fraction[inner], split[inner]
+
+            rows = np.arange(len(nodes))
+            feature = engine.feature[nodes]
+            threshold = engine.threshold[nodes]
+            children = []
+            for child, go_left in ((engine.left[nodes], True), (engine.right[nodes], False)):
+                child_lo, child_hi = lo.copy(), hi.copy()
+                if go_left:
+                    child_hi[rows, feature] = np.minimum(hi[rows, feature], threshold)
+                else:
+                    child_lo[rows, feature] = np.maximum(lo[rows, feature], threshold)
+                child_fraction = fraction.copy()
+                child_fraction[rows, feature] *= cover[child] / cover[nodes]
+                child_split = split.copy()
+                child_split[rows, feature] = True
+                children.append((child, root_cover, member, child_lo, child_hi, child_fraction, child_split))
+            nodes, root_cover, member, lo, hi, fraction, split = (
+                np.concatenate(parts) for parts in zip(*children))
+
+        leaf, root_cover, member, lo, hi, fraction, split = (np.concatenate(parts) for parts in zip(*leaves))
+        value = engine.value[leaf]
+
+        # Expected raw score of every model: cover-weighted mean leaf value plus bias
+        n_members = len(engine.member_bias)
+        expected = np.bincount(member, weights=value * cover[leaf] / root_cover, minlength=n_members)
+        self.member_expected = expected + engine.member_bias
+        self.member_sigmoid = engine.member_sigmoid
+        self.member_weight = engine.member_to_output[:, 0]
+
+        # Compact each path to its split features, sorted by path length; path
+        # arrays are stored slot-major, shape (max_length, n_leaves)
+        length = split.sum(axis=1)
+        order = np.argsort(length, kind='stable')
+        length, split = length[order], split[order]
+        slots = np.argsort(~split, axis=1, kind='stable')[:, :length.max()]
+        used = np.arange(slots.shape[1]) < length[:, np.newaxis]
+        taken = np.take_along_axis
+        self.path_feature = np.ascontiguousarray(np.where(used, slots, 0).T, dtype=np.intp)
+        self.path_lo = np.ascontiguousarray(np.where(used, taken(lo[order], slots, axis=1), -np.inf).T)
+        self.path_hi = np.ascontiguousarray(np.where(used, taken(hi[order], slots, axis=1), np.inf).T)
+        self.path_fraction = np.ascontiguousarray(
+            np.where(used, taken(fraction[order], slots, axis=1), 1.0).T, dtype=np.float32)
+        self.leaf_value = value[order].astype(np.float32)
+        self.leaf_output = (member[order] * n_features).astype(np.intp)
+        self.length_offsets = np.searchsorted(length, np.arange(self.path_feature.shape[0] + 2))
+        self.n_features = n_features
+
+    # Arrays that fully describe the attribution engine (see to_arrays/from_arrays)
+    ARRAY_FIELDS = ('path_feature', 'path_lo', 'path_hi', 'path_fraction', 'leaf_value', 'leaf_output',
+                    'length_offsets', 'member_expected', 'member_sigmoid', 'member_weight')
+
+    def to_arrays(self):
+        """Path and model arrays of the attribution engine, for saving to disk"""
+        return {field: getattr(self, field) for field in self.ARRAY_FIELDS}
+
+    @classmethod
+    def from_arrays(cls, arrays, n_features):
+        """Rebuild the attribution engine from saved arrays (which may be read-only memory maps)"""
+        attribution = cls.__new__(cls)
+        for field in cls.ARRAY_FIELDS:
+            setattr(attribution, field, np.asarray(arrays[field]))
+        attribution.n_features = n_features
+        return attribution
+
+    def member_attributions(self, X):
+        """
+        Attributions of every model in its raw score space
+
+        Returns:
+            Array of shape (n_rows, n_members, n_features); summed over features
+            and added to member_expected it gives each model's raw score
+        """
+        # Same float32 rounding of the inputs as the tree engine
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        n_rows, n_members = len(X), len(self.member_expected)
+        phi = np.zeros(n_rows * n_members * self.n_features)
+        if n_rows == 0:
+            return phi.reshape(0, n_members, self.n_features)
+
+        for start in range(0, n_rows, CHUNK_ROWS):
+            rows = X[start:start + CHUNK_ROWS].T
+            # Offset of each row in the flat output
+            row_offset = (np.arange(rows.shape[1]) + start)[:, np.newaxis] * (n_members * self.n_features)
+            block = max(1, MAX_BLOCK_CELLS // rows.shape[1])
+
+            for length in range(1, len(self.length_offsets) - 1):
+                nodes, weights = quadrature(length)
+
+                for first in range(self.length_offsets[length], self.length_offsets[length + 1], block):
+                    leaves = slice(first, min(first + block, self.length_offsets[length + 1]))
+                    feature = self.path_feature[:length, leaves]
+                    fraction = self.path_fraction[:length, np.newaxis, leaves]
+
+                    # (length, rows, leaves): does the row satisfy each path interval
+                    x = rows[feature].transpose(0, 2, 1)
+                    satisfied = (x > self.path_lo[:length, np.newaxis, leaves]) & \
+                                (x <= self.path_hi[:length, np.newaxis, leaves])
+                    delta = satisfied.astype(np.float32) - fraction
+
+                    # Integrand factors at every quadrature node, and the
+                    # integral of their product with each slot left out
+                    factors = fraction + delta * nodes
+                    integral = (weights * factors.prod(axis=1, keepdims=True) / factors).sum(axis=0)
+
+                    contribution = delta * integral * self.leaf_value[leaves]
+                    output = row_offset + (self.leaf_output[leaves] + feature)[:, np.newaxis, :]
+                    phi += np.bincount(output.ravel(), weights=contribution.ravel(), minlength=len(phi))
+
+        return phi.reshape(n_rows, n_members, self.n_features)
+
+    def attributions(self, X):
+        """
+        Attributions of the ensemble probability
+
+        Gradient boosting attributions are rescaled from log-odds onto the
+        probability change of their model (keeping their proportions), and
+        all models are combined with their soft-voting weights.
+
+        Returns:
+            (attributions of shape (n_rows, n_features), base probability);
+            base + attributions.sum(axis=1) is the ensemble probability
+        """
+        phi = self.member_attributions(X)
+        raw = self.member_expected + phi.sum(axis=2)
+        sigmoid = self.member_sigmoid.astype(bool)
+
+        base = np.where(sigmoid, 1.0 / (1.0 + np.exp(-self.member_expected)), self.member_expected)
+        proba = np.where(sigmoid, 1.0 / (1.0 + np.exp(-raw)), raw)
+        change = raw - self.member_expected
+        # Rows at the expected value use the sigmoid's slope
+        slope = np.divide(proba - base, change, out=proba * (1 - proba), where=np.abs(change) > 1e-12)
+        scale = np.where(sigmoid, slope, 1.0) * self.member_weight
+
+        return (phi * scale[:, :, np.newaxis]).sum(axis=1), float(base @ self.member_weight)
+
+
+def compile_tree_attribution(model_components, engine=None):
+    """
+    Build the attribution engine of the soft-voting ensemble
+
+    Args:
+        model_components: Components holding the fitted 'ensemble'
+        engine: Compiled tree engine of the ensemble, compiled here when not given
+    """
+    from model.tree_engine import FlatTreeEnsemble
+
+    ensemble = model_components['ensemble']
+    if engine is None:
+        engine = FlatTreeEnsemble([ensemble])
+
+    # Node covers in the engine's order: members, then their trees
+    cover = []
+    for model in ensemble.estimators_:
+        # Random forest trees are listed, boosting stages are an (n_stages, 1) array
+        cover.extend(estimator.tree_.weighted_n_node_samples for estimator in np.ravel(model.estimators_))
+    return TreeAttribution(engine, np.concatenate(cover))
@@ -0,0 +1,205 @@
+import warnings
+import numpy as np
+
+# Upper bound on rows x trees evaluated in one traversal pass
+MAX_CHUNK_CELLS = 1 << 20
+
+
+class FlatTreeEnsemble:
+    """
+    Flat-array evaluator for fitted sklearn tree ensembles.
+
+    Every tree of every model is exported once into contiguous node arrays
+    (feature, threshold, left/right child, leaf value). Scoring walks all
+    trees for all rows together, one tree level per NumPy step, and reduces
+    the leaf values to one positive-class probability per model.
+
+    Supported models: binary RandomForestClassifier, binary
+    GradientBoostingClassifier and soft-voting VotingClassifier over those,
+    and GradientBoostingRegressor (whose "probability" is its raw prediction).
+    """
+
+    def __init__(self, models):
+        # Only needed to compile; evaluating saved arrays does not import sklearn
+        from sklearn.ensemble import (GradientBoostingClassifier, GradientBoostingRegressor, RandomForestClassifier,
+                                      VotingClassifier)
+
+        features, thresholds, lefts, rights, values = [], [], [], [], []
+        roots, tree_members = [], []
+        member_bias, member_sigmoid = [], []
+        member_weights = []  # (member index, output index, weight)
+        self.max_depth = 0
+        n_nodes = 0
+
+        def add_tree(tree, leaf_values, member):
+            nonlocal n_nodes
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            # Leaves point to themselves and always "go left", so rows that
+            # reach a leaf early stay there for the remaining levels
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + n_nodes)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + n_nodes)
+            values.append(leaf_values)
+            roots.append(n_nodes)
+            tree_members.append(member)
+            self.max_depth = max(self.max_depth, tree.max_depth)
+            n_nodes += tree.node_count
+
+        def add_member(model, output, weight):
+            member = len(member_bias)
+            member_weights.append((member, output, weight))
+
+            if isinstance(model, RandomForestClassifier):
+                if len(model.classes_) != 2:
+                    raise ValueError("Only binary RandomForestClassifier models are supported")
+                for estimator in model.estimators_:
+                    counts = estimator.tree_.value[:, 0, :]
+                    normalizer = counts.sum(axis=1)
+                    normalizer[normalizer == 0] = 1
+                    add_tree(estimator.tree_, counts[:, 1] / normalizer / len(model.estimators_), member)
+                member_bias.append(0.0)
+                member_sigmoid.append(False)
+
+            elif isinstance(model, (GradientBoostingClassifier, GradientBoostingRegressor)):
+                if model.estimators_.shape[1] != 1:
+                    raise ValueError("Only binary GradientBoostingClassifier models are supported")
+                classifier = isinstance(model, GradientBoostingClassifier)
+                # The initial raw prediction is constant for the built-in
+                # init estimators; recover it from a decision_function call
+                origin = np.zeros((1, model.n_features_in_))
+                stage_sum = 0.0
+                for estimator in model.estimators_[:, 0]:
+                    add_tree(estimator.tree_, estimator.tree_.value[:, 0, 0] * model.learning_rate, member)
+                    stage_sum += model.learning_rate * estimator.predict(origin)[0]
+                with warnings.catch_warnings():
+                    # Models fitted on DataFrames warn about the unnamed origin row
+                    warnings.simplefilter('ignore', UserWarning)
+                    raw_prediction = model.decision_function if classifier else model.predict
+                    member_bias.append(raw_prediction(origin)[0] - stage_sum)
+                # Regressors predict the raw score itself
+                member_sigmoid.append(classifier)
+
+            else:
+                raise ValueError(f"Unsupported model type: {type(model).__name__}")
+
+        for output, model in enumerate(models):
+            if isinstance(model, VotingClassifier):
+                if model.voting != 'soft':
+                    raise ValueError("Only soft-voting VotingClassifier models are supported")
+                weights = model._weights_not_none
+                weights = np.ones(len(model.estimators_)) if weights is None else np.asarray(weights, dtype=np.float64)
+                for estimator, weight in zip(model.estimators_, weights / weights.sum()):
+                    add_member(estimator, output, weight)
+            else:
+                add_member(model, output, 1.0)
+
+        self.n_outputs = len(models)
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.concatenate(values).astype(np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+
+        # Leaf values of each tree are summed into their model's raw score
+        self.tree_to_member = np.zeros((len(roots), len(member_bias)))
+        self.tree_to_member[np.arange(len(roots)), tree_members] = 1.0
+        self.member_bias = np.asarray(member_bias)
+        self.member_sigmoid = np.asarray(member_sigmoid)
+
+        # Member probabilities are averaged into the requested outputs
+        self.member_to_output = np.zeros((len(member_bias), self.n_outputs))
+        for member, output, weight in member_weights:
+            self.member_to_output[member, output] = weight
+
+    # Arrays that fully describe a compiled ensemble (see to_arrays/from_arrays)
+    ARRAY_FIELDS = ('feature', 'threshold', 'left', 'right', 'value', 'roots',
+                    'tree_to_member', 'member_bias', 'member_sigmoid', 'member_to_output')
+
+    def to_arrays(self):
+        """Node and reduction arrays of the compiled ensemble, for saving to disk"""
+        return {field: getattr(self, field) for field in self.ARRAY_FIELDS}
+
+    @classmethod
+    def from_arrays(cls, arrays, max_depth):
+        """Rebuild an evaluator from saved arrays (which may be read-only memory maps)"""
+        engine = cls.__new__(cls)
+        for field in cls.ARRAY_FIELDS:
+            # Plain ndarray views of memory maps skip np.memmap's per-indexing overhead
+            setattr(engine, field, np.asarray(arrays[field]))
+        engine.max_depth = max_depth
+        engine.n_outputs = arrays['member_to_output'].shape[1]
+        return engine
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, X, roots=None):
+        """
+        Return the leaf node index reached by every row in every tree (or in
+        the trees starting at the given roots), shape (n_rows, n_trees)
+        """
+        roots = self.roots if roots is None else roots
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.repeat(roots[np.newaxis, :], X.shape[0], axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def tree_sums(self, X, trees=None):
+        """
+        Leaf values of every tree (or of the given tree indices) summed per
+        exported base model, before bias and sigmoid; shape (n_rows, n_members)
+        """
+        X = np.asarray(X)
+        roots, tree_to_member = self.roots, self.tree_to_member
+        if trees is not None:
+            roots, tree_to_member = roots[trees], tree_to_member[trees]
+        # Bound the (rows x trees) node-index working set for large batches
+        chunk_rows = max(1, MAX_CHUNK_CELLS // max(len(roots), 1))
+        return np.vstack([
+            self.value[self.apply(X[start:start + chunk_rows], roots)] @ tree_to_member
+            for start in range(0, max(len(X), 1), chunk_rows)
+        ])
+
+    def sums_to_proba(self, sums):
+        """Positive-class probability of every base model from its tree sums"""
+        raw = sums + self.member_bias
+        return np.where(self.member_sigmoid, 1.0 / (1.0 + np.exp(-raw)), raw)
+
+    def member_proba(self, X):
+        """Positive-class probability of every exported base model, shape (n_rows, n_members)"""
+        return self.sums_to_proba(self.tree_sums(X))
+
+    def predict_proba(self, X):
+        """Positive-class probability of every compiled model, shape (n_rows, n_models)"""
+        return self.member_proba(X) @ self.member_to_output
+
+
+def compile_tree_engine(model_components):
+    """
+    Export the fitted ensemble and its individual models into flat arrays
+
+    Returns:
+        Dictionary with an 'ensemble' evaluator (one output, the soft-voting
+        ensemble) and, unless the ensemble's members are the individual
+        models themselves ('shared_members'), a 'members' evaluator
+        (rf_model1, rf_model2, gb_model1, gb_model2 in that order). With
+        shared members the ensemble evaluator's member_proba() gives the
+        individual models' probabilities, so their trees are exported once
+    """
+    engines = {'ensemble': FlatTreeEnsemble([model_components['ensemble']])}
+    if not model_components.get('shared_members'):
+        engines['members'] = FlatTreeEnsemble([
+            model_components['rf_model1'],
+            model_components['rf_model2'],
+            model_components['gb_model1'],
+            model_components['gb_model2']
+        ])
+    return engines
@@ -1,8 +1,22 @@
 from dataclasses import Field
 from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, field_validator
+import numpy as np
+from pydantic import BaseModel, ValidationError, field_validator
 from pydantic.fields import Field
 
+# Allowed values of the categorical features, and the error raised for any other value
+CATEGORICAL_VALUES = {
+    'sex': ((0, 1), 'sex must be 0 (female) or 1 (male)'),
+    'cp': ((0, 1, 2, 3), 'cp must be between 0 and 3'),
+    'fbs': ((0, 1), 'value must be 0 or 1'),
+    'restecg': ((0, 1, 2), 'restecg must be between 0 and 2'),
+    'exang': ((0, 1), 'value must be 0 or 1'),
+    'slope': ((0, 1, 2), 'slope must be between 0 and 2'),
+    'ca': ((0, 1, 2, 3, 4), 'ca must be between 0 and 4'),
+    'thal': ((0, 1, 2, 3), 'thal must be between 0 and 3')
+}
+
+
 class PatientData(BaseModel):
     age: int = Field(..., example=63, description="Age in years")
     sex: int = Field(..., example=1, description="0 = female, 1 = male")
@@ -18,48 +32,18 @@ class PatientData(BaseModel):
     ca: int = Field(..., example=0, description="Number of major vessels colored by fluoroscopy (0-4)")
     thal: int = Field(..., example=1, description="Thalassemia (0-3)")
 
-    @field_validator('sex')
-    def sex_must_be_valid(cls, v):
-        if v not in [0, 1]:
-            raise ValueError('sex must be 0 (female) or 1 (male)')
-        return v
-    
-    @field_validator('cp')
-    def cp_must_be_valid(cls, v):
-        if v not in [0, 1, 2, 3]:
-            raise ValueError('cp must be between 0 and 3')
-        return v
-    
-    @field_validator('restecg')
-    def restecg_must_be_valid(cls, v):
-        if v not in [0, 1, 2]:
-            raise ValueError('restecg must be between 0 and 2')
-        return v
-    
-    @field_validator('fbs', 'exang')
-    def binary_must_be_valid(cls, v):
-        if v not in [0, 1]:
-            raise ValueError('value must be 0 or 1')
-        return v
-    
-    @field_validator('slope')
-    def slope_must_be_valid(cls, v):
-        if v not in [0, 1, 2]:
-            raise ValueError('slope must be between 0 and 2')
-        return v
-    
-    @field_validator('ca')
-    def ca_must_be_valid(cls, v):
-        if v not in [0, 1, 2, 3, 4]:
-            raise ValueError('ca must be between 0 and 4')
-        return v
-    
-    @field_validator('thal')
-    def thal_must_be_valid(cls, v):
-        if v not in [0, 1, 2, 3]:
-            raise ValueError('thal must be between 0 and 3')
+    @field_validator(*CATEGORICAL_VALUES)
+    def categorical_must_be_valid(cls, v, info):
+        allowed, message = CATEGORICAL_VALUES[info.field_name]
+        if v not in allowed:
+            raise ValueError(message)
         return v
 
+
+# Features in PatientData (and heart.csv) column order
+FEATURES = list(PatientData.model_fields)
+INTEGER_FEATURES = [name for name, field in PatientData.model_fields.items() if field.annotation is int]
+
 class PredictionResponse(BaseModel):
     prediction: Dict[str, Any]
     uncertainty: Dict[str, Any]
@@ -67,4 +51,64 @@ class PredictionResponse(BaseModel):
     key_contributors: Dict[str, Dict[str, Any]]
     report_date: str
     clinical_insights: Dict[str, List[str]]
-    visualization: Optional[str] = None
\ No newline at end of file
+    visualization: Optional[str] = None
+    report_id: Optional[str] = None
+    model_version: Optional[str] = None
+    mode: Optional[str] = None
+    trees_evaluated: Optional[int] = None
+    early_exit: Optional[bool] = None
+
+
+def _validation_message(error):
+    return '; '.join(
+        f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}"
+        for item in error.errors()
+    )
+
+
+def validate_patient(record):
+    """Validate one parsed record (e.g. a CSV row); returns (patient dict, None) or (None, error message)"""
+    try:
+        return PatientData.model_validate(record).model_dump(), None
+    except ValidationError as e:
+        return None, _validation_message(e)
+
+
+def validate_matrix(values, max_errors=20):
+    """
+    Apply the PatientData checks to a feature matrix, one vectorized pass per column
+
+    Integer features must be whole numbers and categorical features one of
+    their CATEGORICAL_VALUES; unlike PatientData, oldpeak must also be finite.
+    Error messages are the ones validate_patient reports.
+
+    Args:
+        values: (n_patients, 13) float array in FEATURES order
+        max_errors: Invalid rows to describe
+
+    Returns:
+        (number of invalid rows, [(row index, error message)] of the first
+        max_errors invalid rows)
+    """
+    problems = []
+    for j, feature in enumerate(FEATURES):
+        column = values[:, j]
+        not_finite = ~np.isfinite(column)
+        problems.append((feature, not_finite, 'Input should be a finite number'))
+        fractional = ~not_finite & (column != np.floor(column))
+        if feature in INTEGER_FEATURES:
+            problems.append((feature, fractional, 'Input should be a valid integer, got a number with a fractional part'))
+        if feature in CATEGORICAL_VALUES:
+            allowed, message = CATEGORICAL_VALUES[feature]
+            problems.append((feature, ~np.isin(column, allowed) & ~not_finite & ~fractional,
+                             f'Value error, {message}'))
+
+    invalid = np.zeros(len(values), dtype=bool)
+    for _, mask, _ in problems:
+        invalid |= mask
+    rows = np.flatnonzero(invalid)
+    errors = [
+        (int(row), '; '.join(f'{feature}: {message}' for feature, mask, message in problems if mask[row]))
+        for row in rows[:max_errors]
+    ]
+    return len(rows), errors
@@ -0,0 +1,165 @@
+"""
+Parsing of columnar /predict/columnar payloads into a feature matrix.
+
+Three encodings of the 13 heart.csv feature columns are accepted:
+    columns  JSON object of column arrays: {"age": [63, 37], "sex": [1, 1], ...}
+    arrow    Arrow IPC stream or file with one numeric column per feature
+    npy      .npy file of an (n_patients, 13) numeric matrix in heart.csv
+             column order (FEATURES in schema.py)
+
+Each parser returns an (n_patients, 13) float64 array in FEATURES order,
+to be checked with schema.validate_matrix. A float64 .npy body in native
+byte order is used in place, without a copy; Arrow columns are read
+without a copy and gathered into the matrix once; JSON column arrays are
+converted one column at a time. Extra columns are ignored.
+"""
+import io
+import json
+import numpy as np
+from schema import FEATURES
+
+# Body content types and the format they are parsed as
+COLUMNAR_FORMATS = {
+    'application/json': 'columns',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.arrow.file': 'arrow',
+    'application/x-npy': 'npy'
+}
+
+
+class ColumnarFormatError(ValueError):
+    """Raised when a payload cannot be parsed into a feature matrix"""
+
+
+def columnar_format(content_type, requested=None):
+    """Resolve the payload format from an explicit format or the Content-Type header"""
+    if requested:
+        if requested not in ('columns', 'arrow', 'npy'):
+            raise ValueError(f"Unsupported columnar format: {requested}")
+        return requested
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unsupported content type: {media_type or 'none'} (use application/json, "
+                         f"application/vnd.apache.arrow.stream or application/x-npy)")
+    return COLUMNAR_FORMATS[media_type]
+
+
+def _matrix(columns, n_patients):
+    """Gather per-feature columns into an (n_patients, 13) float64 matrix"""
+    values = np.empty((n_patients, len(FEATURES)), dtype=np.float64)
+    for j, column in enumerate(columns):
+        values[:, j] = column
+    return values
+
+
+def parse_json_columns(body):
+    """Feature matrix of a JSON object of column arrays"""
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise ColumnarFormatError(f"Invalid JSON: {e}")
+    if not isinstance(payload, dict):
+        raise ColumnarFormatError("Expected a JSON object of column arrays")
+    missing = [feature for feature in FEATURES if feature not in payload]
+    if missing:
+        raise ColumnarFormatError(f"Missing columns: {', '.join(missing)}")
+
+    columns = []
+    for feature in FEATURES:
+        if not isinstance(payload[feature], list):
+            raise ColumnarFormatError(f"Column {feature} is not an array")
+        try:
+            columns.append(np.array(payload[feature], dtype=np.float64))
+        except (TypeError, ValueError):
+            raise ColumnarFormatError(f"Column {feature} has non-numeric values")
+        if columns[-1].ndim != 1:
+            raise ColumnarFormatError(f"Column {feature} is not a flat array")
+    lengths = {len(column) for column in columns}
+    if len(lengths) > 1:
+        raise ColumnarFormatError(f"Columns have different lengths: {sorted(lengths)}")
+    return _matrix(columns, lengths.pop())
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ColumnarFormatError("Arrow payloads need pyarrow on the server: pip install pyarrow")
+    return pyarrow
+
+
+def parse_arrow(body):
+    """Feature matrix of an Arrow IPC stream or file"""
+    pa = _require_pyarrow()
+    buffer = pa.py_buffer(body)
+    try:
+        if body[:6] == b'ARROW1':
+            table = pa.ipc.open_file(buffer).read_all()
+        else:
+            table = pa.ipc.open_stream(buffer).read_all()
+    except pa.ArrowInvalid as e:
+        raise ColumnarFormatError(f"Invalid Arrow IPC data: {e}")
+    missing = [feature for feature in FEATURES if feature not in table.column_names]
+    if missing:
+        raise ColumnarFormatError(f"Missing columns: {', '.join(missing)}")
+
+    columns = []
+    for feature in FEATURES:
+        column = table.column(feature)
+        if not (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+                or pa.types.is_boolean(column.type)):
+            raise ColumnarFormatError(f"Column {feature} has non-numeric type {column.type}")
+        if column.null_count:
+            raise ColumnarFormatError(f"Column {feature} has {column.null_count} missing values")
+        # Zero-copy for numeric columns without nulls stored in one chunk
+        columns.append(column.to_numpy())
+    return _matrix(columns, table.num_rows)
+
+
+def parse_npy(body):
+    """Feature matrix of a .npy file, used in place when it is float64 in native byte order"""
+    stream = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    except ValueError as e:
+        raise ColumnarFormatError(f"Invalid .npy data: {e}")
+    if len(shape) != 2 or shape[1] != len(FEATURES):
+        raise ColumnarFormatError(f"Expected an (n, {len(FEATURES)}) matrix, got shape {shape}")
+    if dtype.kind not in 'biuf':
+        raise ColumnarFormatError(f"Expected a numeric matrix, got dtype {dtype}")
+
+    count = shape[0] * shape[1]
+    if len(body) - stream.tell() < count * dtype.itemsize:
+        raise ColumnarFormatError(f"Truncated .npy data: expected {count} values")
+    values = np.frombuffer(body, dtype=dtype, count=count, offset=stream.tell())
+    values = values.reshape(shape, order='F' if fortran_order else 'C')
+    return values.astype(np.float64, copy=False)
+
+
+PARSERS = {
+    'columns': parse_json_columns,
+    'arrow': parse_arrow,
+    'npy': parse_npy
+}
+
+
+def parse_columnar(body, fmt):
+    """
+    Parse a columnar payload
+
+    Args:
+        body: Raw request body
+        fmt: 'columns', 'arrow' or 'npy' (see columnar_format)
+
+    Returns:
+        (n_patients, 13) float64 array in FEATURES order
+
+    Raises:
+        ColumnarFormatError: If the payload cannot be parsed
+    """
+    return PARSERS[fmt](body)
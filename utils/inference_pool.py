@@ -0,0 +1,307 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+import concurrent.futures
+import pandas as pd
+from starlette.concurrency import run_in_threadpool
+from model.load_model import load_model
+from model.predict import predict_heart_disease_batch
+from model.feature_schema import get_feature_schema
+from utils.metrics import StageTimer
+from schema import FEATURES
+
+# Model components of the current process: loaded once per pool worker by
+# _init_worker. Inline pools set them per thread instead, so pools of
+# different model versions can run side by side in the server process
+_worker_components = None
+_inline = threading.local()
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the pool already holds the maximum number of queued and running tasks"""
+
+
+class PoolTimeoutError(Exception):
+    """Raised when a task does not finish within the configured timeout"""
+
+
+class PoolClosedError(Exception):
+    """Raised when a task is submitted to, or cancelled by, a pool that has been shut down"""
+
+
+def _init_worker(model_path, compile_trees, cascade):
+    global _worker_components
+    _worker_components = load_model(model_path, compile_trees=compile_trees, cascade=cascade)
+
+
+def _components():
+    return getattr(_inline, 'components', None) or _worker_components
+
+
+def _ping():
+    return _worker_components is not None
+
+
+def _attach_visualization(result, z_scores, include_visualization, model_components=None):
+    # Imported on first use so matplotlib stays out of the import path
+    from utils.virtualization import visualize_z_scores, visualization_fields
+
+    feature_schema = get_feature_schema(model_components or _components())
+    if include_visualization:
+        img_base64 = visualize_z_scores(z_scores, feature_schema, result)
+        result['visualization'] = f"data:image/png;base64,{img_base64}"
+    else:
+        # The server registers the fields and replaces them with a /visualization/{id} URL
+        result['visualization_fields'] = visualization_fields(z_scores, feature_schema, result)
+    return result
+
+
+def predict_task(patient_dict, include_visualization=False):
+    """Run a single /predict request in a pool worker"""
+    results, stage_durations = predict_many_task([patient_dict], [include_visualization])
+    return results[0], stage_durations
+
+
+def predict_fast_task(patient_dict, fast_model, include_visualization=False):
+    """
+    Run a /predict?mode=fast request on the distilled surrogate of a model version
+
+    Meant for the server's thread pool rather than a pool worker: the
+    surrogate (see model/surrogate.py) scores a patient in a fraction of a
+    millisecond, less than the round trip to a worker process.
+    """
+    stage_timer = StageTimer()
+    results, z_scores = predict_heart_disease_batch([patient_dict], fast_model, return_z_scores=True,
+                                                    stage_timer=stage_timer, mode='fast')
+    result = _attach_visualization(results[0], z_scores[0], include_visualization, fast_model)
+    stage_timer.lap('visualization')
+    return result, stage_timer.durations
+
+
+def predict_many_task(patient_dicts, include_visualization_flags):
+    """
+    Run several coalesced /predict requests as one batch in a pool worker
+
+    Returns:
+        The results and the time spent in each stage, in seconds
+    """
+    stage_timer = StageTimer()
+    # The z-scores computed for abnormal-feature detection are reused by the plot
+    results, z_scores = predict_heart_disease_batch(patient_dicts, _components(),
+                                                    return_z_scores=True, stage_timer=stage_timer)
+    results = [
+        _attach_visualization(result, patient_z_scores, include_visualization)
+        for result, patient_z_scores, include_visualization in zip(results, z_scores, include_visualization_flags)
+    ]
+    stage_timer.lap('visualization')
+    return results, stage_timer.durations
+
+
+def predict_batch_task(patient_dicts):
+    """Run a /predict/batch request in a pool worker, returning the results and stage durations"""
+    stage_timer = StageTimer()
+    results = predict_heart_disease_batch(patient_dicts, _components(), stage_timer=stage_timer)
+    return results, stage_timer.durations
+
+
+def predict_matrix_task(values):
+    """Run a /predict/columnar request in a pool worker: values is a validated feature matrix in FEATURES order"""
+    stage_timer = StageTimer()
+    results = predict_heart_disease_batch(pd.DataFrame(values, columns=FEATURES, copy=False), _components(),
+                                          stage_timer=stage_timer)
+    return results, stage_timer.durations
+
+
+def warm_up_task(patient_dicts):
+    """
+    Run synthetic patients through every prediction path of a pool worker
+
+    Returns:
+        The visualization fields of the patients, so the caller can warm up rendering too
+    """
+    predict_heart_disease_batch(patient_dicts, _components())
+    plots = []
+    for patient_dict in patient_dicts:
+        predict_task(patient_dict, include_visualization=True)
+        result, _ = predict_task(patient_dict)
+        plots.append(result['visualization_fields'])
+    return plots
+
+
+class InferencePool:
+    """
+    Long-lived pool of inference worker processes.
+
+    Each worker loads the model artifact once at start-up. At most
+    `workers + queue_depth` tasks are admitted at a time; further
+    submissions fail fast with PoolSaturatedError so the API can shed load
+    instead of queueing without bound. Callers await results without
+    blocking the event loop.
+
+    With workers=0 tasks run inline on the server's thread pool against
+    the given model components, which is useful for development.
+    """
+
+    def __init__(self, model_path, model_components=None, workers=1, queue_depth=8, timeout=30.0,
+                 compile_trees=True, cascade=False):
+        self.model_path = model_path
+        self.model_components = model_components
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.compile_trees = compile_trees
+        self.cascade = cascade
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_depth)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+
+    @property
+    def in_flight(self):
+        """Number of admitted tasks that have not finished yet"""
+        return self._in_flight
+
+    def start(self, nice=0):
+        """
+        Start the workers and wait until every one of them has loaded the model
+
+        Args:
+            nice: Run the workers this much lower in CPU priority (Linux), so
+                that loading a new model version does not slow down the
+                version still serving requests; see restore_priority()
+        """
+        if self.workers == 0:
+            if self.model_components is None:
+                self.model_components = load_model(self.model_path, compile_trees=self.compile_trees,
+                                                   cascade=self.cascade)
+            return
+
+        # Spawn rather than fork so workers do not inherit the server's
+        # event loop and threads
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_path, self.compile_trees, self.cascade)
+        )
+        pings = [self._executor.submit(_ping) for _ in range(self.workers)]
+        if nice:
+            # Workers are spawned by submit(); lower their priority before
+            # they get through the imports and the model load
+            self._set_worker_priority(os.getpriority(os.PRIO_PROCESS, 0) + nice)
+        concurrent.futures.wait(pings)
+        for ping in pings:
+            ping.result()
+
+    def warm_up(self, patient_dicts):
+        """
+        Run warm_up_task once per worker and wait for all of them
+
+        Returns:
+            The visualization fields returned by the warm-up
+        """
+        if self._executor is None:
+            return self._run_inline(warm_up_task, patient_dicts)
+
+        runs = [self._executor.submit(warm_up_task, patient_dicts) for _ in range(self.workers)]
+        concurrent.futures.wait(runs)
+        plots = [run.result() for run in runs]
+        return plots[0]
+
+    def _set_worker_priority(self, priority):
+        for pid in list(self._executor._processes):
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, priority)
+            except ProcessLookupError:
+                pass
+
+    def restore_priority(self):
+        """
+        Give workers started with start(nice=...) the server's CPU priority again
+
+        Raising priority needs CAP_SYS_NICE (e.g. running as root, as in the
+        Docker image); without it the workers keep the lower priority.
+
+        Returns:
+            Whether the priority was restored
+        """
+        if self._executor is None:
+            return True
+        try:
+            self._set_worker_priority(os.getpriority(os.PRIO_PROCESS, 0))
+        except PermissionError:
+            return False
+        return True
+
+    def shutdown(self):
+        """Stop accepting tasks, cancel queued ones and wait for the running ones"""
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _run_inline(self, task, *args):
+        _inline.components = self.model_components
+        try:
+            return task(*args)
+        finally:
+            _inline.components = None
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, task, *args):
+        """
+        Run a task function in the pool and await its result
+
+        Raises:
+            PoolSaturatedError: If no queue slot is free
+            PoolTimeoutError: If the task does not finish within the timeout
+            PoolClosedError: If the pool was shut down (e.g. its model version
+                was unloaded) before the task could run
+        """
+        if self._closed:
+            raise PoolClosedError("Inference pool is closed; its model version was unloaded")
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturatedError(f"Inference queue is full ({self.workers} workers, depth {self.queue_depth})")
+        with self._lock:
+            self._in_flight += 1
+
+        if self.workers == 0:
+            try:
+                return await asyncio.wait_for(run_in_threadpool(self._run_inline, task, *args), self.timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeoutError(f"Inference did not finish within {self.timeout}s")
+            finally:
+                self._release()
+
+        executor = self._executor
+        try:
+            if executor is None:
+                raise RuntimeError("executor is shut down")
+            future = executor.submit(task, *args)
+        except RuntimeError:
+            # shutdown() ran after the closed check above
+            self._release()
+            raise PoolClosedError("Inference pool is closed; its model version was unloaded")
+        except Exception:
+            self._release()
+            raise
+        # The slot is held until the worker is done (or the task is cancelled
+        # before it starts), so timed-out tasks still count against the queue
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"Inference did not finish within {self.timeout}s")
+        except asyncio.CancelledError:
+            # shutdown() cancelled the queued task; the caller itself was not cancelled
+            if self._closed and not asyncio.current_task().cancelling():
+                raise PoolClosedError("Inference pool was closed before the task ran")
+            raise
+
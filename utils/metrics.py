@@ -0,0 +1,237 @@
+"""
+Low-overhead request metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain Python objects guarded by a lock; an
+observation is a dictionary lookup, a bisect and two additions. Values
+that other components already track (result cache hits, pool queue depth)
+are read through callbacks when /metrics is scraped instead of being
+counted twice.
+
+Inference runs in pool worker processes, so stage durations measured there
+with a StageTimer travel back with the task result and are recorded into
+the registry by the server process.
+"""
+import time
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageTimer:
+    """
+    Lap timer that accumulates the wall time spent in named stages
+
+    Each lap() charges the time since the previous lap (or since start())
+    to the given stage.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.durations[stage] = self.durations.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series_items = sorted((label_values, list(series)) for label_values, series in self._series.items())
+        for label_values, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.label_names, label_values, [('le', '+Inf')])
+            yield f'{self.name}_bucket{labels} {series[-2]}'
+            labels = _format_labels(self.label_names, label_values)
+            yield f'{self.name}_count{labels} {series[-2]}'
+            yield f'{self.name}_sum{labels} {_format_value(series[-1])}'
+
+
+class CallbackMetric:
+    """Gauge or counter whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, kind, callback):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+
+    def collect(self):
+        value = self.callback()
+        if value is None:
+            return
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield f'{self.name} {_format_value(value)}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge_callback(self, name, documentation, callback):
+        return self.register(CallbackMetric(name, documentation, 'gauge', callback))
+
+    def counter_callback(self, name, documentation, callback):
+        return self.register(CallbackMetric(name, documentation, 'counter', callback))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    'heart_http_requests_total', 'HTTP requests by route, method and status code', ('route', 'method', 'status'))
+http_request_duration = registry.histogram(
+    'heart_http_request_duration_seconds', 'HTTP request latency by route', ('route',))
+stage_duration = registry.histogram(
+    'heart_stage_duration_seconds', 'Time spent in each stage of request handling', ('stage',))
+inference_errors = registry.counter(
+    'heart_inference_errors_total', 'Inference requests that failed, by reason', ('reason',))
+patients_scored = registry.counter(
+    'heart_patients_scored_total', 'Patients scored, by path (full, early_exit or fast)', ('path',))
+trees_evaluated = registry.counter(
+    'heart_trees_evaluated_total', 'Trees evaluated for scored patients, by path', ('path',))
+
+
+def observe_stages(durations):
+    """Record the stage durations (in seconds) of one request"""
+    for stage, seconds in durations.items():
+        stage_duration.observe(seconds, stage)
+
+
+def observe_scoring(results):
+    """Count the patients of freshly scored results and the trees evaluated for them"""
+    for result in results:
+        path = 'fast' if result['mode'] == 'fast' else 'early_exit' if result['early_exit'] else 'full'
+        patients_scored.inc(path)
+        trees_evaluated.inc(path, amount=result['trees_evaluated'])
+
+
+def server_timing(durations):
+    """Format stage durations as a Server-Timing header value"""
+    return ', '.join(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in durations.items())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests and timing them per route
+
+    Requests are labelled with the matched route template (e.g.
+    /visualization/{vis_id}) to keep the number of series bounded. With
+    server_timing enabled, stage durations that a handler stored in
+    request.state.stage_timings are sent back in a Server-Timing header.
+    """
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.send_server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.send_server_timing:
+                    durations = dict(scope.get('state', {}).get('stage_timings') or {})
+                    durations['total'] = time.perf_counter() - start
+                    headers = list(message.get('headers', []))
+                    headers.append((b'server-timing', server_timing(durations).encode('latin-1')))
+                    message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            route_path = route.path if route is not None else 'unmatched'
+            http_requests.inc(route_path, scope['method'], str(status))
+            http_request_duration.observe(time.perf_counter() - start, route_path)
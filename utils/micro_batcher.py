@@ -0,0 +1,109 @@
+import time
+import asyncio
+from collections import Counter
+from utils.inference_pool import predict_many_task
+
+# Upper bounds (ms) of the queue wait histogram buckets
+WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent /predict requests into small batches.
+
+    The first request to arrive opens a window of `window_ms`; every request
+    that arrives before it closes (or until `max_batch_size` requests are
+    waiting) is scored together in one predict_heart_disease_batch call on
+    the inference pool, and the results are handed back to their callers.
+    Errors raised by the pool (e.g. saturation) are passed to every caller
+    in the batch.
+    """
+
+    def __init__(self, inference_pool, window_ms=2.0, max_batch_size=32):
+        self.inference_pool = inference_pool
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._timer = None
+
+        # Metrics
+        self.batch_sizes = Counter()
+        self.wait_buckets = [0] * len(WAIT_BUCKETS_MS)
+        self.wait_count = 0
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    async def predict(self, patient_dict, include_visualization=False):
+        """
+        Queue one patient for the next batch and await its result
+
+        Returns:
+            The result and the stage durations of the batch it was scored in
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((patient_dict, include_visualization, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self._record(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    def _record(self, batch):
+        now = time.perf_counter()
+        self.batch_sizes[len(batch)] += 1
+        for *_, enqueued in batch:
+            wait_ms = (now - enqueued) * 1000
+            self.wait_count += 1
+            self.wait_sum_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            for i, bound in enumerate(WAIT_BUCKETS_MS):
+                if wait_ms <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+
+    async def _run(self, batch):
+        patient_dicts = [patient_dict for patient_dict, *_ in batch]
+        flags = [include_visualization for _, include_visualization, *_ in batch]
+        try:
+            results, stage_durations = await self.inference_pool.run(predict_many_task, patient_dicts, flags)
+        except Exception as e:
+            for *_, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result((result, stage_durations))
+
+    def stats(self):
+        """Batch size distribution and queue wait statistics"""
+        batches = sum(self.batch_sizes.values())
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": batches,
+            "requests": self.wait_count,
+            "mean_batch_size": self.wait_count / batches if batches else 0.0,
+            "batch_size_distribution": dict(sorted(self.batch_sizes.items())),
+            "queue_wait_ms": {
+                "mean": self.wait_sum_ms / self.wait_count if self.wait_count else 0.0,
+                "max": self.wait_max_ms,
+                "buckets": {
+                    ("+Inf" if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(WAIT_BUCKETS_MS, self.wait_buckets)
+                }
+            }
+        }
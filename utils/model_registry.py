@@ -0,0 +1,247 @@
+"""
+Versioned model artifacts in a local directory, with zero-downtime swaps.
+
+The registry directory holds model artifacts: joblib pickles (*.pkl) and
+memory-mapped artifact directories (see model/artifact.py). The artifact to
+serve is the one named in the directory's `current` file (one line, the
+artifact's name), or the default artifact when there is none.
+
+Every loaded artifact is a ModelVersion: its version (the content hash
+load_model reports), its own inference pool and, when one was distilled
+from it, its fast-mode surrogate (<base>.fast.pkl next to the artifact, see
+model/surrogate.py; not an artifact of its own). A swap loads and warms the
+new version on a fresh pool while the current one keeps serving, then
+replaces the active version in one assignment. Requests hold the version
+they acquired until they finish, so requests in flight during a swap
+complete on the old version; once none are left (or after drain_timeout)
+its pool is shut down and its memory released.
+"""
+import os
+import time
+import threading
+from model.load_model import model_version
+from model.surrogate import SURROGATE_SUFFIX
+from model.artifact import MANIFEST_NAME, is_mmap_artifact
+
+# File in the registry directory naming the artifact to serve
+POINTER_NAME = 'current'
+
+
+class SwapInProgressError(Exception):
+    """Raised when a swap is requested while another one is loading"""
+
+
+def artifact_signature(path):
+    """(path, size, mtime) of an artifact, which changes whenever it is replaced"""
+    stat_path = os.path.join(path, MANIFEST_NAME) if is_mmap_artifact(path) else path
+    stat = os.stat(stat_path)
+    return os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+
+
+class ModelVersion:
+    """One loaded model artifact and the inference pool serving it"""
+
+    def __init__(self, version, path, pool, micro_batcher=None, fast_model=None):
+        self.version = version
+        self.path = path
+        self.pool = pool
+        self.micro_batcher = micro_batcher
+        self.fast_model = fast_model
+        self.signature = artifact_signature(path)
+        self.loaded_at = time.time()
+        self.in_flight = 0
+
+    def close(self):
+        self.pool.shutdown()
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'artifact': os.path.basename(self.path.rstrip('/')),
+            'loaded_at': self.loaded_at,
+            'in_flight': self.in_flight,
+            'fast_model': self.fast_model['fidelity'] if self.fast_model is not None else None
+        }
+
+
+class ModelRegistry:
+    """
+    Model versions of a registry directory and the one currently served.
+
+    `loader(path, version)` builds a loaded and warmed-up ModelVersion; it
+    runs on the caller's thread and may take seconds. `on_activate(version)`
+    is called right after a version becomes active.
+    """
+
+    def __init__(self, directory, default_path, loader, drain_timeout=300.0, on_activate=None):
+        self.directory = directory
+        self.default_path = default_path
+        self.loader = loader
+        self.drain_timeout = drain_timeout
+        self.on_activate = on_activate
+        self.active = None
+        self.draining = []
+        self.loading = None
+        self.swaps = 0
+        self.last_error = None
+        self._failed_signature = None
+        self._lock = threading.Lock()
+
+    def artifacts(self):
+        """Names of the artifacts in the registry directory"""
+        names = []
+        for name in sorted(os.listdir(self.directory)):
+            # Artifacts being exported are staged in hidden directories
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            # Fast-mode surrogates are served with the artifact they were distilled from
+            if os.path.isfile(path) and name.endswith('.pkl') and not name.endswith(SURROGATE_SUFFIX):
+                names.append(name)
+            elif is_mmap_artifact(path):
+                names.append(name)
+        return names
+
+    def resolve(self, name):
+        """
+        Path of a named artifact of the registry directory
+
+        Raises:
+            ValueError: If the directory holds no artifact of that name
+        """
+        if name not in self.artifacts():
+            raise ValueError(f"No model artifact named {name!r} in {self.directory}")
+        return os.path.join(self.directory, name)
+
+    def target(self):
+        """Path of the artifact that should be served: the `current` pointer, or the default"""
+        pointer = os.path.join(self.directory, POINTER_NAME)
+        if os.path.isfile(pointer):
+            with open(pointer) as f:
+                name = f.read().strip()
+            if name:
+                return self.resolve(name)
+        return self.default_path
+
+    def changed(self):
+        """Whether the target artifact differs from the active one (and has not failed to load)"""
+        try:
+            signature = artifact_signature(self.target())
+        except (OSError, ValueError):
+            return False
+        active = self.active
+        return signature != self._failed_signature and (active is None or signature != active.signature)
+
+    def acquire(self):
+        """
+        The active version, held until release(); None before the first load
+
+        A request scores every row on the version it acquired, even if a
+        swap completes meanwhile.
+        """
+        with self._lock:
+            version = self.active
+            if version is not None:
+                version.in_flight += 1
+            return version
+
+    def release(self, version):
+        with self._lock:
+            version.in_flight -= 1
+
+    def activate(self, path, update_pointer=False):
+        """
+        Load the artifact at path and make it the active version (blocking)
+
+        Does nothing if the artifact's version is already active. The
+        previous version is drained and shut down in the background. With
+        update_pointer, the `current` file is pointed at the artifact once
+        it is active, so the file watch and restarts keep serving it.
+
+        Raises:
+            SwapInProgressError: If another swap is loading
+        """
+        with self._lock:
+            if self.loading is not None:
+                raise SwapInProgressError(f"Already loading {os.path.basename(self.loading)}")
+            self.loading = path
+
+        try:
+            signature = artifact_signature(path)
+            version = model_version(path)
+            active = self.active
+            if active is not None and active.version == version:
+                # Same model under a new name or file time: nothing to load
+                active.path, active.signature = path, signature
+                if update_pointer:
+                    self._write_pointer(path)
+                return active
+
+            print(f"Loading model version {version} from {path}...")
+            new = self.loader(path, version)
+            with self._lock:
+                previous, self.active = self.active, new
+                self.swaps += 1
+                if previous is not None:
+                    self.draining.append(previous)
+            self.last_error = None
+            if update_pointer:
+                self._write_pointer(path)
+            if self.on_activate is not None:
+                self.on_activate(new)
+            print(f"Serving model version {version}")
+
+            if previous is not None:
+                threading.Thread(target=self._drain, args=(previous,), daemon=True).start()
+            return new
+        except Exception as e:
+            try:
+                # Not retried by the file watch until the artifact changes again
+                self._failed_signature = artifact_signature(path)
+            except OSError:
+                self._failed_signature = None
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            with self._lock:
+                self.loading = None
+
+    def _write_pointer(self, path):
+        pointer = os.path.join(self.directory, POINTER_NAME)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(os.path.basename(path.rstrip('/')) + '\n')
+        os.replace(pointer + '.tmp', pointer)
+
+    def _drain(self, version):
+        deadline = time.monotonic() + self.drain_timeout
+        while version.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if version.in_flight > 0:
+            print(f"Model version {version.version} still has {version.in_flight} request(s) "
+                  f"after {self.drain_timeout}s; unloading anyway")
+        version.close()
+        with self._lock:
+            # close() may have cleared the list already
+            if version in self.draining:
+                self.draining.remove(version)
+        print(f"Unloaded model version {version.version}")
+
+    def close(self):
+        """Shut down the pools of every loaded version"""
+        with self._lock:
+            versions = ([self.active] if self.active is not None else []) + self.draining
+            self.active = None
+            self.draining = []
+        for version in versions:
+            version.close()
+
+    def status(self):
+        return {
+            'directory': self.directory,
+            'active': self.active.describe() if self.active is not None else None,
+            'draining': [version.describe() for version in self.draining],
+            'loading': os.path.basename(self.loading.rstrip('/')) if self.loading else None,
+            'artifacts': self.artifacts(),
+            'swaps': self.swaps,
+            'last_error': self.last_error
+        }
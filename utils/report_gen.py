@@ -26,6 +26,8 @@ def generate_report(results, include_visualization=False):
     report.append(f"Prediction Reliability: {results['uncertainty']['reliability_percent']:.1f}%")
     report.append(f"Uncertainty Level: {results['uncertainty']['uncertainty_percent']:.1f}%")
     report.append(f"Assessment: {results['uncertainty']['assessment']}")
+    if results.get('mode') == 'fast':
+        report.append("Scoring Mode: fast (distilled surrogate of the ensemble; approximate)")
     report.append("")
     
     # Key insights
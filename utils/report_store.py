@@ -0,0 +1,285 @@
+"""
+Persistent store of generated reports.
+
+Every /predict report is saved, together with the prediction JSON, to a
+local SQLite database so it can be fetched again without re-predicting.
+Writes go through a write-behind queue: submit() only appends to an
+in-memory queue, and a single writer thread drains it, inserting up to
+`batch_size` reports per transaction. The request path never touches the
+disk. Reports still waiting in the queue are served from memory, so a
+report can be read back as soon as it has been submitted.
+
+When the queue is full (the disk cannot keep up), new reports are dropped
+and counted instead of blocking callers. A batch whose transaction fails
+is retried with exponential backoff, still readable from memory meanwhile;
+only after its last retry is it dropped and counted as write errors.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    risk_level TEXT NOT NULL,
+    probability REAL NOT NULL,
+    model_version TEXT,
+    prediction TEXT NOT NULL,
+    report TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_created_at ON reports (created_at, id);
+CREATE INDEX IF NOT EXISTS reports_risk_level_created_at ON reports (risk_level, created_at, id);
+"""
+
+INSERT = ("INSERT OR REPLACE INTO reports (id, created_at, risk_level, probability, model_version, prediction, report) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+SUMMARY_COLUMNS = "id, created_at, risk_level, probability, model_version"
+
+# Largest page served by list_reports
+MAX_PAGE_SIZE = 500
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets readers run while the writer thread commits
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def _summary(row):
+    report_id, created_at, risk_level, probability, model_version = row
+    return {
+        'id': report_id,
+        'created_at': _iso(created_at),
+        'risk_level': risk_level,
+        'heart_disease_probability': probability,
+        'model_version': model_version
+    }
+
+
+class ReportStore:
+    """
+    SQLite report store with a write-behind insert queue.
+
+    Args:
+        path: SQLite database file
+        batch_size: Most reports inserted per transaction
+        flush_interval: Seconds the writer waits to fill a batch once it has
+            at least one report
+        max_queue: Reports allowed to wait for the writer before new ones are dropped
+        max_retries: Retries of a failed batch before its reports are dropped
+        retry_interval: Seconds before the first retry; doubled for each next one
+    """
+
+    def __init__(self, path, batch_size=256, flush_interval=0.05, max_queue=10000, max_retries=5,
+                 retry_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # id -> row, until committed
+        self._pending_lock = threading.Lock()
+        self._writer = None
+        self._local = threading.local()
+
+        # Metrics
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_retries = 0
+        self.write_errors = 0
+
+        connection = _connect(path)
+        connection.executescript(SCHEMA)
+        connection.close()
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write_loop, name='report-store-writer', daemon=True)
+        self._writer.start()
+
+    def close(self):
+        """Write every queued report and stop the writer thread"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, report_id, result, report, model_version=None):
+        """
+        Queue a report for writing without waiting on the disk
+
+        Returns:
+            False if the queue was full and the report was dropped
+        """
+        row = (
+            report_id,
+            time.time(),
+            result['prediction']['risk_level'],
+            float(result['prediction']['heart_disease_probability']),
+            model_version,
+            result,  # serialized by the writer thread
+            report
+        )
+        with self._pending_lock:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self._pending[report_id] = row
+            self.submitted += 1
+        return True
+
+    def _write_loop(self):
+        connection = _connect(self.path)
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            if row is None:
+                break
+            batch = [row]
+            # Fill the batch with whatever arrives within flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            written = len(batch) if self._insert(connection, batch) else 0
+            with self._pending_lock:
+                self.written += written
+                self.write_errors += len(batch) - written
+                self.batches += 1
+                for row in batch:
+                    if self._pending.get(row[0]) is row:
+                        del self._pending[row[0]]
+        connection.close()
+
+    def _insert(self, connection, batch):
+        """Insert a batch in one transaction, retrying failures; False once the retries are used up"""
+        rows = [row[:5] + (json.dumps(row[5]),) + row[6:] for row in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                with connection:
+                    connection.executemany(INSERT, rows)
+                return True
+            except sqlite3.Error as e:
+                if attempt == self.max_retries:
+                    print(f"Report store: failed to write {len(batch)} report(s) after {attempt + 1} attempts, "
+                          f"dropping them: {e}")
+                    return False
+                delay = self.retry_interval * 2 ** attempt
+                print(f"Report store: failed to write {len(batch)} report(s): {e}; retrying in {delay:g}s")
+                with self._pending_lock:
+                    self.write_retries += 1
+                time.sleep(delay)
+
+    def _reader(self):
+        # One read connection per thread (FastAPI runs sync endpoints on a thread pool)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = _connect(self.path)
+        return connection
+
+    def get(self, report_id):
+        """Full stored report (prediction JSON and text), or None"""
+        with self._pending_lock:
+            row = self._pending.get(report_id)
+        if row is None:
+            row = self._reader().execute(
+                f"SELECT {SUMMARY_COLUMNS}, prediction, report FROM reports WHERE id = ?", (report_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        report = _summary(row[:5])
+        report['prediction'] = row[5] if isinstance(row[5], dict) else json.loads(row[5])
+        report['report'] = row[6]
+        return report
+
+    def list_reports(self, limit=50, cursor=None, risk_level=None, since=None, until=None):
+        """
+        One page of report summaries, newest first
+
+        Args:
+            limit: Page size (at most MAX_PAGE_SIZE)
+            cursor: next_cursor of the previous page
+            risk_level: Only reports with this risk level
+            since, until: Only reports created in [since, until) (Unix timestamps)
+
+        Returns:
+            Dictionary with 'reports' and 'next_cursor' (None on the last page).
+            Pages follow the (created_at, id) index, so deep pages cost the same
+            as the first one. Reports still in the write queue are not listed.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conditions, params = [], []
+        if risk_level is not None:
+            conditions.append("risk_level = ?")
+            params.append(risk_level)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+        if cursor is not None:
+            created_at, report_id = decode_cursor(cursor)
+            conditions.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, report_id])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = self._reader().execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM reports {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return {'reports': [_summary(row) for row in rows], 'next_cursor': next_cursor}
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'write_retries': self.write_retries,
+            'write_errors': self.write_errors,
+            'batches': self.batches,
+            'mean_batch_size': self.written / self.batches if self.batches else 0.0
+        }
+
+
+def encode_cursor(created_at, report_id):
+    return f"{created_at!r}_{report_id}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    created_at, _, report_id = cursor.partition('_')
+    if not report_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return float(created_at), report_id
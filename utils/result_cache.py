@@ -0,0 +1,88 @@
+import time
+import threading
+from collections import OrderedDict
+from model.feature_info import FEATURE_INFO
+
+
+class ResultCache:
+    """
+    In-process LRU cache of prediction results with a time-to-live.
+
+    Keys are the exact feature values of a patient (as floats, in
+    FEATURE_INFO order) plus any request options that change the result.
+    The cache is tied to one model version: switching to a different
+    artifact clears it. Valid only because bootstrap noise is seeded from
+    the same exact values (see input_seed in model/predict.py), so equal
+    keys always produce equal results.
+    """
+
+    eviction_policy = "lru+ttl"
+
+    def __init__(self, max_size=10000, ttl=3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.model_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(patient_dict, *options):
+        return tuple(float(patient_dict[feature]) for feature in FEATURE_INFO) + options
+
+    def set_model_version(self, model_version):
+        """Bind the cache to a model version, dropping all entries if it changed"""
+        with self._lock:
+            if model_version != self.model_version:
+                if self._items:
+                    self.invalidations += 1
+                self._items.clear()
+                self.model_version = model_version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic(), result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model_version": self.model_version,
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "eviction_policy": self.eviction_policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,226 @@
+"""
+Streaming bulk scoring of CSV and NDJSON uploads.
+
+The request body is read incrementally, split into lines, parsed and
+validated row by row, and grouped into chunks of at most `chunk_rows`
+rows, valid or not. Each chunk is scored with one vectorized batch call while the
+next chunk is being read, and the results are written back as NDJSON as
+soon as the chunk is done. At most `prefetch` parsed chunks wait for
+scoring; when the client stops reading results the reader stops reading
+the upload, so memory use does not grow with the size of the file.
+
+Output lines, in input order:
+    {"row": 1, "result": {...}}       scored row (same fields as /predict)
+    {"row": 2, "error": "..."}        row that failed parsing or validation
+    {"summary": {...}}                last line: row, scored and error counts
+A failure that stops the stream (e.g. a missing CSV column or the
+inference workers becoming unavailable) is reported as a final
+{"error": "..."} line.
+"""
+import csv
+import json
+import asyncio
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from model.feature_info import FEATURE_INFO
+from schema import validate_patient
+
+# Upload content types and the format they are parsed as
+STREAM_FORMATS = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/json-lines': 'ndjson'
+}
+
+# Longest accepted input line
+MAX_LINE_BYTES = 64 * 1024
+
+
+class StreamAbortedError(Exception):
+    """Raised to end a stream early with a final error line"""
+
+
+class StreamFormatError(StreamAbortedError, ValueError):
+    """Raised when the upload cannot be parsed any further"""
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose content is produced while the request body is still being read.
+
+    Under ASGI spec < 2.4 Starlette listens for client disconnects by calling
+    receive(), which would swallow the body messages the content generator
+    reads. Here receive() belongs to the generator until upload_finished is
+    set (a disconnect during the upload ends the stream through
+    ClientDisconnect); only then does the response listen for disconnects.
+    """
+
+    def __init__(self, content, upload_finished, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upload_finished = upload_finished
+
+    async def listen_for_disconnect(self, receive):
+        await self.upload_finished.wait()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+
+def stream_format(content_type, requested=None):
+    """Resolve the upload format from an explicit format or the Content-Type header"""
+    if requested:
+        if requested not in ('csv', 'ndjson'):
+            raise ValueError(f"Unsupported stream format: {requested}")
+        return requested
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported content type: {media_type or 'none'} (use text/csv or application/x-ndjson)")
+    return STREAM_FORMATS[media_type]
+
+
+async def iter_lines(byte_chunks):
+    """Split an async stream of byte chunks into decoded lines"""
+    buffer = b''
+    async for data in byte_chunks:
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        if len(buffer) > MAX_LINE_BYTES:
+            raise StreamFormatError(f"Line exceeds {MAX_LINE_BYTES} bytes")
+        for line in lines:
+            yield line.decode('utf-8').rstrip('\r')
+    if buffer:
+        yield buffer.decode('utf-8').rstrip('\r')
+
+
+async def iter_records(lines, fmt):
+    """
+    Parse and validate rows
+
+    Yields:
+        (row number, patient dict or None, error message or None); rows are
+        numbered from 1, not counting the CSV header or blank lines
+    """
+    header = None
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        if fmt == 'csv':
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                missing = [feature for feature in FEATURE_INFO if feature not in header]
+                if missing:
+                    raise StreamFormatError(f"CSV header is missing columns: {', '.join(missing)}")
+                continue
+            row += 1
+            if len(values) != len(header):
+                yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            record = dict(zip(header, values))
+        else:
+            row += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield row, None, "Expected a JSON object"
+                continue
+
+        patient, error = validate_patient(record)
+        yield row, patient, error
+
+
+async def iter_chunks(records, chunk_rows):
+    """
+    Group parsed rows into chunks of up to chunk_rows rows
+
+    Invalid rows count towards the limit, so a run of them is answered as
+    it arrives instead of piling up until enough valid rows follow.
+
+    Yields:
+        Lists of (row number, patient dict or None, error message or None)
+    """
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _dumps(payload):
+    return (json.dumps(payload) + '\n').encode('utf-8')
+
+
+async def score_stream(byte_chunks, fmt, score_chunk, chunk_rows=1000, prefetch=2, upload_finished=None):
+    """
+    Score an uploaded CSV/NDJSON stream, yielding NDJSON result lines
+
+    Args:
+        byte_chunks: Async iterator over the raw request body
+        fmt: 'csv' or 'ndjson'
+        score_chunk: Coroutine function scoring a list of patient dicts and
+            returning their results in order; it may raise StreamAbortedError
+            to end the stream
+        chunk_rows: Rows (valid or not) per chunk; the valid ones are scored in one batch
+        prefetch: Parsed chunks allowed to wait for scoring
+        upload_finished: Optional asyncio.Event set once the body is no longer read
+    """
+    queue = asyncio.Queue(maxsize=prefetch)
+
+    async def read():
+        try:
+            async for chunk in iter_chunks(iter_records(iter_lines(byte_chunks), fmt), chunk_rows):
+                await queue.put(chunk)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            if upload_finished is not None:
+                upload_finished.set()
+
+    reader = asyncio.create_task(read())
+    rows = scored = errors = 0
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, ClientDisconnect):
+                return
+            if isinstance(chunk, Exception):
+                if not isinstance(chunk, (StreamFormatError, UnicodeDecodeError)):
+                    raise chunk
+                yield _dumps({"error": str(chunk)})
+                break
+
+            patients = [patient for _, patient, _ in chunk if patient is not None]
+            try:
+                results = iter(await score_chunk(patients) if patients else [])
+            except StreamAbortedError as e:
+                yield _dumps({"error": str(e)})
+                break
+            lines = []
+            for row, patient, error in chunk:
+                if patient is None:
+                    lines.append(_dumps({"row": row, "error": error}))
+                    errors += 1
+                else:
+                    lines.append(_dumps({"row": row, "result": next(results)}))
+                    scored += 1
+            rows += len(chunk)
+            yield b''.join(lines)
+
+        yield _dumps({"summary": {"rows": rows, "scored": scored, "errors": errors}})
+    finally:
+        reader.cancel()
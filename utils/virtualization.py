@@ -1,59 +1,363 @@
-import matplotlib.pyplot as plt
 import io
-import pandas as pd
+import os
+import queue
+import hmac
 import base64
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from model.feature_info import FEATURE_INFO
+from model.predict import RISK_LEVELS
+
+# Numerical features shown in the profile plot
+NUM_FEATURES = [f for f in FEATURE_INFO
+                if f not in ['sex', 'cp', 'fbs', 'restecg', 'exang', 'slope', 'ca', 'thal']]
+
+# Number of pre-built figure templates kept for reuse
+RENDER_POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", "4"))
+
+_template_pool = queue.LifoQueue(maxsize=RENDER_POOL_SIZE)
+
+
+class _ProfileTemplate:
+    """
+    Pre-built feature profile figure.
+
+    Axes, reference lines and feature-name ticks are drawn once; a render
+    only updates bar heights and colours, the title and the two text boxes.
+    Each template is owned by one thread at a time via the template pool.
+    """
+
+    def __init__(self):
+        self.figure = Figure(figsize=(12, 6))
+        FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        self.ax = ax
+
+        # Create bar plot of z-scores
+        self.bars = ax.bar(range(len(NUM_FEATURES)), [0] * len(NUM_FEATURES), color='skyblue')
+
+        # Add reference lines
+        ax.axhline(y=0, color='black', linestyle='-', alpha=0.3)
+        ax.axhline(y=1.5, color='red', linestyle='--', alpha=0.5)
+        ax.axhline(y=-1.5, color='red', linestyle='--', alpha=0.5)
+
+        # Set labels and title
+        ax.set_xticks(range(len(NUM_FEATURES)), [FEATURE_INFO[f]['name'] for f in NUM_FEATURES],
+                      rotation=45, ha='right')
+        ax.set_ylabel('Standard Deviations from Mean')
+        self.title = ax.set_title('Patient Feature Profile (Risk Level: )')
+
+        # Risk probability and reliability boxes
+        self.risk_text = ax.text(0.02, 0.95, '', transform=ax.transAxes, fontsize=12,
+                                 bbox=dict(facecolor='white', alpha=0.8))
+        self.reliability_text = ax.text(0.02, 0.89, '', transform=ax.transAxes, fontsize=12,
+                                        bbox=dict(facecolor='white', alpha=0.8))
+
+        # Fix the layout once so renders skip the extra layout draw pass
+        self.figure.tight_layout()
+        self.figure.set_layout_engine('none')
+
+    def render(self, z_values, result, fmt='png'):
+        """Draw the given z-scores and result into the template and return the encoded image bytes"""
+        for bar, z_val in zip(self.bars, z_values):
+            bar.set_height(z_val)
+            # Color bars based on abnormality
+            if abs(z_val) > 1.5:
+                bar.set_color('salmon' if z_val > 0 else 'lightgreen')
+            else:
+                bar.set_color('skyblue')
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+        self.title.set_text(f'Patient Feature Profile (Risk Level: {result["prediction"]["risk_level"]})')
+        self.risk_text.set_text(f'Heart Disease Risk: {result["prediction"]["heart_disease_probability"]:.1%}')
+        self.reliability_text.set_text(f'Prediction Reliability: {result["uncertainty"]["reliability_percent"]:.1f}%')
+
+        buf = io.BytesIO()
+        self.figure.savefig(buf, format=fmt)
+        return buf.getvalue()
+
+
+def _acquire_template():
+    try:
+        return _template_pool.get_nowait()
+    except queue.Empty:
+        return _ProfileTemplate()
+
+
+def _release_template(template):
+    try:
+        _template_pool.put_nowait(template)
+    except queue.Full:
+        pass
+
+
+def _patient_z_scores(patient_data, feature_means, feature_stds):
+    """Z-scores of the plotted numerical features"""
+    # Only the first row of a DataFrame is plotted
+    if hasattr(patient_data, 'iloc'):
+        patient_data = patient_data.iloc[0]
+
+    return [float((patient_data[f] - feature_means[f]) / feature_stds[f]) for f in NUM_FEATURES]
+
+
+def _plotted_z_scores(z_scores, feature_schema):
+    """Pick the plotted numerical features out of a z-score row in model feature order"""
+    return [float(z_scores[feature_schema.index[f]]) for f in NUM_FEATURES]
+
+
+def _render(z_values, result, fmt='png'):
+    template = _acquire_template()
+    try:
+        return template.render(z_values, result, fmt)
+    finally:
+        _release_template(template)
+
 
 def visualize_patient_data(patient_data, feature_means, feature_stds, result):
     """Create visualization of patient data relative to population norms"""
-    if not isinstance(patient_data, pd.DataFrame):
-        patient_data = pd.DataFrame([patient_data])
-    
-    # Calculate z-scores
-    z_scores = (patient_data - feature_means) / feature_stds
-    
-    # Select numerical features for visualization
-    num_features = [col for col in z_scores.columns 
-                   if col not in ['sex', 'cp', 'fbs', 'restecg', 'exang', 'slope', 'ca', 'thal']]
-    
-    # Create figure
-    plt.figure(figsize=(12, 6))
-    
-    # Create bar plot of z-scores
-    bars = plt.bar(range(len(num_features)), z_scores[num_features].iloc[0], color='skyblue')
-    
-    # Color bars based on abnormality
-    for i, feature in enumerate(num_features):
-        z_val = z_scores[feature].iloc[0]
-        if abs(z_val) > 1.5:
-            bars[i].set_color('salmon' if z_val > 0 else 'lightgreen')
-    
-    # Add reference lines
-    plt.axhline(y=0, color='black', linestyle='-', alpha=0.3)
-    plt.axhline(y=1.5, color='red', linestyle='--', alpha=0.5)
-    plt.axhline(y=-1.5, color='red', linestyle='--', alpha=0.5)
-    
-    # Set labels and title
-    plt.xticks(range(len(num_features)), [FEATURE_INFO[f]['name'] for f in num_features], rotation=45, ha='right')
-    plt.ylabel('Standard Deviations from Mean')
-    plt.title(f'Patient Feature Profile (Risk Level: {result["prediction"]["risk_level"]})')
-    
-    # Add risk probability and reliability
-    plt.text(0.02, 0.95, f'Heart Disease Risk: {result["prediction"]["heart_disease_probability"]:.1%}', 
-             transform=plt.gca().transAxes, fontsize=12, 
-             bbox=dict(facecolor='white', alpha=0.8))
-    
-    plt.text(0.02, 0.89, f'Prediction Reliability: {result["uncertainty"]["reliability_percent"]:.1f}%', 
-             transform=plt.gca().transAxes, fontsize=12, 
-             bbox=dict(facecolor='white', alpha=0.8))
-    
-    plt.tight_layout()
-    
+    image = _render(_patient_z_scores(patient_data, feature_means, feature_stds), result)
+
     # Convert plot to base64 for embedding in web applications
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
+    return base64.b64encode(image).decode('utf-8')
+
+
+def visualize_z_scores(z_scores, feature_schema, result):
+    """Same as visualize_patient_data, from z-scores already computed by the prediction"""
+    image = _render(_plotted_z_scores(z_scores, feature_schema), result)
+    return base64.b64encode(image).decode('utf-8')
+
+
+# --- On-demand rendering by opaque ID ---
+# A plot is described by its fields: the z-scores rounded to 2 decimals, the
+# risk level, the probability and the reliability. Workers compute the
+# fields; the server encrypts them into the ID of a /visualization/{id} URL,
+# so any server process sharing the key can render any ID without a store.
+# The ID is the fields packed into bytes, encrypted deterministically and
+# authenticated with HMAC-SHA256 (synthetic IV: the tag of the fields seeds
+# the keystream), so it reveals nothing about the patient, cannot be forged
+# or altered, and equal plots share an ID (and a cached image). IDs stay
+# valid as long as the key does.
+
+MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Upper bound on the total size of cached rendered images
+VISUALIZATION_CACHE_BYTES = int(os.environ.get("VISUALIZATION_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Key of the visualization IDs, shared by every server process (and host)
+# that must render them; without one, a random key is created in
+# VISUALIZATION_KEY_FILE and read by every process using that file
+VISUALIZATION_KEY = os.environ.get("VISUALIZATION_KEY", "")
+VISUALIZATION_KEY_FILE = os.environ.get("VISUALIZATION_KEY_FILE", "visualization.key")
+
+# Plotted z-scores are clamped to this many standard deviations
+MAX_PLOTTED_Z_SCORE = 100
+
+_RISK_LEVEL_NAMES = list(RISK_LEVELS.values())
+# Packed fields: z-scores, risk level index, probability, reliability
+_FIELDS_FORMAT = struct.Struct(f">{len(NUM_FEATURES)}hBHH")
+_TAG_BYTES = 16
+
+
+class _ImageCache:
+    """Thread-safe LRU cache of rendered images bounded by total byte size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = image
+            self.total_bytes += len(image)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
+_image_cache = _ImageCache(VISUALIZATION_CACHE_BYTES)
+
+
+def _read_or_create_key(path):
+    """The key in a key file, created with a random key if missing (by whichever process gets there first)"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.visualization.', suffix='.tmp', dir=directory)
+    try:
+        os.write(fd, os.urandom(32))
+        os.fsync(fd)
+        os.close(fd)
+        # link() fails if another process created the file first; its key wins
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@lru_cache(maxsize=1)
+def _keys():
+    """(encryption key, authentication key) derived from the configured key"""
+    if VISUALIZATION_KEY:
+        key = VISUALIZATION_KEY.encode()
+    else:
+        try:
+            key = _read_or_create_key(VISUALIZATION_KEY_FILE)
+        except OSError as e:
+            print(f"Cannot read or create {VISUALIZATION_KEY_FILE} ({e}); visualization IDs only resolve "
+                  f"in this process until VISUALIZATION_KEY is set")
+            key = os.urandom(32)
+    if len(key) < 16:
+        raise ValueError("The visualization key must be at least 16 bytes")
+    return (hmac.new(key, b'visualization-encrypt', hashlib.sha256).digest(),
+            hmac.new(key, b'visualization-authenticate', hashlib.sha256).digest())
+
+
+def _keystream(key, tag, length):
+    blocks = [hmac.new(key, tag + counter.to_bytes(4, 'big'), hashlib.sha256).digest()
+              for counter in range((length + 31) // 32)]
+    return b''.join(blocks)[:length]
+
+
+def visualization_fields(z_scores, feature_schema, result):
+    """
+    Describe a patient's feature profile plot as a tuple of ints
+
+    Args:
+        z_scores: The patient's z-scores in model feature order (as returned
+            by predict_heart_disease_batch with return_z_scores=True)
+        feature_schema: FeatureSchema of the model
+        result: The patient's prediction result
+    """
+    limit = MAX_PLOTTED_Z_SCORE * 100
+    fields = [min(max(round(z_val * 100), -limit), limit)
+              for z_val in _plotted_z_scores(z_scores, feature_schema)]
+    fields.append(_RISK_LEVEL_NAMES.index(result["prediction"]["risk_level"]))
+    fields.append(round(result["prediction"]["heart_disease_probability"] * 1000))
+    fields.append(round(result["uncertainty"]["reliability_percent"] * 10))
+    return tuple(fields)
+
+
+def _check_fields(fields):
+    if len(fields) != len(NUM_FEATURES) + 3 or not all(isinstance(field, int) for field in fields):
+        raise ValueError("Malformed visualization fields")
+    *z_fields, risk_index, probability, reliability = fields
+    limit = MAX_PLOTTED_Z_SCORE * 100
+    if (not all(-limit <= z_field <= limit for z_field in z_fields)
+            or not 0 <= risk_index < len(_RISK_LEVEL_NAMES)
+            or not 0 <= probability <= 1000 or not 0 <= reliability <= 1000):
+        raise ValueError("Visualization fields out of range")
+
+
+def encode_visualization(fields):
+    """
+    Opaque ID carrying a plot's fields, renderable by any process sharing the key
+
+    Args:
+        fields: Plot fields returned by visualization_fields()
+
+    Returns:
+        The visualization ID
+
+    Raises:
+        ValueError: If the fields are malformed or out of range
+    """
+    fields = tuple(fields)
+    _check_fields(fields)
+    encryption_key, authentication_key = _keys()
+    plaintext = _FIELDS_FORMAT.pack(*fields)
+    tag = hmac.new(authentication_key, plaintext, hashlib.sha256).digest()[:_TAG_BYTES]
+    ciphertext = bytes(a ^ b for a, b in zip(plaintext, _keystream(encryption_key, tag, len(plaintext))))
+    return base64.urlsafe_b64encode(tag + ciphertext).decode('ascii').rstrip('=')
+
+
+def decode_visualization(visualization_id):
+    """
+    Plot fields carried by a visualization ID
+
+    Raises:
+        ValueError: If the ID was not issued under the current key
+    """
+    try:
+        token = base64.urlsafe_b64decode(visualization_id + '=' * (-len(visualization_id) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid visualization ID")
+    if len(token) != _TAG_BYTES + _FIELDS_FORMAT.size:
+        raise ValueError("Invalid visualization ID")
+    encryption_key, authentication_key = _keys()
+    tag, ciphertext = token[:_TAG_BYTES], token[_TAG_BYTES:]
+    plaintext = bytes(a ^ b for a, b in zip(ciphertext, _keystream(encryption_key, tag, len(ciphertext))))
+    if not hmac.compare_digest(tag, hmac.new(authentication_key, plaintext, hashlib.sha256).digest()[:_TAG_BYTES]):
+        raise ValueError("Invalid visualization ID")
+    fields = _FIELDS_FORMAT.unpack(plaintext)
+    _check_fields(fields)
+    return fields
+
+
+def visualization_id(z_scores, feature_schema, result):
+    """Opaque ID of a patient's plot (e.g. to name image files)"""
+    return encode_visualization(visualization_fields(z_scores, feature_schema, result))
+
+
+def _plot_inputs(fields):
+    *z_fields, risk_index, probability, reliability = fields
+    z_values = [z_field / 100 for z_field in z_fields]
+    result = {
+        "prediction": {
+            "risk_level": _RISK_LEVEL_NAMES[risk_index],
+            "heart_disease_probability": probability / 1000
+        },
+        "uncertainty": {"reliability_percent": reliability / 10}
+    }
+    return z_values, result
+
+
+def render_visualization(visualization_id, fmt='png'):
+    """
+    Render (or fetch from cache) the plot behind a visualization ID
     
-    return img_str
\ No newline at end of file
+    Args:
+        visualization_id: ID returned by encode_visualization()
+        fmt: 'png' or 'svg'
+        
+    Returns:
+        Encoded image bytes
+        
+    Raises:
+        ValueError: If the ID is invalid, or the format is unsupported
+    """
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported image format: {fmt}")
+
+    fields = decode_visualization(visualization_id)
+    key = (visualization_id, fmt)
+    image = _image_cache.get(key)
+    if image is None:
+        z_values, result = _plot_inputs(fields)
+        image = _render(z_values, result, fmt)
+        _image_cache.put(key, image)
+    return image